@@ -116,6 +116,7 @@ function Account($filter, $http, $q, $resource, HLResource, HLUtils, HLCache,
 
                     return {
                         objects: objects,
+                        pagination: jsonData ? jsonData.pagination : null,
                     };
                 },
             },
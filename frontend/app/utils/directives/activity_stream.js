@@ -106,6 +106,25 @@ function ActivityStreamDirective($filter, $q, $state, Account, Case, Change, Con
                 loadMore();
             }
 
+            function _getCalls(getCalls, id, length) {
+                // Calls are paginated newest first, so fetch pages until there are enough calls for the stream.
+                let calls = [];
+
+                function getPage(pageNumber) {
+                    return getCalls({id: id, page: pageNumber}).$promise.then(results => {
+                        calls = calls.concat(results.objects);
+
+                        if (results.pagination && results.pagination.next_page && calls.length < length) {
+                            return getPage(pageNumber + 1);
+                        }
+
+                        return {objects: calls};
+                    });
+                }
+
+                return getPage(1);
+            }
+
             function _fetchActivity(obj) {
                 var activity = [];
                 var promises = [];
@@ -407,9 +426,9 @@ function ActivityStreamDirective($filter, $q, $state, Account, Case, Change, Con
                     });
 
                     if (contentType === 'account') {
-                        callPromise = Account.getCalls({id: currentObject.id}).$promise;
+                        callPromise = _getCalls(Account.getCalls, currentObject.id, requestLength);
                     } else {
-                        callPromise = Contact.getCalls({id: currentObject.id}).$promise;
+                        callPromise = _getCalls(Contact.getCalls, currentObject.id, requestLength);
                     }
 
                     // Add promise to list of all promises for later handling.
@@ -16,6 +16,7 @@ from lily.utils.api.serializers import (RelatedAddressSerializer, RelatedEmailAd
                                         RelatedPhoneNumberSerializer, RelatedTagSerializer)
 
 from ..models import Account, Website, AccountStatus
+from ..search import AccountMapping
 from .validators import DuplicateAccountName, HostnameValidator
 
 
@@ -108,6 +109,13 @@ class AccountSerializer(PhoneNumberFormatMixin, WritableNestedSerializer):
 
         return instance
 
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """
+        Fetch the related objects of the serialized accounts with a constant number of queries.
+        """
+        return AccountMapping.prepare_batch(queryset).select_related('status').prefetch_related('contacts')
+
     class Meta:
         model = Account
         fields = (
@@ -1,12 +1,25 @@
+from urllib import urlencode
+
+from mock import patch
+from rest_framework import status
+from rest_framework.reverse import reverse
+
+from lily.calls.factories import CallFactory
+from lily.calls.models import Call
+from lily.contacts.factories import FunctionFactory
+from lily.socialmedia.factories import SocialMediaFactory
+from lily.tags.factories import TagFactory
 from lily.tenant.factories import TenantFactory
-from lily.tests.utils import GenericAPITestCase
+from lily.tenant.middleware import set_current_user
+from lily.tests.utils import GenericAPITestCase, ListQueryCountMixin
+from lily.utils.models.factories import AddressFactory, EmailAddressFactory, PhoneNumberFactory
 
 from ..factories import AccountFactory, AccountStatusFactory, WebsiteFactory
 from ..models import Account
 from .serializers import AccountSerializer
 
 
-class AccountTests(GenericAPITestCase):
+class AccountTests(ListQueryCountMixin, GenericAPITestCase):
     """
     Class containing tests for the accounts API.
 
@@ -29,6 +42,14 @@ class AccountTests(GenericAPITestCase):
 
         return data
 
+    def _create_list_object(self, tenant):
+        account = AccountFactory.create(tenant=tenant, assigned_to=self.user_obj)
+        account.email_addresses.add(EmailAddressFactory(tenant=tenant))
+        account.addresses.add(AddressFactory(tenant=tenant))
+        account.social_media.add(SocialMediaFactory(tenant=tenant))
+        TagFactory.create_batch(size=2, tenant=tenant, subject=account)
+        FunctionFactory.create_batch(size=2, tenant=tenant, account=account)
+
     def _create_object_stub(self, with_relations=True, size=1, **kwargs):
         """
         Create an object dict with relation dicts using factories.
@@ -86,3 +107,61 @@ class AccountTests(GenericAPITestCase):
                 [item['id'] for item in request.data.get(field_name)],
                 '%s %s -was- deleted while it should have been.' % (field_name, object_list[1].pk)
             )
+
+    @patch('lily.api.filters.LilySearch')
+    def test_search_paginated_in_index(self, search_mock):
+        """
+        Test that a search is paginated by the index, with the order and total of the search results.
+        """
+        accounts = self._create_object(size=3)
+        search_mock.return_value.do_search.return_value = (
+            [{'id': accounts[2].pk}, {'id': accounts[0].pk}], None, 42, 1
+        )
+
+        request = self.user.get('%s?%s' % (reverse(self.list_url), urlencode({
+            'search': 'name:test',
+            'ordering': '-id',
+            'page': 2,
+            'page_size': 2,
+        })))
+
+        self.assertStatus(request, status.HTTP_200_OK)
+        self.assertEqual(search_mock.call_args[1]['sort'], ['-id'])
+        self.assertEqual(search_mock.call_args[1]['page'], 1)
+        self.assertEqual(search_mock.call_args[1]['size'], 2)
+        self.assertEqual([obj['id'] for obj in request.data['results']], [accounts[2].pk, accounts[0].pk])
+        self.assertEqual(request.data['pagination']['total'], 42)
+        self.assertEqual(request.data['pagination']['number_of_pages'], 21)
+
+    def test_calls(self):
+        """
+        Test that the calls of the account and its contacts are listed newest first with the names of their owners.
+        """
+        set_current_user(self.user_obj)
+        tenant = self.user_obj.tenant
+        account = self._create_object()
+        contact = FunctionFactory(tenant=tenant, account=account).contact
+        contact_number = PhoneNumberFactory(tenant=tenant)
+        contact.phone_numbers.add(contact_number)
+
+        self.user_obj.internal_number = 201
+        self.user_obj.save()
+
+        call_kwargs = {'tenant': tenant, 'status': Call.ANSWERED, 'type': Call.INBOUND}
+        account_number = account.phone_numbers.first()
+        account_call = CallFactory(caller_number=account_number.number, internal_number=201, **call_kwargs)
+        contact_call = CallFactory(caller_number=contact_number.number, internal_number=999, **call_kwargs)
+        CallFactory(caller_number=contact_number.number, tenant=tenant, status=Call.RINGING, type=Call.INBOUND)
+
+        request = self.user.get(reverse('account-calls', kwargs={'pk': account.pk}))
+
+        self.assertStatus(request, status.HTTP_200_OK)
+        calls = request.data['objects']
+        self.assertEqual([call['id'] for call in calls], [contact_call.pk, account_call.pk])
+        self.assertEqual(calls[0]['contact'], contact.full_name)
+        self.assertNotIn('account', calls[0])
+        self.assertNotIn('user', calls[0])
+        self.assertEqual(calls[1]['account'], account.name)
+        self.assertEqual(calls[1]['contact'], contact.full_name)
+        self.assertEqual(calls[1]['user'], self.user_obj.full_name)
+        self.assertEqual(request.data['pagination']['total'], 2)
@@ -2,13 +2,13 @@ from django_filters import FilterSet
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.decorators import detail_route
 from rest_framework.filters import OrderingFilter
-from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
 from lily.api.filters import ElasticSearchFilter
-from lily.api.mixins import ModelChangesMixin
+from lily.api.mixins import EagerLoadingMixin, ModelChangesMixin, SearchSourceListMixin
 from lily.calls.api.serializers import CallSerializer
 from lily.calls.models import Call
+from lily.contacts.models import Contact
 from lily.users.models import LilyUser
 
 from .serializers import AccountSerializer, AccountStatusSerializer
@@ -43,7 +43,7 @@ class AccountFilter(FilterSet):
         }
 
 
-class AccountViewSet(ModelChangesMixin, ModelViewSet):
+class AccountViewSet(ModelChangesMixin, SearchSourceListMixin, EagerLoadingMixin, ModelViewSet):
     """
     Returns a list of all **active** accounts in the system.
 
@@ -65,6 +65,8 @@ class AccountViewSet(ModelChangesMixin, ModelViewSet):
 
     # ElasticSearchFilter: set the model type.
     model_type = 'accounts_account'
+    # ElasticSearchFilter: set the fields the search index can sort on, to paginate in the index.
+    search_ordering_fields = ('id', )
     # OrderingFilter: set all possible fields to order by.
     ordering_fields = ('id', )
     # OrderingFilter: set the default ordering fields.
@@ -85,78 +87,58 @@ class AccountViewSet(ModelChangesMixin, ModelViewSet):
     @detail_route(methods=['GET'])
     def calls(self, request, pk=None):
         """
-        Gets the calls for the given contact.
+        Gets the calls from the phone numbers of the account and its contacts, newest first and paginated.
         """
-        account_phone_numbers = []
-        calls = []
         account = self.get_object()
-        contacts = account.get_contacts()
-        tenant = self.request.user.tenant
+        contacts = list(Contact.objects.filter(
+            functions__account=account,
+            functions__is_deleted=False,
+            is_deleted=False,
+        ).distinct().prefetch_related('phone_numbers'))
 
-        # Get calls made from a phone number which belongs to the account.
-        for number in account.phone_numbers.all():
-            account_phone_numbers.append(number.number)
-
-        call_objects = Call.objects.filter(
-            status=Call.ANSWERED,
-            type=Call.INBOUND,
-            caller_number__in=account_phone_numbers,
-            created__isnull=False,
-        )
-
-        if call_objects:
-            calls = CallSerializer(call_objects, many=True).data
-
-            for call in calls:
-                call['account'] = account.name
-
-                if len(contacts) == 1:
-                    call['contact'] = contacts[0].full_name
+        # Map every phone number to the names of its owners once, instead of per call.
+        owners = {}
 
-                user = LilyUser.objects.filter(internal_number=call.get('internal_number'), tenant=tenant).first()
+        for number in account.phone_numbers.all():
+            owners[number.number] = {'account': account.name}
 
-                if user:
-                    call['user'] = user.full_name
+            if len(contacts) == 1:
+                owners[number.number]['contact'] = contacts[0].full_name
 
-        # Get calls for every phone number of every contact in an account.
         for contact in contacts:
-            contact_phone_numbers = []
-
             for number in contact.phone_numbers.all():
-                contact_phone_numbers.append(number.number)
-
-            call_objects = Call.objects.filter(
-                status=Call.ANSWERED,
-                type=Call.INBOUND,
-                caller_number__in=contact_phone_numbers,
-                created__isnull=False,
-            )
+                owners.setdefault(number.number, {})['contact'] = contact.full_name
 
-            if call_objects:
-                contact_calls = CallSerializer(call_objects, many=True).data
-
-                for call in contact_calls:
-                    add_call = True
+        call_objects = Call.objects.filter(
+            status=Call.ANSWERED,
+            type=Call.INBOUND,
+            caller_number__in=owners.keys(),
+            created__isnull=False,
+        ).order_by('-created', '-id')
 
-                    for account_call in calls:
-                        if call.get('id') == account_call.get('id'):
-                            add_call = False
-                            account_call['contact'] = contact.full_name
+        page = self.paginate_queryset(call_objects)
+        calls = CallSerializer(page, many=True).data
 
-                    if add_call:
-                        call['contact'] = contact.full_name
+        # Fetch the users that answered the calls of the page at once.
+        internal_numbers = set(
+            int(call['internal_number']) for call in calls if call['internal_number'].isdigit()
+        )
+        users = dict(
+            (str(user.internal_number), user.full_name)
+            for user in LilyUser.objects.filter(tenant=request.user.tenant, internal_number__in=internal_numbers)
+        )
 
-                        user = LilyUser.objects.filter(
-                            internal_number=call.get('internal_number'),
-                            tenant=tenant,
-                        ).first()
+        for call in calls:
+            call.update(owners[call['caller_number']])
 
-                        if user:
-                            call['user'] = user.full_name
+            if call['internal_number'] in users:
+                call['user'] = users[call['internal_number']]
 
-                        calls.append(call)
+        response = self.get_paginated_response(calls)
+        # Keep the objects key the activity stream reads.
+        response.data['objects'] = response.data.pop('results')
 
-        return Response({'objects': calls})
+        return response
 
 
 class AccountStatusViewSet(ModelViewSet):
@@ -94,14 +94,18 @@ class ExportAccountView(ExportListViewMixin, View):
                 result = value
         return result
 
-    # ExportListViewMixin
-    def get_items(self):
+    def get_search(self, size=10):
         search = LilySearch(
             tenant_id=self.request.user.tenant_id,
             model_type='accounts_account',
-            page=0,
-            size=1000000000,
+            size=size,
         )
+
         if self.request.GET.get('export_filter'):
             search.query_common_fields(self.request.GET.get('export_filter'))
-        return search.do_search()[0]
+        return search
+
+    # ExportListViewMixin
+    def get_items(self):
+        # Scroll through the results, instead of fetching them all at once.
+        return self.get_search().scan()
@@ -3,16 +3,33 @@ import hmac
 
 from django.utils.translation import ugettext_lazy as _
 from rest_framework.authentication import BaseAuthentication, SessionAuthentication, TokenAuthentication
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied
 
 from lily.deals.models import Deal
 from lily.integrations.credentials import get_credentials
+from lily.users import auth_cache
 from lily.users.models import LilyUser
 from lily.tenant.middleware import set_current_user
 from lily.utils.functions import has_required_tier
 
 
-class TokenGETAuthentication(TokenAuthentication):
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that looks up the token in the auth cache, see lily.users.auth_cache.
+    """
+    def authenticate_credentials(self, key):
+        token = auth_cache.get_token(key)
+
+        if token is None:
+            raise AuthenticationFailed(_('Invalid token.'))
+
+        if not token.user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (token.user, token)
+
+
+class TokenGETAuthentication(CachedTokenAuthentication):
     """
     Allows for token authentication based on the GET parameter.
     """
@@ -25,15 +42,15 @@ class TokenGETAuthentication(TokenAuthentication):
 
 
 class LilyApiAuthentication(BaseAuthentication):
-    authenticators = (SessionAuthentication, TokenAuthentication, TokenGETAuthentication)
+    # The authenticators don't keep state, so they're shared by all requests.
+    authenticators = (SessionAuthentication(), CachedTokenAuthentication(), TokenGETAuthentication())
 
     def authenticate(self, request):
-        for authenticator_cls in self.authenticators:
-            authenticator = authenticator_cls()
-
+        for authenticator in self.authenticators:
             auth_tuple = authenticator.authenticate(request)
             if auth_tuple:
-                if isinstance(authenticator, TokenAuthentication) or isinstance(authenticator, TokenGETAuthentication):
+                if isinstance(authenticator, TokenAuthentication):
+                    # The cached token has the tenant's plan loaded, so this doesn't query the database.
                     if not has_required_tier(2, tenant=auth_tuple[0].tenant):
                         # Tenant is on free plan, so no external API access.
                         raise PermissionDenied({
@@ -4,11 +4,47 @@ from rest_framework import pagination
 from rest_framework.response import Response
 
 
+class SearchResultsPage(object):
+    """
+    Stand in for all search results when paginating, of which only the rows of the requested page are known.
+    """
+    def __init__(self, rows, total):
+        self.rows = rows
+        self.total = total
+
+    def count(self):
+        return self.total
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, key):
+        # The paginator only slices the requested page, which are the rows.
+        return self.rows
+
+
 class CustomPagination(pagination.PageNumberPagination):
     page_size = 100  # The default page size.
     page_size_query_param = 'page_size'  # The query param used to custom define a page size per request.
     max_page_size = 200  # The hard limit for page size.
 
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Paginate with the total of the search when ElasticSearchFilter fetched just the page, in the order of the hits.
+        """
+        search_results = getattr(request, 'search_results', None)
+
+        if search_results is not None:
+            if search_results.from_source:
+                rows = search_results.hits
+            else:
+                objects = dict((obj.pk, obj) for obj in queryset)
+                rows = [objects[pk] for pk in search_results.ids if pk in objects]
+
+            queryset = SearchResultsPage(rows, search_results.total)
+
+        return super(CustomPagination, self).paginate_queryset(queryset, request, view)
+
     def get_paginated_response(self, data):
         return Response(OrderedDict([
             ('pagination', OrderedDict([
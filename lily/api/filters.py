@@ -1,11 +1,30 @@
+from django.conf import settings
 from rest_framework.filters import BaseFilterBackend
 from rest_framework.settings import api_settings
 from lily.search.lily_search import LilySearch
 
 
+class SearchResults(object):
+    """
+    The page of search results a request is paginated with, see CustomPagination.
+    """
+    def __init__(self, hits, total, page_number, page_size, from_source=False):
+        self.hits = hits
+        self.ids = [hit['id'] for hit in hits]
+        self.total = total
+        self.page_number = page_number
+        self.page_size = page_size
+        # Whether the hits are the rows of the page, instead of the objects with their ids.
+        self.from_source = from_source
+
+
 class ElasticSearchFilter(BaseFilterBackend):
     # The URL query parameter used for the search.
     search_param = api_settings.SEARCH_PARAM
+    # The URL query parameter used for ordering, the same one OrderingFilter uses.
+    ordering_param = api_settings.ORDERING_PARAM
+    # The URL query parameter to serve the rows from the search index, for views with serve_search_source set.
+    source_param = 'source'
 
     def get_search_terms(self, request):
         """
@@ -17,6 +36,54 @@ class ElasticSearchFilter(BaseFilterBackend):
             return params.split(',')
         return None
 
+    def get_search_ordering(self, request, view):
+        """
+        Return the ordering of the request as search sort options, or None if the index can't sort that way.
+
+        Only fields in the view's search_ordering_fields are sortable in the index, analyzed strings aren't.
+        """
+        params = request.query_params.get(self.ordering_param)
+        if params:
+            ordering = [param.strip() for param in params.split(',') if param.strip()]
+        else:
+            ordering = list(getattr(view, 'ordering', None) or [])
+
+        sortable_fields = getattr(view, 'search_ordering_fields', ('id', ))
+        if any(field.lstrip('-') not in sortable_fields for field in ordering):
+            return None
+
+        # Sort on id last, so every object is on exactly one page.
+        if not any(field.lstrip('-') == 'id' for field in ordering):
+            ordering.append('id')
+
+        return ordering
+
+    def get_page(self, request, view):
+        """
+        Return the page number and size if the search can be paginated in the index, otherwise None.
+        """
+        paginator = getattr(view, 'paginator', None)
+        if paginator is None or 'limit' in request.query_params:
+            return None
+
+        # Any other parameter filters the queryset further, so the search results aren't the rows of a page.
+        params = set([
+            self.search_param, self.ordering_param, self.source_param, paginator.page_query_param,
+            paginator.page_size_query_param, api_settings.URL_FORMAT_OVERRIDE,
+        ])
+        if any(param not in params for param in request.query_params):
+            return None
+
+        try:
+            page_number = int(request.query_params.get(paginator.page_query_param, 1))
+        except ValueError:
+            return None
+
+        if page_number < 1:
+            return None
+
+        return page_number, paginator.get_page_size(request)
+
     def filter_queryset(self, request, queryset, view):
         model_type = getattr(view, 'model_type', None)
 
@@ -28,19 +95,45 @@ class ElasticSearchFilter(BaseFilterBackend):
         if not search_terms:
             return queryset
 
-        if 'limit' in request.query_params:
-            limit = request.query_params['limit']
+        page = self.get_page(request, view)
+        ordering = self.get_search_ordering(request, view)
 
-            search = LilySearch(
-                tenant_id=request.user.tenant_id,
-                model_type=model_type,
-                size=int(limit),
+        if page and ordering:
+            # Let the search paginate, so only the objects of the page are fetched.
+            page_number, page_size = page
+            from_source = (
+                getattr(view, 'serve_search_source', False) and
+                request.query_params.get(self.source_param, '').lower() == 'true'
             )
-        else:
+
             search = LilySearch(
                 tenant_id=request.user.tenant_id,
                 model_type=model_type,
+                sort=ordering,
+                page=page_number - 1,
+                size=page_size,
             )
+            search.filter_query(' AND '.join(search_terms))
+            hits, facets, total, took = search.do_search(None if from_source else ['id'])
+
+            request.search_results = SearchResults(hits, total, page_number, page_size, from_source)
+
+            if from_source:
+                return queryset.none()
+
+            return queryset.filter(id__in=request.search_results.ids)
+
+        if 'limit' in request.query_params:
+            size = int(request.query_params['limit'])
+        else:
+            # The queryset is paginated afterwards, so all matching objects are needed.
+            size = settings.ES_SEARCH_FILTER_MAX_RESULTS
+
+        search = LilySearch(
+            tenant_id=request.user.tenant_id,
+            model_type=model_type,
+            size=size,
+        )
 
         search.filter_query(' AND '.join(search_terms))
         ids = [result['id'] for result in search.do_search(['id'])[0]]
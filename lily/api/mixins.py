@@ -203,6 +203,47 @@ class ModelChangesMixin(object):
         return Response({'objects': changes})
 
 
+class EagerLoadingMixin(object):
+    """
+    Fetch the related objects of listed and retrieved objects up front, with the setup_eager_loading of the serializer.
+    """
+    eager_loading_actions = ('list', 'retrieve', )
+
+    def get_queryset(self):
+        queryset = super(EagerLoadingMixin, self).get_queryset()
+        serializer_class = self.get_serializer_class()
+
+        if getattr(self, 'action', None) in self.eager_loading_actions and \
+                hasattr(serializer_class, 'setup_eager_loading'):
+            queryset = serializer_class.setup_eager_loading(queryset)
+
+        return queryset
+
+
+class SearchSourceListMixin(object):
+    """
+    Serve list pages straight from the search index with ?search=...&source=true, without querying the database.
+
+    The rows are the indexed documents instead of serialized objects, see ElasticSearchFilter.
+    """
+    serve_search_source = True
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            search_results = getattr(request, 'search_results', None)
+            if search_results is not None and search_results.from_source:
+                return self.get_paginated_response(page)
+
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+
 class PhoneNumberFormatMixin(object):
     def get_country(self, instance):
         country = None
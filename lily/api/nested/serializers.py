@@ -1,6 +1,3 @@
-import json
-import grequests
-
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
@@ -11,6 +8,8 @@ from rest_framework.fields import empty
 from rest_framework.serializers import SerializerMetaclass
 
 from lily.api.mixins import ValidateEverythingSimultaneouslyMixin
+from lily.utils.tasks import deliver_webhook_events
+from lily.utils.webhooks import record_webhook_event
 
 
 def is_dirty(instance, data):
@@ -194,7 +193,11 @@ class WritableNestedSerializer(ValidateEverythingSimultaneouslyMixin, serializer
             # Save the reverse many to manys with a through model.
             self.save_many_to_many_through_reverse_fields()
 
-        self.call_webhook(validated_data, self.instance)
+            # Record the webhook event in the same transaction, so it's only sent for committed changes.
+            webhook_event = self.call_webhook(validated_data, self.instance)
+
+        if webhook_event:
+            deliver_webhook_events.delay(webhook_event.webhook_id)
 
         return self.instance
 
@@ -229,7 +232,11 @@ class WritableNestedSerializer(ValidateEverythingSimultaneouslyMixin, serializer
             # Save the reverse many to manys with a through model.
             self.save_many_to_many_through_reverse_fields(cleanup=True)
 
-        self.call_webhook(validated_data, self.instance)
+            # Record the webhook event in the same transaction, so it's only sent for committed changes.
+            webhook_event = self.call_webhook(validated_data, self.instance)
+
+        if webhook_event:
+            deliver_webhook_events.delay(webhook_event.webhook_id)
 
         return self.instance
 
@@ -363,6 +370,12 @@ class WritableNestedSerializer(ValidateEverythingSimultaneouslyMixin, serializer
             raise NotImplementedError('many_to_many_through_reverse_fields are not supported yet.')
 
     def call_webhook(self, original_validated_data, instance=None):
+        """
+        Record an event for the webhook of the user, which is posted to it asynchronously.
+
+        Returns:
+            WebhookEvent: the recorded event, or None if there is no webhook for this change
+        """
         user = self.context.get('request').user
         # Get the webhook of the user.
         webhook = user.webhooks.first()
@@ -392,19 +405,7 @@ class WritableNestedSerializer(ValidateEverythingSimultaneouslyMixin, serializer
                     'event': 'update',
                 }
 
-            data = json.dumps(data, sort_keys=True, default=lambda x: str(x))
-
-            headers = {
-                'Content-Type': 'application/json',
-            }
-
-            webhook_calls = (grequests.post(wh.url, data=data, headers=headers) for wh in [webhook])
-
-            try:
-                # User has a webhook set, so post the data to the given URL.
-                grequests.map(webhook_calls)
-            except:
-                pass
+            return record_webhook_event(webhook, data)
 
 
 class WritableNestedListSerializer(serializers.ListSerializer):
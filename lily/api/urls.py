@@ -13,7 +13,7 @@ from lily.integrations.api.views import (DocumentDetails, EstimatesList, Integra
                                          PandaDocList, DocumentEventList, DocumentEventCatch, PandaDocSharedKey)
 from lily.messaging.email.api.views import (EmailLabelViewSet, EmailAccountViewSet, EmailMessageViewSet,
                                             EmailTemplateFolderViewSet, EmailTemplateViewSet, SharedEmailConfigViewSet,
-                                            TemplateVariableViewSet)
+                                            TemplateVariableViewSet, GmailPushNotification)
 from lily.notes.api.views import NoteViewSet
 from lily.provide.api.views import DataproviderView
 from lily.tenant.api.views import TenantViewSet
@@ -66,6 +66,8 @@ urlpatterns = [
 
     url(r'^deals/nextsteps/$', DealNextStepList.as_view()),
 
+    url(r'^messaging/email/push/$', GmailPushNotification.as_view()),
+
     url(r'integrations/auth/(?P<integration_type>[a-z]+)$', IntegrationAuth.as_view()),
     url(r'integrations/documents/events/catch/$', DocumentEventCatch.as_view()),
     url(r'integrations/documents/events/shared-key/$', PandaDocSharedKey.as_view()),
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calls', '0004_call_created'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='call',
+            index_together=set([('caller_number', 'created')]),
+        ),
+    ]
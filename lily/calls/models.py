@@ -40,7 +40,13 @@ class Call(TenantMixin):
         """
         Return the content type (Django model) for this model.
         """
-        return ContentType.objects.get(app_label='calls', model='call')
+        return ContentType.objects.get_for_model(self)
 
     def __unicode__(self):
         return '%s: Call from %s to %s' % (self.unique_id, self.caller_number, self.called_number)
+
+    class Meta:
+        # The call history of accounts and contacts is looked up by number, newest first.
+        index_together = [
+            ['caller_number', 'created'],
+        ]
@@ -1,6 +1,7 @@
 import anyjson
 
 from channels import Group
+from django.db.models import Prefetch
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers
 
@@ -12,9 +13,11 @@ from lily.api.serializers import ContentTypeSerializer
 from lily.contacts.api.serializers import RelatedContactSerializer
 from lily.contacts.models import Function
 from lily.users.api.serializers import RelatedLilyUserSerializer, RelatedTeamSerializer
+from lily.users.models import LilyUser
 from lily.utils.api.serializers import RelatedTagSerializer
 
 from ..models import Case, CaseStatus, CaseType
+from ..search import CaseMapping
 
 
 class CaseStatusSerializer(serializers.ModelSerializer):
@@ -168,6 +171,24 @@ class CaseSerializer(WritableNestedSerializer):
 
         return super(CaseSerializer, self).update(instance, validated_data)
 
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """
+        Fetch the related objects of the serialized cases with a constant number of queries.
+        """
+        return CaseMapping.prepare_batch(queryset).select_related('created_by').prefetch_related(
+            'account__status',
+            'account__email_addresses',
+            'account__phone_numbers',
+            'account__addresses',
+            'contact__functions',
+            Prefetch(
+                'assigned_to_teams__user_set',
+                queryset=LilyUser.objects.filter(is_active=True),
+                to_attr='prefetched_active_users'
+            ),
+        )
+
     class Meta:
         model = Case
         fields = (
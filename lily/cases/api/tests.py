@@ -2,12 +2,13 @@ from lily.accounts.factories import AccountFactory
 from lily.cases.api.serializers import CaseSerializer
 from lily.cases.factories import CaseFactory, CaseStatusFactory, CaseTypeFactory
 from lily.cases.models import Case
-from lily.contacts.factories import ContactFactory
-from lily.tests.utils import GenericAPITestCase
-from lily.users.factories import LilyUserFactory
+from lily.contacts.factories import ContactFactory, FunctionFactory
+from lily.tags.factories import TagFactory
+from lily.tests.utils import GenericAPITestCase, ListQueryCountMixin
+from lily.users.factories import LilyUserFactory, TeamFactory
 
 
-class CaseTests(GenericAPITestCase):
+class CaseTests(ListQueryCountMixin, GenericAPITestCase):
     """
     Class containing tests for the case API.
 
@@ -20,6 +21,14 @@ class CaseTests(GenericAPITestCase):
     model_cls = Case
     serializer_cls = CaseSerializer
 
+    def _create_list_object(self, tenant):
+        function = FunctionFactory.create(tenant=tenant)
+        team = TeamFactory.create(tenant=tenant)
+        LilyUserFactory.create(tenant=tenant).teams.add(team)
+
+        case = CaseFactory.create(tenant=tenant, account=function.account, contact=function.contact, teams=team)
+        TagFactory.create_batch(size=2, tenant=tenant, subject=case)
+
     def _create_object_stub(self, with_relations=False, size=1, **kwargs):
         """
         Create an object dict with relation dicts using factories.
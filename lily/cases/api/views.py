@@ -6,7 +6,7 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from lily.api.filters import ElasticSearchFilter
-from lily.api.mixins import ModelChangesMixin
+from lily.api.mixins import EagerLoadingMixin, ModelChangesMixin, SearchSourceListMixin
 
 from .serializers import CaseSerializer, CaseStatusSerializer, CaseTypeSerializer
 from ..models import Case, CaseStatus, CaseType
@@ -45,7 +45,7 @@ class CaseFilter(FilterSet):
         fields = ['type', 'status', 'not_type', 'not_status', ]
 
 
-class CaseViewSet(ModelChangesMixin, viewsets.ModelViewSet):
+class CaseViewSet(ModelChangesMixin, SearchSourceListMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     """
     Returns a list of all **active** cases in the system.
 
@@ -82,6 +82,8 @@ class CaseViewSet(ModelChangesMixin, viewsets.ModelViewSet):
 
     # ElasticSearchFilter: set the model type.
     model_type = 'cases_case'
+    # ElasticSearchFilter: set the fields the search index can sort on, to paginate in the index.
+    search_ordering_fields = ('id', 'created', 'modified', 'priority', )
     # OrderingFilter: set all possible fields to order by.
     ordering_fields = ('id', 'created', 'modified', 'priority', 'subject',)
     # OrderingFilter: set the default ordering fields.
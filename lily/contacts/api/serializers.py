@@ -1,8 +1,10 @@
 from django.conf import settings
+from django.db.models import Prefetch
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers
 
 from lily.accounts.api.serializers import RelatedAccountSerializer
+from lily.accounts.models import Account
 from lily.api.fields import SanitizedHtmlCharField
 from lily.api.nested.mixins import RelatedSerializerMixin
 from lily.api.nested.serializers import WritableNestedSerializer
@@ -15,6 +17,7 @@ from lily.utils.api.serializers import (RelatedPhoneNumberSerializer, RelatedAdd
 from lily.utils.functions import send_get_request, send_post_request, has_required_tier
 
 from ..models import Contact, Function
+from ..search import ContactMapping
 
 
 class FunctionSerializer(serializers.ModelSerializer):
@@ -58,6 +61,18 @@ class ContactSerializer(PhoneNumberFormatMixin, WritableNestedSerializer):
     gender_display = serializers.CharField(source='get_gender_display', read_only=True)
     salutation_display = serializers.CharField(source='get_salutation_display', read_only=True)
 
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """
+        Fetch the related objects of the serialized contacts with a constant number of queries.
+        """
+        return ContactMapping.prepare_batch(queryset).prefetch_related(
+            Prefetch('accounts', queryset=Account.objects.select_related('status')),
+            'accounts__email_addresses',
+            'accounts__phone_numbers',
+            'accounts__addresses',
+        )
+
     class Meta:
         model = Contact
         fields = (
@@ -7,11 +7,11 @@ from lily.contacts.factories import ContactFactory, FunctionFactory
 from lily.contacts.models import Contact
 from lily.socialmedia.factories import SocialMediaFactory
 from lily.tags.factories import TagFactory
-from lily.tests.utils import GenericAPITestCase
+from lily.tests.utils import GenericAPITestCase, ListQueryCountMixin
 from lily.utils.models.factories import PhoneNumberFactory, EmailAddressFactory, AddressFactory
 
 
-class ContactTests(GenericAPITestCase):
+class ContactTests(ListQueryCountMixin, GenericAPITestCase):
     """
     Class containing tests for the contact API.
 
@@ -50,6 +50,12 @@ class ContactTests(GenericAPITestCase):
             # If required size is 1, just give the object instead of a list.
             return object_list[0]
 
+    def _create_list_object(self, tenant):
+        contact = self._create_object(with_relations=True, tenant=tenant)
+        for function in contact.functions.all():
+            function.account.email_addresses.add(EmailAddressFactory(tenant=tenant))
+            function.account.addresses.add(AddressFactory(tenant=tenant))
+
     def _create_object_stub(self, with_relations=False, size=1, **kwargs):
         """
         Create an object dict with relation dicts using factories.
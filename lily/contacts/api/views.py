@@ -4,7 +4,7 @@ from rest_framework.filters import OrderingFilter
 from rest_framework.response import Response
 
 from lily.api.filters import ElasticSearchFilter
-from lily.api.mixins import ModelChangesMixin
+from lily.api.mixins import EagerLoadingMixin, ModelChangesMixin, SearchSourceListMixin
 
 from lily.calls.api.serializers import CallSerializer
 from lily.calls.models import Call
@@ -13,7 +13,7 @@ from lily.contacts.models import Contact, Function
 from lily.users.models import LilyUser
 
 
-class ContactViewSet(ModelChangesMixin, viewsets.ModelViewSet):
+class ContactViewSet(ModelChangesMixin, SearchSourceListMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     """
     Returns a list of all **active** contacts in the system.
 
@@ -44,6 +44,8 @@ class ContactViewSet(ModelChangesMixin, viewsets.ModelViewSet):
 
     # ElasticSearchFilter: set the model type.
     model_type = 'contacts_contact'
+    # ElasticSearchFilter: set the fields the search index can sort on, to paginate in the index.
+    search_ordering_fields = ('id', )
     # OrderingFilter: set all possible fields to order by.
     ordering_fields = (
         'id', 'first_name', 'last_name', 'full_name', 'gender', 'gender_display', 'salutation', 'salutation_display',
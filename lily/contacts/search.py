@@ -145,7 +145,7 @@ class ContactMapping(BaseMapping):
         """
         return {
             Function: lambda obj: [obj.contact],
-            Account: lambda obj: [f.contact for f in obj.functions.all()],
+            Account: lambda obj: Contact.objects.filter(functions__account=obj),
             Tag: lambda obj: [obj.subject],
             EmailAddress: lambda obj: obj.contact_set.all(),
             PhoneNumber: lambda obj: obj.contact_set.all(),
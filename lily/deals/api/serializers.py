@@ -3,6 +3,7 @@ import anyjson
 
 from channels import Group
 from django.utils.timezone import utc
+from django.db.models import Prefetch
 from django.utils.translation import ugettext_lazy as _
 
 from lily.api.fields import RegexDecimalField, SanitizedHtmlCharField
@@ -15,10 +16,12 @@ from lily.api.serializers import ContentTypeSerializer
 from lily.contacts.api.serializers import RelatedContactSerializer
 from lily.contacts.models import Function
 from lily.users.api.serializers import RelatedLilyUserSerializer, RelatedTeamSerializer
+from lily.users.models import LilyUser
 from lily.utils.api.serializers import RelatedTagSerializer
 from lily.utils.functions import add_business_days
 
 from ..models import Deal, DealNextStep, DealWhyCustomer, DealWhyLost, DealFoundThrough, DealContactedBy, DealStatus
+from ..search import DealMapping
 
 
 class DealNextStepSerializer(serializers.ModelSerializer):
@@ -321,6 +324,33 @@ class DealSerializer(WritableNestedSerializer):
 
         return super(DealSerializer, self).update(instance, validated_data)
 
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """
+        Fetch the related objects of the serialized deals with a constant number of queries.
+        """
+        return DealMapping.prepare_batch(queryset).select_related(
+            'contact',
+            'created_by',
+            'next_step',
+            'why_lost',
+            'why_customer',
+            'found_through',
+            'contacted_by',
+            'status',
+        ).prefetch_related(
+            'account__status',
+            'account__email_addresses',
+            'account__phone_numbers',
+            'account__addresses',
+            'contact__functions',
+            Prefetch(
+                'assigned_to_teams__user_set',
+                queryset=LilyUser.objects.filter(is_active=True),
+                to_attr='prefetched_active_users'
+            ),
+        )
+
     class Meta:
         model = Deal
         fields = (
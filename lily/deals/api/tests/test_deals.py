@@ -1,15 +1,16 @@
 from lily.accounts.factories import AccountFactory
+from lily.contacts.factories import FunctionFactory
 from lily.deals.api.serializers import DealSerializer
 from lily.deals.factories import DealFactory, DealWhyCustomerFactory, DealNextStepFactory, DealFoundThroughFactory, \
     DealContactedByFactory, DealStatusFactory, DealWhyLostFactory
 from lily.deals.models import Deal
 from lily.notes.factories import NoteFactory
 from lily.tags.factories import TagFactory
-from lily.tests.utils import GenericAPITestCase
-from lily.users.factories import LilyUserFactory
+from lily.tests.utils import GenericAPITestCase, ListQueryCountMixin
+from lily.users.factories import LilyUserFactory, TeamFactory
 
 
-class DealTests(GenericAPITestCase):
+class DealTests(ListQueryCountMixin, GenericAPITestCase):
     """
     Class containing tests for the deal API.
 
@@ -22,6 +23,15 @@ class DealTests(GenericAPITestCase):
     model_cls = Deal
     serializer_cls = DealSerializer
 
+    def _create_list_object(self, tenant):
+        function = FunctionFactory.create(tenant=tenant)
+        team = TeamFactory.create(tenant=tenant)
+        LilyUserFactory.create(tenant=tenant).teams.add(team)
+
+        deal = DealFactory.create(tenant=tenant, account=function.account, contact=function.contact)
+        deal.assigned_to_teams.add(team)
+        TagFactory.create_batch(size=2, tenant=tenant, subject=deal)
+
     def _create_object_stub(self, with_relations=False, size=1, **kwargs):
         """
         Create an object dict with relation dicts using factories.
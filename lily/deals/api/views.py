@@ -6,7 +6,7 @@ from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 
 from lily.api.filters import ElasticSearchFilter
-from lily.api.mixins import ModelChangesMixin
+from lily.api.mixins import EagerLoadingMixin, ModelChangesMixin, SearchSourceListMixin
 
 from .serializers import (DealSerializer, DealNextStepSerializer, DealWhyCustomerSerializer, DealWhyLostSerializer,
                           DealFoundThroughSerializer, DealContactedBySerializer, DealStatusSerializer)
@@ -133,7 +133,7 @@ class DealFilter(FilterSet):
         }
 
 
-class DealViewSet(ModelChangesMixin, ModelViewSet):
+class DealViewSet(ModelChangesMixin, SearchSourceListMixin, EagerLoadingMixin, ModelViewSet):
     """
     Returns a list of all **active** deals in the system.
 
@@ -172,6 +172,8 @@ class DealViewSet(ModelChangesMixin, ModelViewSet):
 
     # ElasticSearchFilter: set the model type.
     model_type = 'deals_deal'
+    # ElasticSearchFilter: set the fields the search index can sort on, to paginate in the index.
+    search_ordering_fields = ('id', )
     # OrderingFilter: set all possible fields to order by.
     ordering_fields = ('id', )
     # OrderingFilter: set the default ordering fields.
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenant', '0005_tenant_billing'),
+        ('accounts', '0019_auto_20170419_0926'),
+        ('contacts', '0013_auto_20170717_2005'),
+        ('integrations', '0005_create_documentevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MoneybirdContact',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('moneybird_id', models.CharField(max_length=255)),
+                ('version', models.BigIntegerField(null=True, blank=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.SET_NULL, blank=True, to='accounts.Account', null=True)),
+                ('contact', models.ForeignKey(on_delete=django.db.models.deletion.SET_NULL, blank=True, to='contacts.Contact', null=True)),
+                ('tenant', models.ForeignKey(to='tenant.Tenant', blank=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='moneybirdcontact',
+            unique_together=set([('tenant', 'moneybird_id')]),
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.db import models
 from django.utils import timezone
 from oauth2client.contrib.django_orm import CredentialsField
 
+from lily.accounts.models import Account
 from lily.contacts.models import Contact
 from lily.deals.models import Deal, DealStatus, DealNextStep
 from lily.tenant.models import TenantMixin
@@ -51,3 +52,17 @@ class DocumentEvent(TenantMixin):
 
     class Meta:
         unique_together = ('tenant', 'event_type', 'document_status')
+
+
+class MoneybirdContact(TenantMixin):
+    """
+    The contact and/or account a Moneybird contact was imported as, so importing again updates them.
+    """
+    moneybird_id = models.CharField(max_length=255)
+    contact = models.ForeignKey(Contact, null=True, blank=True, on_delete=models.SET_NULL)
+    account = models.ForeignKey(Account, null=True, blank=True, on_delete=models.SET_NULL)
+    # The Moneybird version (time of the last change) that was imported.
+    version = models.BigIntegerField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('tenant', 'moneybird_id')
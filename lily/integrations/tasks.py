@@ -1,25 +1,236 @@
 import logging
+from multiprocessing.pool import ThreadPool
 
 from celery.task import task
-from django.db import transaction
 
 from lily.accounts.models import Account, AccountStatus
 from lily.contacts.models import Contact, Function
 from lily.tenant.models import Tenant
-from lily.utils.functions import send_get_request
+from lily.utils.bulk_import import BulkImporter, normalize_value
+from lily.utils.functions import flatten, send_get_request
 from lily.utils.models.models import Address, EmailAddress, PhoneNumber
 
 from .credentials import get_credentials
+from .models import MoneybirdContact
 
 
 logger = logging.getLogger(__name__)
 
 
+MONEYBIRD_CONTACTS_PER_PAGE = 100
+
+
+def iter_moneybird_contacts(administration_id, credentials):
+    """
+    Yield the contacts of a Moneybird administration, the next page is fetched while the current one is processed.
+    """
+    base_url = 'https://moneybird.com/api/v2/%s/contacts?page=%s&per_page=%s'
+    pool = ThreadPool(1)
+
+    try:
+        page = 1
+        next_response = pool.apply_async(
+            send_get_request, (base_url % (administration_id, page, MONEYBIRD_CONTACTS_PER_PAGE), credentials)
+        )
+
+        while True:
+            data = next_response.get().json()
+
+            if not data or not isinstance(data, list):
+                if data:
+                    logger.error('Unexpected Moneybird response: %s', data)
+                break
+
+            # Increment the page so we can check for more contacts.
+            page += 1
+            next_response = pool.apply_async(
+                send_get_request, (base_url % (administration_id, page, MONEYBIRD_CONTACTS_PER_PAGE), credentials)
+            )
+
+            for contact_data in data:
+                yield contact_data
+    finally:
+        pool.terminate()
+
+
+def add_missing_related(importer, field_name, related_model, related_values, key_fields):
+    """
+    Create the related objects the owners don't have yet and add them to the owners.
+
+    Args:
+        importer (BulkImporter): the importer to write with
+        field_name (str): the name of the many to many field of the owners
+        related_model (Model): the model of the related objects
+        related_values (list): (owner, dict with the field values of the related object) tuples
+        key_fields (list): the fields that identify a related object of an owner
+    """
+    for model in set(type(owner) for owner, values in related_values):
+        model_values = [(owner, values) for owner, values in related_values if type(owner) is model]
+        existing = importer.get_m2m(model, field_name, [owner for owner, values in model_values])
+
+        keys = set()
+        for owner_pk, related_objects in existing.items():
+            for obj in related_objects:
+                keys.add((owner_pk, tuple(normalize_value(getattr(obj, field)) for field in key_fields)))
+
+        pairs = []
+        for owner, values in model_values:
+            key = (owner.pk, tuple(normalize_value(values.get(field)) for field in key_fields))
+            if key not in keys:
+                keys.add(key)
+                pairs.append((owner, related_model(**values)))
+
+        importer.create(related_model, [related for owner, related in pairs])
+        importer.add_m2m(model, field_name, pairs)
+
+
+def import_moneybird_page(importer, tenant, account_status, records):
+    """
+    Import a page of Moneybird contacts with a fixed number of queries.
+
+    Records are linked to the contact/account they were imported as by their Moneybird id, so importing again updates
+    these instead of creating duplicates. Records with an unchanged version are skipped.
+    """
+    links = dict((link.moneybird_id, link) for link in MoneybirdContact.objects.filter(
+        tenant=tenant,
+        moneybird_id__in=[unicode(record.get('id')) for record in records]
+    ))
+
+    records = [
+        record for record in records
+        if getattr(links.get(unicode(record.get('id'))), 'version', None) != record.get('version') or
+        record.get('version') is None
+    ]
+    if not records:
+        return
+
+    record_ids = set(unicode(record.get('id')) for record in records)
+    links = dict((moneybird_id, link) for moneybird_id, link in links.items() if moneybird_id in record_ids)
+
+    linked_contacts = Contact.objects.filter(is_deleted=False).in_bulk(
+        [existing_link.contact_id for existing_link in links.values() if existing_link.contact_id]
+    )
+    linked_accounts = Account.objects.filter(is_deleted=False).in_bulk(
+        [existing_link.account_id for existing_link in links.values() if existing_link.account_id]
+    )
+
+    # Find or create the contacts and accounts of records that weren't imported before.
+    contact_lookups = []
+    account_lookups = []
+    for record in records:
+        link = links.get(unicode(record.get('id')))
+
+        if record.get('firstname') and not (link and link.contact_id in linked_contacts):
+            contact_lookups.append({
+                'first_name': record.get('firstname'),
+                'last_name': record.get('lastname') or '',
+                'tenant': tenant,
+                'is_deleted': False,
+            })
+
+        if record.get('company_name') and not (link and link.account_id in linked_accounts):
+            account_lookups.append({
+                'name': record.get('company_name'),
+                'status': account_status,
+                'tenant': tenant,
+                'is_deleted': False,
+            })
+
+    new_contacts = iter(importer.get_or_create(Contact, contact_lookups))
+    new_accounts = iter(importer.get_or_create(
+        Account,
+        account_lookups,
+        defaults=[{'flatname': flatten(lookup['name'])} for lookup in account_lookups]
+    ))
+
+    functions = []
+    email_addresses = []
+    phone_numbers = []
+    addresses = []
+    new_links = []
+
+    for record in records:
+        link = links.get(unicode(record.get('id')))
+        contact = None
+        account = None
+
+        first_name = record.get('firstname')
+        if first_name:
+            if link and link.contact_id in linked_contacts:
+                contact = linked_contacts[link.contact_id]
+                last_name = record.get('lastname') or ''
+                if contact.first_name != first_name or contact.last_name != last_name:
+                    Contact.objects.filter(pk=contact.pk).update(first_name=first_name, last_name=last_name)
+                    importer.mark_changed([contact])
+            else:
+                contact = next(new_contacts)
+
+        company = record.get('company_name')
+        if company:
+            if link and link.account_id in linked_accounts:
+                account = linked_accounts[link.account_id]
+                if account.name != company:
+                    Account.objects.filter(pk=account.pk).update(name=company, flatname=flatten(company))
+                    importer.mark_changed([account])
+            else:
+                account = next(new_accounts)
+
+            if contact:
+                # Contacts and accounts are linked through functions.
+                functions.append({'account': account, 'contact': contact})
+
+        new_links.append(MoneybirdContact(
+            tenant=tenant,
+            moneybird_id=unicode(record.get('id')),
+            contact=contact,
+            account=account,
+            version=record.get('version'),
+        ))
+
+        # Save all contact info to the contact if there is one, otherwise use the account.
+        contact_object = contact or account
+        if not contact_object:
+            continue
+
+        invoices_email = record.get('send_invoices_to_email')
+        estimates_email = record.get('send_estimates_to_email')
+
+        for email in set(email.lower() for email in (invoices_email, estimates_email) if email):
+            email_addresses.append((contact_object, {'email_address': email, 'tenant': tenant}))
+
+        if record.get('phone'):
+            phone_numbers.append((contact_object, {'number': record.get('phone'), 'tenant': tenant}))
+
+        if record.get('address1'):
+            addresses.append((contact_object, {
+                'address': record.get('address1'),
+                'postal_code': record.get('zipcode') or '',
+                'city': record.get('city') or '',
+                'country': record.get('country') or '',
+                'tenant': tenant,
+            }))
+
+            if record.get('address2'):
+                addresses.append((contact_object, {
+                    'address': record.get('address2'),
+                    'postal_code': '',
+                    'city': '',
+                    'country': record.get('country') or '',
+                    'tenant': tenant,
+                }))
+
+    importer.get_or_create(Function, functions)
+    add_missing_related(importer, 'email_addresses', EmailAddress, email_addresses, ['email_address'])
+    add_missing_related(importer, 'phone_numbers', PhoneNumber, phone_numbers, ['number'])
+    add_missing_related(importer, 'addresses', Address, addresses, ['address', 'postal_code', 'city', 'country'])
+
+    # Replace the links of the imported records.
+    MoneybirdContact.objects.filter(pk__in=[existing_link.pk for existing_link in links.values()]).delete()
+    importer.create(MoneybirdContact, new_links)
+
+
 @task(name='import_moneybird_contacts')
 def import_moneybird_contacts(tenant_id):
-    importing = True
-    page = 1
-
     tenant = Tenant.objects.get(pk=tenant_id)
     # Can't retreive tenant from request here, so get the tenant.
     credentials = get_credentials('moneybird', tenant)
@@ -29,142 +240,11 @@ def import_moneybird_contacts(tenant_id):
     # New tenants have this account status, but older tenants might not.
     account_status, status_created = AccountStatus.objects.get_or_create(name='Customer', tenant=tenant)
 
-    base_url = 'https://moneybird.com/api/v2/%s/contacts?page=%s&per_page=100'
-
-    while importing:
-        url = base_url % (administration_id, page)
-        response = send_get_request(url, credentials)
-
-        data = response.json()
-
-        if data:
-            for contact_data in data:
-                # For every field we want to fill we do the following:
-                # 1. Setup a dict with the information.
-                # 2. Retrieve all objects with that info.
-                # 3. If no object exists, create a new one (and add to set for related objects).
-                try:
-                    with transaction.atomic():
-                        contact = None
-                        first_name = contact_data.get('firstname')
-                        last_name = contact_data.get('lastname', '')
-
-                        if first_name:
-                            contact_dict = {
-                                'first_name': first_name,
-                                'last_name': last_name,
-                                'tenant': tenant,
-                                'is_deleted': False
-                            }
-                            # Since we have the possibility to resync we want to update
-                            # contacts that might already exist.
-                            contact = Contact.objects.filter(**contact_dict).last()
-
-                            if not contact:
-                                contact = Contact.objects.create(**contact_dict)
-
-                        company = contact_data.get('company_name')
-
-                        if company:
-                            account_dict = {
-                                'name': company,
-                                'status': account_status,
-                                'tenant': tenant,
-                                'is_deleted': False
-                            }
-                            account = Account.objects.filter(**account_dict).last()
-
-                            if not account:
-                                account = Account.objects.create(**account_dict)
-
-                            if contact:
-                                # Contacts and accounts are linked through functions.
-                                Function.objects.get_or_create(account=account, contact=contact)
-
-                        if contact:
-                            # Save all contact info to the contact if there is one.
-                            contact_object = contact
-                        else:
-                            # Otherwise use the account.
-                            contact_object = account
-
-                        invoices_email = contact_data.get('send_invoices_to_email')
-                        estimates_email = contact_data.get('send_estimates_to_email')
-                        phone = contact_data.get('phone')
-                        address = contact_data.get('address1')
-                        alternate_address = contact_data.get('address2')
-
-                        if invoices_email:
-                            invoices_email_dict = {
-                                'email_address': invoices_email,
-                                'tenant': tenant,
-                            }
-                            invoices_email_address = contact_object.email_addresses.filter(**invoices_email_dict)
-
-                            if not invoices_email_address.last():
-                                invoices_email_address = EmailAddress.objects.create(**invoices_email_dict)
-                                contact_object.email_addresses.add(invoices_email_address)
-
-                        if estimates_email and not invoices_email == estimates_email:
-                            # No point in adding two of the same email addresses.
-                            estimates_email_dict = {
-                                'email_address': estimates_email,
-                                'tenant': tenant,
-                            }
-                            estimates_email_address = contact_object.email_addresses.filter(**estimates_email_dict)
-
-                            if not estimates_email_address.last():
-                                estimates_email_address = EmailAddress.objects.create(**estimates_email_dict)
-                                contact_object.email_addresses.add(estimates_email_address)
-
-                        if phone:
-                            phone_number_dict = {
-                                'number': phone,
-                                'tenant': tenant,
-                            }
-                            phone_number = contact_object.phone_numbers.filter(**phone_number_dict).last()
-
-                            if not phone_number:
-                                phone_number = PhoneNumber.objects.create(**phone_number_dict)
-                                contact_object.phone_numbers.add(phone_number)
-
-                        if address:
-                            postal_code = contact_data.get('zipcode')
-                            city = contact_data.get('city')
-                            country = contact_data.get('country')
-
-                            address_dict = {
-                                'address': address,
-                                'postal_code': postal_code,
-                                'city': city,
-                                'country': country,
-                                'tenant': tenant,
-                            }
-
-                            address = Address.objects.filter(**address_dict).last()
-
-                            if not address:
-                                address = Address.objects.create(**address_dict)
-                                contact_object.addresses.add(address)
-
-                            if alternate_address:
-                                address_dict = ({
-                                    'address': alternate_address,
-                                    'country': country,
-                                    'tenant': tenant,
-                                })
-
-                                alternate_address = Address.objects.filter(**address_dict).last()
-
-                                if not alternate_address:
-                                    alternate_address = Address.objects.create(**address_dict)
-                                    contact_object.addresses.add(alternate_address)
-
-                        contact_object.save()
-                except Exception as e:
-                    logger.error(e)
-
-            # Increment the page so we can check for more contacts.
-            page += 1
-        else:
-            importing = False
+    # Malformed contacts are logged and skipped, so they don't stop the import.
+    importer = BulkImporter(chunk_size=MONEYBIRD_CONTACTS_PER_PAGE, skip_errors=True)
+    importer.run(
+        iter_moneybird_contacts(administration_id, credentials),
+        lambda records: import_moneybird_page(importer, tenant, account_status, records)
+    )
+    logger.info('Imported %s Moneybird contacts for tenant %s, skipped %s', importer.rows - importer.skipped,
+                tenant_id, importer.skipped)
@@ -0,0 +1,94 @@
+from django.test import TestCase
+
+from lily.accounts.models import Account, AccountStatus
+from lily.contacts.models import Contact, Function
+from lily.tenant.factories import TenantFactory
+from lily.utils.bulk_import import BulkImporter
+
+from .models import MoneybirdContact
+from .tasks import import_moneybird_page
+
+
+class MoneybirdImportTests(TestCase):
+    def setUp(self):
+        self.tenant = TenantFactory.create()
+        self.account_status = AccountStatus.objects.create(name='Customer', tenant=self.tenant)
+
+    def get_record(self, **kwargs):
+        record = {
+            'id': '1001',
+            'version': 1,
+            'firstname': 'John',
+            'lastname': 'Doe',
+            'company_name': 'Doe Inc.',
+            'send_invoices_to_email': 'john@example.com',
+            'send_estimates_to_email': 'John@example.com',
+            'phone': '+31612345678',
+        }
+        record.update(kwargs)
+        return record
+
+    def import_records(self, records):
+        importer = BulkImporter(skip_errors=True)
+        importer.run(records, lambda page: import_moneybird_page(importer, self.tenant, self.account_status, page))
+        return importer
+
+    def test_reimport(self):
+        """
+        Test that importing the same records again doesn't create duplicates.
+        """
+        self.import_records([self.get_record()])
+        self.import_records([self.get_record(version=None)])
+
+        contact = Contact.objects.get(tenant=self.tenant)
+        account = Account.objects.get(tenant=self.tenant)
+        self.assertEqual(Function.objects.filter(contact=contact, account=account).count(), 1)
+        self.assertEqual(list(contact.email_addresses.values_list('email_address', flat=True)), ['john@example.com'])
+        self.assertEqual(contact.phone_numbers.count(), 1)
+
+        link = MoneybirdContact.objects.get(tenant=self.tenant)
+        self.assertEqual((link.moneybird_id, link.contact_id, link.account_id), ('1001', contact.pk, account.pk))
+
+    def test_unchanged_version(self):
+        """
+        Test that records with the version that was imported before are skipped.
+        """
+        self.import_records([self.get_record()])
+        self.import_records([self.get_record(firstname='Jane', company_name='Jane Inc.')])
+
+        self.assertEqual(Contact.objects.get(tenant=self.tenant).first_name, 'John')
+        self.assertEqual(Account.objects.get(tenant=self.tenant).name, 'Doe Inc.')
+
+    def test_changed_version(self):
+        """
+        Test that a changed record updates the contact and account it was imported as.
+        """
+        self.import_records([self.get_record()])
+        contact = Contact.objects.get(tenant=self.tenant)
+        account = Account.objects.get(tenant=self.tenant)
+
+        self.import_records([self.get_record(version=2, firstname='Jane', company_name='Jane Inc.')])
+
+        contact.refresh_from_db()
+        account.refresh_from_db()
+        self.assertEqual((contact.first_name, contact.last_name), ('Jane', 'Doe'))
+        self.assertEqual((account.name, account.flatname), ('Jane Inc.', 'janeinc'))
+        self.assertEqual(Contact.objects.filter(tenant=self.tenant).count(), 1)
+        self.assertEqual(Account.objects.filter(tenant=self.tenant).count(), 1)
+        self.assertEqual(MoneybirdContact.objects.get(tenant=self.tenant).version, 2)
+
+    def test_malformed_record(self):
+        """
+        Test that a record that can't be imported is skipped and the other records are imported.
+        """
+        importer = self.import_records([
+            self.get_record(),
+            self.get_record(id='1002', firstname='J' * 300, company_name=None),
+            self.get_record(id='1003', firstname='Jane', company_name=None),
+        ])
+
+        self.assertEqual(importer.skipped, 1)
+        self.assertEqual(
+            set(MoneybirdContact.objects.filter(tenant=self.tenant).values_list('moneybird_id', flat=True)),
+            set(['1001', '1003'])
+        )
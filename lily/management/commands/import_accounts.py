@@ -1,5 +1,4 @@
 import csv
-import gc
 
 from django.contrib.contenttypes.models import ContentType
 from django.core.files.storage import default_storage
@@ -8,6 +7,8 @@ from django.core.management.base import BaseCommand
 from lily.accounts.models import Account, AccountStatus, Website
 from lily.tags.models import Tag
 from lily.tenant.models import Tenant
+from lily.utils.bulk_import import BulkImporter
+from lily.utils.functions import clean_website, flatten
 from lily.utils.models.models import EmailAddress
 
 
@@ -36,44 +37,49 @@ class Command(BaseCommand):
         tenant_id = options['tenant'].strip()
         tag_name = options['tag'].replace('_', ' ')
 
-        if tag_name:
-            content_type = ContentType.objects.get_for_model(Account)
-
         if tenant_id:
             tenant = Tenant.objects.get(pk=int(tenant_id))
         else:
             raise Exception('Please provide the ID of the tenant you wish to import accounts for.')
 
-        for row in self.read_csvfile(csvfile):
-            name = row.get('name')
-            account_status = AccountStatus.objects.get(name='Prospect', tenant=tenant)
-            account = Account.objects.create(name=name, tenant=tenant, status=account_status)
-
-            website = Website.objects.create(
-                website=row.get('website'),
-                is_primary=True, account=account,
-                tenant=tenant,
-            )
-
-            email_address = EmailAddress.objects.create(
-                email_address=row.get('email_address'),
-                status=EmailAddress.PRIMARY_STATUS,
-                tenant=tenant,
-            )
+        self.tenant = tenant
+        self.tag_name = tag_name
+        self.content_type = ContentType.objects.get_for_model(Account)
+        self.account_status = AccountStatus.objects.get(name='Prospect', tenant=tenant)
 
-            if tag_name:
-                tag = Tag.objects.create(
-                    name=tag_name,
-                    object_id=account.id,
-                    content_type=content_type,
-                    tenant=tenant,
-                )
+        self.importer = BulkImporter(stdout=self.stdout)
+        self.importer.run(self.read_csvfile(csvfile), self.import_rows)
 
-            account.email_addresses.add(email_address)
-            account.websites.add(website)
-            account.tags.add(tag)
-
-            gc.collect()
+    def import_rows(self, rows):
+        """
+        Import a chunk of rows, with a few bulk queries for all rows together.
+        """
+        tenant = self.tenant
+        accounts = self.importer.create(Account, [
+            Account(name=row.get('name'), flatname=flatten(row.get('name')), tenant=tenant, status=self.account_status)
+            for row in rows
+        ])
+
+        self.importer.create(Website, [
+            Website(website=clean_website(row.get('website')), is_primary=True, account=account, tenant=tenant)
+            for account, row in zip(accounts, rows) if row.get('website')
+        ])
+
+        rows_with_email = [(account, row) for account, row in zip(accounts, rows) if row.get('email_address')]
+        email_addresses = self.importer.create(EmailAddress, [
+            EmailAddress(email_address=row.get('email_address').lower(), status=EmailAddress.PRIMARY_STATUS,
+                         tenant=tenant)
+            for account, row in rows_with_email
+        ])
+        self.importer.add_m2m(Account, 'email_addresses', [
+            (account, email_address) for (account, row), email_address in zip(rows_with_email, email_addresses)
+        ])
+
+        if self.tag_name:
+            self.importer.create(Tag, [
+                Tag(name=self.tag_name, object_id=account.id, content_type=self.content_type, tenant=tenant)
+                for account in accounts
+            ])
 
     def read_csvfile(self, file_name):
         """
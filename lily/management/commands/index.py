@@ -1,3 +1,7 @@
+from datetime import datetime
+from functools import partial
+import math
+from multiprocessing import Pool
 import os
 import traceback
 import time
@@ -5,13 +9,18 @@ import time
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.db import connection
+from django.db.models import Max, Min
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from elasticsearch.exceptions import NotFoundError
 
 from slacker import Slacker
 
 from lily.search.analyzers import get_analyzers
 from lily.search.connections_utils import get_es_client, get_index_name
-from lily.search.indexing import index_objects
+from lily.search.indexing import index_objects, update_changed_in_index
 from lily.search.scan_search import ModelMappings
+from lily.search.tasks import get_last_changed_update
 
 
 class Command(BaseCommand):
@@ -33,7 +42,24 @@ The second way is to target a specific model:
     index -t contacts_contact
     index -t lily.contacts
 
-It is possible to specify multiple models, using comma separation."""
+It is possible to specify multiple models, using comma separation.
+
+Large indexes can be built by multiple processes, each indexing a part of the pk range:
+
+    index -t email -w 8 -b 1000
+
+Progress is saved per part, so a failed run can be continued with:
+
+    index -t email -w 8 -r
+
+Instead of building new indexes, the live indexes can be brought up to date with the objects modified since a
+given time (e.g. after an Elasticsearch outage), soft deleted objects are removed:
+
+    index --since "2017-03-01 12:00"
+
+Or since the last run of the periodic update of changed objects:
+
+    index --changed-only"""
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -61,6 +87,41 @@ It is possible to specify multiple models, using comma separation."""
             dest='force',
             help='Force the creation of the new index, removing the old one (leftovers).'
         )
+        parser.add_argument(
+            '-r', '--resume',
+            action='store_true',
+            dest='resume',
+            help='Resume indexing into the leftover index of a failed run.'
+        )
+        parser.add_argument(
+            '--since',
+            action='store',
+            dest='since',
+            default='',
+            help='Update the live index with the objects modified since this date/time, without building a new index.'
+        )
+        parser.add_argument(
+            '--changed-only',
+            action='store_true',
+            dest='changed_only',
+            help='Update the live index with the objects modified since the last periodic update.'
+        )
+        parser.add_argument(
+            '-w', '--workers',
+            action='store',
+            dest='workers',
+            type=int,
+            default=1,
+            help='The number of processes to index with.'
+        )
+        parser.add_argument(
+            '-b', '--bulk-size',
+            action='store',
+            dest='bulk_size',
+            type=int,
+            default=settings.ES_INDEX_BULK_SIZE,
+            help='The number of documents per bulk request.'
+        )
 
     def handle(self, *args, **kwargs):
         self.stdout.write('Please remember that Lily needs to be in maintenance mode. \n\n')
@@ -70,7 +131,10 @@ It is possible to specify multiple models, using comma separation."""
             self.handle_kwargs(**kwargs)
 
             self.es = get_es_client()
-            self.index()
+            if self.since:
+                self.update_changed()
+            else:
+                self.index()
 
             if self.log_queries:
                 for query in connection.queries:
@@ -119,6 +183,31 @@ It is possible to specify multiple models, using comma separation."""
         # Validate the force kwarg.
         self.force = kwargs['force'] is True
 
+        # Validate the resume kwarg.
+        self.resume = kwargs['resume'] is True
+
+        # Validate the workers and bulk size kwargs.
+        if kwargs['workers'] < 1 or kwargs['bulk_size'] < 1:
+            raise Exception('The number of workers and the bulk size should be at least 1.')
+        self.workers = kwargs['workers']
+        self.bulk_size = kwargs['bulk_size']
+
+        # Validate the since and changed_only kwargs.
+        self.since = None
+        if kwargs['since']:
+            self.since = parse_datetime(kwargs['since'])
+            if not self.since:
+                since_date = parse_date(kwargs['since'])
+                if not since_date:
+                    raise Exception('Unknown date/time format %s, use e.g. "2017-03-01 12:00".' % kwargs['since'])
+                self.since = datetime.combine(since_date, datetime.min.time())
+            if timezone.is_naive(self.since):
+                self.since = timezone.make_aware(self.since)
+        elif kwargs['changed_only']:
+            self.since = get_last_changed_update()
+            if not self.since:
+                raise Exception('The time of the last update is unknown, use --since instead.')
+
     def validate_targets(self, targets_to_check):
         """
         Validate every target that is passed to the command.
@@ -163,6 +252,8 @@ It is possible to specify multiple models, using comma separation."""
         """
         Do the actual indexing for all specified targets.
         """
+        checkpoints = IndexCheckpoints(self.es)
+
         for mapping in self.target_list:
             model_name = mapping.get_mapping_type_name()
             main_index_base = settings.ES_INDEXES['default']
@@ -180,6 +271,8 @@ It is possible to specify multiple models, using comma separation."""
 
             # Check any indices with no alias (leftovers from failed indexing).
             # Or it could be that it is still in progress,
+            temp_index_base = None
+            partitions = None
             aliases = self.es.indices.get_aliases()
             for key, value in aliases.iteritems():
                 if not key.endswith(model_name):
@@ -189,31 +282,53 @@ It is possible to specify multiple models, using comma separation."""
                     # This is an auto created index. Will be removed at end of command.
                     continue
                 if not value['aliases']:
+                    if self.resume and not partitions:
+                        partitions = checkpoints.load(key)
+                        if partitions:
+                            self.stdout.write('Resuming leftover "%s"' % key)
+                            temp_index_base = key[:-len(model_name) - 1]
+                            continue
+
                     if self.force:
                         self.stdout.write('Removing leftover "%s"' % key)
                         self.es.indices.delete(key)
+                        checkpoints.delete(key)
                     else:
-                        raise Exception('Found leftover %s, proceed with -f to remove.'
+                        raise Exception('Found leftover %s, proceed with -f to remove or -r to resume.'
                                         ' Make sure indexing this model is not already running!' % key)
 
-            # Create new index.
-            index_settings = {
-                'mappings': {
-                    model_name: mapping.get_mapping()
-                },
-                'settings': {
-                    'analysis': get_analyzers()['analysis'],
-                    'number_of_shards': 1,
+            if not partitions:
+                # Create new index, refreshing and replication are enabled once all documents are indexed.
+                index_settings = {
+                    'mappings': {
+                        model_name: mapping.get_mapping()
+                    },
+                    'settings': {
+                        'analysis': get_analyzers()['analysis'],
+                        'number_of_shards': 1,
+                        'number_of_replicas': 0,
+                        'refresh_interval': '-1',
+                    }
                 }
-            }
-            temp_index_base = 'index_%s' % (int(time.time()))
-            temp_index = get_index_name(temp_index_base, mapping)
+                temp_index_base = 'index_%s' % (int(time.time()))
+                temp_index = get_index_name(temp_index_base, mapping)
 
-            self.stdout.write('Creating new index "%s"' % temp_index)
-            self.es.indices.create(temp_index, body=index_settings)
+                self.stdout.write('Creating new index "%s"' % temp_index)
+                self.es.indices.create(temp_index, body=index_settings)
+            else:
+                temp_index = get_index_name(temp_index_base, mapping)
 
             # Index documents.
-            self.index_documents(mapping, temp_index_base)
+            self.index_documents(mapping, temp_index_base, partitions)
+
+            self.es.indices.put_settings(index=temp_index, body={
+                'index': {
+                    'number_of_replicas': settings.ES_NUMBER_OF_REPLICAS,
+                    'refresh_interval': settings.ES_REFRESH_INTERVAL,
+                }
+            })
+            self.es.indices.refresh(temp_index)
+            checkpoints.delete(temp_index)
 
             # Switch aliases.
             if old_index:
@@ -244,16 +359,192 @@ It is possible to specify multiple models, using comma separation."""
 
         self.stdout.write('Indexing finished.')
 
-    def index_documents(self, mapping, temp_index_base):
+    def update_changed(self):
         """
-        Index all non deleted objects.
+        Update the live index of all specified targets with the objects modified since self.since.
+        """
+        self.stdout.write('Updating objects modified since %s\n\n' % self.since)
+
+        for mapping in self.target_list:
+            model_name = mapping.get_mapping_type_name()
+            self.stdout.write('==> %s' % model_name)
+
+            if not mapping.has_modified():
+                self.stdout.write('Skipping, %s has no modified date.\n' % model_name)
+                continue
+
+            start_time = time.time()
+            indexed, removed = update_changed_in_index(mapping, self.since, self.bulk_size, print_progress=True)
+            self.stdout.write('Indexed %s and removed %s documents in %.1f seconds\n' % (
+                indexed, removed, time.time() - start_time
+            ))
+
+        self.stdout.write('Updating finished.')
+
+    def index_documents(self, mapping, temp_index_base, partitions=None):
+        """
+        Index all non deleted objects, split by pk range over the worker processes.
+
+        Args:
+            mapping (BaseMapping): the mapping to index
+            temp_index_base (str): the base name of the new index
+            partitions (list): checkpointed partitions to resume, new partitions are created when empty
         """
         model = mapping.get_model()
+        temp_index = get_index_name(temp_index_base, mapping)
         self.stdout.write('Indexing {0}.{1}'.format(model.__module__, model.__name__).lower())
 
-        if mapping.has_deleted():
-            model_objs = model.objects.filter(is_deleted=False)
+        if not partitions:
+            partitions = create_partitions(mapping, temp_index_base, self.workers)
+            IndexCheckpoints(self.es).create(temp_index, partitions)
+
+        todo = [partition for partition in partitions if not partition['done']]
+        indexed = 0
+        start_time = time.time()
+
+        if self.workers > 1 and len(todo) > 1:
+            # Forked processes can't share the database connection.
+            connection.close()
+            pool = Pool(min(self.workers, len(todo)))
+            try:
+                results = pool.imap_unordered(partial(index_partition, bulk_size=self.bulk_size), todo)
+                for partition in results:
+                    self.stdout.write('Finished pk range up to %s' % partition['end_pk'])
+                    indexed += partition['indexed']
+            finally:
+                pool.close()
+                pool.join()
         else:
-            model_objs = model.objects.all()
+            for partition in todo:
+                indexed += index_partition(partition, self.bulk_size, print_progress=True)['indexed']
+
+        elapsed = max(time.time() - start_time, 0.001)
+        self.stdout.write('Indexed %s documents in %.1f seconds (%.0f docs/sec)' % (
+            indexed, elapsed, indexed / elapsed
+        ))
+
+
+def get_index_queryset(mapping):
+    """
+    Return the objects of the mapping that should be indexed.
+    """
+    model = mapping.get_model()
+
+    if mapping.has_deleted():
+        return model.objects.filter(is_deleted=False)
+    return model.objects.all()
+
+
+def create_partitions(mapping, temp_index_base, workers):
+    """
+    Split the pk range of the objects of the mapping in a partition per worker.
+
+    Returns:
+        list: partitions which index the objects with a pk above `last_pk` up to and including `end_pk`
+    """
+    temp_index = get_index_name(temp_index_base, mapping)
+    partitions = []
+    pk_range = get_index_queryset(mapping).aggregate(min_pk=Min('pk'), max_pk=Max('pk'))
+
+    if pk_range['max_pk'] is not None:
+        step = int(math.ceil((pk_range['max_pk'] - pk_range['min_pk'] + 1) / float(workers)))
+        for start_pk in range(pk_range['min_pk'] - 1, pk_range['max_pk'], step):
+            partitions.append({
+                'id': '%s-%s' % (temp_index, len(partitions)),
+                'index_base': temp_index_base,
+                'mapping': mapping.get_mapping_type_name(),
+                'last_pk': start_pk,
+                'end_pk': min(start_pk + step, pk_range['max_pk']),
+                'count': 0,
+                'done': False,
+            })
+
+    return partitions
+
+
+def index_partition(partition, bulk_size, print_progress=False):
+    """
+    Index the objects in the pk range of the partition, saving a checkpoint after every bulk request.
+
+    Can run in a worker process, so it uses its own Elasticsearch client.
+
+    Returns:
+        dict: the partition, with the number of documents indexed by this run as `indexed`
+    """
+    mapping = ModelMappings.name_to_mappings[partition['mapping']]
+    es = get_es_client(force_new=True)
+    checkpoints = IndexCheckpoints(es)
+    partition['indexed'] = 0
+
+    def save_checkpoint(last_pk, count):
+        partition['last_pk'] = last_pk
+        partition['count'] += count
+        partition['indexed'] += count
+        checkpoints.save(partition)
+
+    queryset = get_index_queryset(mapping).filter(pk__gt=partition['last_pk'], pk__lte=partition['end_pk'])
+    index_objects(
+        mapping,
+        queryset,
+        partition['index_base'],
+        print_progress=print_progress,
+        bulk_size=bulk_size,
+        es_client=es,
+        on_bulk_indexed=save_checkpoint
+    )
+
+    partition['done'] = True
+    checkpoints.save(partition)
+
+    return partition
+
+
+class IndexCheckpoints(object):
+    """
+    Progress of the partitions of an index that is being built, stored in Elasticsearch so a crashed run can resume.
+    """
+    index = 'index_checkpoints'
+    doc_type = 'checkpoint'
+
+    def __init__(self, es):
+        self.es = es
+
+    def create(self, index, partitions):
+        for partition in partitions:
+            self.save(partition)
+        # Written last, so only complete checkpoints are found.
+        self.es.index(index=self.index, doc_type=self.doc_type, id=index, body={
+            'partitions': [partition['id'] for partition in partitions],
+        })
+
+    def save(self, partition):
+        body = dict(partition)
+        body.pop('indexed', None)
+        self.es.index(index=self.index, doc_type=self.doc_type, id=partition['id'], body=body)
+
+    def load(self, index):
+        """
+        Return the partitions of the index, or None when there are no checkpoints.
+        """
+        try:
+            ids = self.es.get(index=self.index, doc_type=self.doc_type, id=index)['_source']['partitions']
+        except NotFoundError:
+            return None
+
+        if not ids:
+            return []
+
+        docs = self.es.mget(index=self.index, doc_type=self.doc_type, body={'ids': ids})['docs']
+        return [doc['_source'] for doc in docs if doc.get('found')]
+
+    def delete(self, index):
+        try:
+            ids = self.es.get(index=self.index, doc_type=self.doc_type, id=index)['_source']['partitions']
+        except NotFoundError:
+            return
 
-        index_objects(mapping, model_objs, temp_index_base, print_progress=True)
+        for doc_id in ids + [index]:
+            try:
+                self.es.delete(index=self.index, doc_type=self.doc_type, id=doc_id)
+            except NotFoundError:
+                pass
@@ -11,6 +11,8 @@ from lily.deals.models import Deal
 from lily.socialmedia.models import SocialMedia
 from lily.tags.models import Tag
 from lily.tenant.models import Tenant
+from lily.utils.bulk_import import BulkImporter
+from lily.utils.functions import clean_website, flatten
 from lily.utils.models.models import Address, EmailAddress, PhoneNumber
 from lily.utils.countries import COUNTRIES
 
@@ -96,224 +98,269 @@ class Command(BaseCommand):
                           Account, Contact]:
                 model.objects.filter(tenant=tenant).delete()
 
-        accounts = {}
-        contacts = {}
+        self.tenant = tenant
+        self.content_type = ContentType.objects.get_for_model(Account)
+        self.country_codes = dict((country_name, code) for code, country_name in COUNTRIES)
+        self.accounts = {}
+        self.contacts = set()
+
         with open('accounts.csv', 'rb') as csvfile:
             reader = csv.reader(csvfile, delimiter=',', quotechar='"')
             csvfile.readline()  # skip header
-            for row in reader:
-                name = row[0]
-                mobile_phone = row[1]
-                work_phone = row[2]
-                fax_phone = row[3]
-                primary_email = row[4]
-                skype = row[5]
-                twitter = row[6]
-                street = row[7]
-                city = row[8]
-                state = row[9]
-                zipcode = row[10]
-                country = row[11]
-                work_url = row[12] or row[13]
-                description = row[14] or row[15]
-                tags = row[19:]
-
-                if name in accounts:
-                    print 'Duplicate account: %s ' % name
-                    continue
-
-                account = {
-                    'name': name,
-                    'description': description,
-                }
-                account_instance = Account.objects.get_or_create(tenant=tenant, **account)[0]
-
-                if skype:
-                    social_media = SocialMedia.objects.get_or_create(
-                        tenant=tenant, name='other', other_name='skype', username=skype)[0]
-                    account_instance.social_media.add(social_media)
-
-                if twitter:
-                    social_media = SocialMedia.objects.get_or_create(
-                        tenant=tenant, name='twitter', username=twitter,
-                        profile_url='https://twitter.com/%s' % twitter)[0]
-                    account_instance.social_media.add(social_media)
-
-                for tag in tags:
-                    if tag:
-                        content_type = ContentType.objects.get_for_model(Account)
-                        object_id = account_instance.id
-                        Tag.objects.get_or_create(
-                            tenant=tenant, content_type=content_type, object_id=object_id, name=tag)
-
-                if work_url:
-                    if not (work_url.startswith('http://') or work_url.startswith('https://')):
-                        work_url = 'http://%s' % work_url
-                    website = Website(tenant=tenant, website=work_url)
-                    account_instance.websites.add(website)
-
-                if street:
-                    country_code = self.country
-                    for code, country_name in COUNTRIES:
-                        if country == country_name:
-                            if self.verbose:
-                                print 'found country %s' % country
-                            country_code = code
-                    address_instance = Address.objects.get_or_create(
-                        tenant=tenant, street=street, postal_code=zipcode, state_province=state,
-                        city=city, country=country_code)[0]
-                    account_instance.addresses.add(address_instance)
-
-                for number, number_type in [(mobile_phone, 'mobile'), (work_phone, 'work'), (fax_phone, 'fax')]:
-                    if number:
-                        number = self.clean_phone(number)
-                        phone = PhoneNumber.objects.get_or_create(
-                            tenant=tenant, type=number_type, number=number)[0]
-                        account_instance.phone_numbers.add(phone)
-
-                if primary_email:
-                    email = EmailAddress.objects.get_or_create(
-                        tenant=tenant, email_address=primary_email, status=EmailAddress.PRIMARY_STATUS)[0]
-                    account_instance.email_addresses.add(email)
-
-                account_instance.save()
-                account['instance'] = account_instance
-                accounts[name] = account
+            self.importer = BulkImporter(stdout=self.stdout)
+            self.importer.run(reader, self.import_accounts)
 
         with open('contacts.csv', 'rb') as csvfile:
             csvfile.readline()  # skip header
             reader = csv.reader(csvfile, delimiter=',', quotechar='"')
-            for row in reader:
-                first_name = row[0]
-                last_name = row[1]
-                account_name = row[2]
-                title = row[3]
-                work_phone = row[4]
-                work2_phone = row[5]
-                home_phone = row[6]
-                mobile_phone = row[7]
-                work3_phone = row[8]
-                work4_phone = row[9]
-                fax_phone = row[10]
-                other_phone = row[11]
-                emails = row[12:16]
-                skype = row[16]
-                twitters = row[17:20]
-                facebook = row[20]
-                linkedin = row[21]
-                gplus = row[22]
-                addresses = [row[23:28], row[28:33], row[33:38], row[38:43]]  # 4 addresses
-                websites = row[43:55]
-                # Join some descriptions into a single string.
-                # (Including tags, because they are quite messy in the csv, for example some have spaces.)
-                description = ', '.join([title] + [desc for desc in row[55:] if desc])
-
-                if '@' in first_name:
-                    print 'Email address for name %s ' % first_name
-                    continue
-
-                if not account_name:
-                    print 'Empty account name for %s, %s' % (first_name, last_name)
-                    account_name = None
-                    account_instance = None
-                else:
-                    account_instance = accounts[account_name]['instance']
-
-                contact_key = '%s, %s, %s' % (first_name, last_name, account_name)
-
-                if contact_key in contacts:
-                    print 'Duplicate contact: %s ' % contact_key
-                    continue
-
-                contact = {
-                    'first_name': first_name,
-                    'last_name': last_name,
-                    'description': description,
-                }
-
-                contact_instance = Contact.objects.get_or_create(tenant=tenant, **contact)[0]
-
-                for website in websites:
-                    if website:
-                        if not (website.startswith('http://') or website.startswith('https://')):
-                            website = 'http://%s' % website
-                        social_media = SocialMedia.objects.get_or_create(
-                            tenant=tenant, name='other', username=website,
-                            profile_url=website)[0]
-                        contact_instance.social_media.add(social_media)
-
-                for address in addresses:
-                    street, city, state, zipcode, country = address
-                    if street or city or state or zipcode or country:
-                        country_code = self.country
-                        for code, country_name in COUNTRIES:
-                            if country == country_name:
-                                if self.verbose:
-                                    print 'found country %s' % country
-                                country_code = code
-                        address_instance = Address.objects.get_or_create(
-                            tenant=tenant, street=street, postal_code=zipcode, state_province=state,
-                            city=city, country=country_code)[0]
-                        contact_instance.addresses.add(address_instance)
-
-                if skype:
-                    social_media = SocialMedia.objects.get_or_create(
-                        tenant=tenant, name='other', other_name='skype', username=skype)[0]
-                    contact_instance.social_media.add(social_media)
-
-                if linkedin:
-                    social_media = SocialMedia.objects.get_or_create(
-                        tenant=tenant, name='linkedin', username=linkedin,
-                        profile_url=linkedin)[0]
-                    contact_instance.social_media.add(social_media)
-
-                if gplus:
-                    social_media = SocialMedia.objects.get_or_create(
-                        tenant=tenant, name='googleplus', username=gplus,
-                        profile_url=gplus)[0]
-                    contact_instance.social_media.add(social_media)
-
-                if facebook:
-                    start_username = facebook.rfind('/') + 1
-                    facebook = facebook[start_username:]
-                    social_media = SocialMedia.objects.get_or_create(
-                        tenant=tenant, name='facebook', username=facebook,
-                        profile_url='https://facebook.com/%s' % facebook)[0]
-                    contact_instance.social_media.add(social_media)
-
-                for twitter in twitters:
-                    if twitter:
-                        social_media = SocialMedia.objects.get_or_create(
-                            tenant=tenant, name='twitter', username=twitter,
-                            profile_url='https://twitter.com/%s' % twitter)[0]
-                        contact_instance.social_media.add(social_media)
-
-                first_added = False
-                for email_address in emails:
-                    if email_address:
-                        if first_added:
-                            email_status = EmailAddress.OTHER_STATUS
-                        else:
-                            email_status = EmailAddress.PRIMARY_STATUS
-                        email = EmailAddress.objects.get_or_create(
-                            tenant=tenant, email_address=email_address, status=email_status)[0]
-                        contact_instance.email_addresses.add(email)
-                        first_added = True
-
-                for number, number_type in [
-                    (mobile_phone, 'mobile'), (work_phone, 'work'), (fax_phone, 'fax'), (work2_phone, 'work'),
-                    (work3_phone, 'work'), (work4_phone, 'work'), (other_phone, 'other'), (home_phone, 'home')
-                ]:
-                    if number:
-                        number = self.clean_phone(number)
-                        phone = PhoneNumber.objects.get_or_create(
-                            tenant=tenant, type=number_type, number=number)[0]
-                        contact_instance.phone_numbers.add(phone)
-
-                if account_instance:
-                    Function.objects.get_or_create(contact=contact_instance, account=account_instance)
-
-                contact_instance.save()
-                contacts[contact_key] = contact
-
-        print 'accounts:%s contacts:%s' % (len(accounts), len(contacts)),
+            self.importer = BulkImporter(stdout=self.stdout)
+            self.importer.run(reader, self.import_contacts)
+
+        print 'accounts:%s contacts:%s' % (len(self.accounts), len(self.contacts)),
+
+    def get_country_code(self, country):
+        if country in self.country_codes:
+            if self.verbose:
+                print 'found country %s' % country
+            return self.country_codes[country]
+        return self.country
+
+    def add_related(self, model, field_name, related_model, lookups):
+        """
+        Get or create the related objects of every (instance, lookup) and add them to the instances.
+        """
+        related_objects = self.importer.get_or_create(related_model, [lookup for instance, lookup in lookups])
+        self.importer.add_m2m(model, field_name, [
+            (instance, related) for (instance, lookup), related in zip(lookups, related_objects)
+        ])
+
+    def import_accounts(self, rows):
+        """
+        Import a chunk of the accounts csv, with a few bulk queries for all rows together.
+        """
+        tenant = self.tenant
+        account_rows = []
+        names = set()
+        for row in rows:
+            name = row[0]
+            if name in self.accounts or name in names:
+                print 'Duplicate account: %s ' % name
+                continue
+            names.add(name)
+            account_rows.append(row)
+
+        account_instances = self.importer.get_or_create(
+            Account,
+            [{'tenant': tenant, 'name': row[0], 'description': row[14] or row[15]} for row in account_rows],
+            defaults=[{'flatname': flatten(row[0])} for row in account_rows]
+        )
+
+        social_media = []
+        tags = []
+        websites = []
+        addresses = []
+        phone_numbers = []
+        email_addresses = []
+
+        for row, account_instance in zip(account_rows, account_instances):
+            name = row[0]
+            mobile_phone = row[1]
+            work_phone = row[2]
+            fax_phone = row[3]
+            primary_email = row[4]
+            skype = row[5]
+            twitter = row[6]
+            street = row[7]
+            city = row[8]
+            state = row[9]
+            zipcode = row[10]
+            country = row[11]
+            work_url = row[12] or row[13]
+
+            if skype:
+                social_media.append((account_instance, {
+                    'tenant': tenant, 'name': 'other', 'other_name': 'skype', 'username': skype,
+                }))
+
+            if twitter:
+                social_media.append((account_instance, {
+                    'tenant': tenant, 'name': 'twitter', 'username': twitter,
+                    'profile_url': 'https://twitter.com/%s' % twitter,
+                }))
+
+            for tag in row[19:]:
+                if tag:
+                    tags.append({
+                        'tenant': tenant, 'content_type': self.content_type, 'object_id': account_instance.id,
+                        'name': tag,
+                    })
+
+            if work_url:
+                if not (work_url.startswith('http://') or work_url.startswith('https://')):
+                    work_url = 'http://%s' % work_url
+                websites.append({'tenant': tenant, 'account': account_instance, 'website': clean_website(work_url)})
+
+            if street:
+                addresses.append((account_instance, {
+                    'tenant': tenant, 'street': street, 'postal_code': zipcode, 'state_province': state,
+                    'city': city, 'country': self.get_country_code(country),
+                }))
+
+            for number, number_type in [(mobile_phone, 'mobile'), (work_phone, 'work'), (fax_phone, 'fax')]:
+                if number:
+                    phone_numbers.append((account_instance, {
+                        'tenant': tenant, 'type': number_type, 'number': self.clean_phone(number),
+                    }))
+
+            if primary_email:
+                email_addresses.append((account_instance, {
+                    'tenant': tenant, 'email_address': primary_email.lower(), 'status': EmailAddress.PRIMARY_STATUS,
+                }))
+
+            self.accounts[name] = account_instance
+
+        self.add_related(Account, 'social_media', SocialMedia, social_media)
+        self.importer.get_or_create(Tag, tags)
+        self.importer.get_or_create(Website, websites)
+        self.add_related(Account, 'addresses', Address, addresses)
+        self.add_related(Account, 'phone_numbers', PhoneNumber, phone_numbers)
+        self.add_related(Account, 'email_addresses', EmailAddress, email_addresses)
+
+    def import_contacts(self, rows):
+        """
+        Import a chunk of the contacts csv, with a few bulk queries for all rows together.
+        """
+        tenant = self.tenant
+        contact_rows = []
+        for row in rows:
+            first_name = row[0]
+            last_name = row[1]
+            account_name = row[2]
+
+            if '@' in first_name:
+                print 'Email address for name %s ' % first_name
+                continue
+
+            if not account_name:
+                print 'Empty account name for %s, %s' % (first_name, last_name)
+                account_name = None
+
+            contact_key = '%s, %s, %s' % (first_name, last_name, account_name)
+
+            if contact_key in self.contacts:
+                print 'Duplicate contact: %s ' % contact_key
+                continue
+
+            self.contacts.add(contact_key)
+            # Join some descriptions into a single string.
+            # (Including tags, because they are quite messy in the csv, for example some have spaces.)
+            description = ', '.join([row[3]] + [desc for desc in row[55:] if desc])
+            contact_rows.append((row, account_name, description))
+
+        contact_instances = self.importer.get_or_create(Contact, [
+            {'tenant': tenant, 'first_name': contact_row[0][0], 'last_name': contact_row[0][1],
+             'description': contact_row[2]}
+            for contact_row in contact_rows
+        ])
+
+        social_media = []
+        addresses = []
+        email_addresses = []
+        phone_numbers = []
+        functions = []
+
+        for (row, account_name, description), contact_instance in zip(contact_rows, contact_instances):
+            work_phone = row[4]
+            work2_phone = row[5]
+            home_phone = row[6]
+            mobile_phone = row[7]
+            work3_phone = row[8]
+            work4_phone = row[9]
+            fax_phone = row[10]
+            other_phone = row[11]
+            emails = row[12:16]
+            skype = row[16]
+            twitters = row[17:20]
+            facebook = row[20]
+            linkedin = row[21]
+            gplus = row[22]
+            contact_addresses = [row[23:28], row[28:33], row[33:38], row[38:43]]  # 4 addresses
+            websites = row[43:55]
+
+            for website in websites:
+                if website:
+                    if not (website.startswith('http://') or website.startswith('https://')):
+                        website = 'http://%s' % website
+                    social_media.append((contact_instance, {
+                        'tenant': tenant, 'name': 'other', 'username': website, 'profile_url': website,
+                    }))
+
+            for address in contact_addresses:
+                street, city, state, zipcode, country = address
+                if street or city or state or zipcode or country:
+                    addresses.append((contact_instance, {
+                        'tenant': tenant, 'street': street, 'postal_code': zipcode, 'state_province': state,
+                        'city': city, 'country': self.get_country_code(country),
+                    }))
+
+            if skype:
+                social_media.append((contact_instance, {
+                    'tenant': tenant, 'name': 'other', 'other_name': 'skype', 'username': skype,
+                }))
+
+            if linkedin:
+                social_media.append((contact_instance, {
+                    'tenant': tenant, 'name': 'linkedin', 'username': linkedin, 'profile_url': linkedin,
+                }))
+
+            if gplus:
+                social_media.append((contact_instance, {
+                    'tenant': tenant, 'name': 'googleplus', 'username': gplus, 'profile_url': gplus,
+                }))
+
+            if facebook:
+                start_username = facebook.rfind('/') + 1
+                facebook = facebook[start_username:]
+                social_media.append((contact_instance, {
+                    'tenant': tenant, 'name': 'facebook', 'username': facebook,
+                    'profile_url': 'https://facebook.com/%s' % facebook,
+                }))
+
+            for twitter in twitters:
+                if twitter:
+                    social_media.append((contact_instance, {
+                        'tenant': tenant, 'name': 'twitter', 'username': twitter,
+                        'profile_url': 'https://twitter.com/%s' % twitter,
+                    }))
+
+            first_added = False
+            for email_address in emails:
+                if email_address:
+                    if first_added:
+                        email_status = EmailAddress.OTHER_STATUS
+                    else:
+                        email_status = EmailAddress.PRIMARY_STATUS
+                    email_addresses.append((contact_instance, {
+                        'tenant': tenant, 'email_address': email_address.lower(), 'status': email_status,
+                    }))
+                    first_added = True
+
+            for number, number_type in [
+                (mobile_phone, 'mobile'), (work_phone, 'work'), (fax_phone, 'fax'), (work2_phone, 'work'),
+                (work3_phone, 'work'), (work4_phone, 'work'), (other_phone, 'other'), (home_phone, 'home')
+            ]:
+                if number:
+                    phone_numbers.append((contact_instance, {
+                        'tenant': tenant, 'type': number_type, 'number': self.clean_phone(number),
+                    }))
+
+            if account_name:
+                functions.append({'contact': contact_instance, 'account': self.accounts[account_name]})
+
+        self.add_related(Contact, 'social_media', SocialMedia, social_media)
+        self.add_related(Contact, 'addresses', Address, addresses)
+        self.add_related(Contact, 'email_addresses', EmailAddress, email_addresses)
+        self.add_related(Contact, 'phone_numbers', PhoneNumber, phone_numbers)
+        self.importer.get_or_create(Function, functions)
+        # The accounts are indexed with their contacts.
+        self.importer.mark_changed(function['account'] for function in functions)
@@ -45,6 +45,7 @@ class EmailLabelSerializer(serializers.ModelSerializer):
             'label_id',
             'name',
             'unread',
+            'total',
         )
 
 
@@ -1,5 +1,8 @@
+import hmac
 import logging
+from base64 import b64decode
 
+import anyjson
 from django.conf import settings
 from django.db.models import Q
 from django_filters.rest_framework import DjangoFilterBackend, FilterSet
@@ -8,6 +11,7 @@ from rest_framework import viewsets, mixins, status, filters
 from rest_framework.decorators import detail_route, list_route
 from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet
 
 from lily.accounts.models import Account
@@ -19,11 +23,12 @@ from lily.users.api.serializers import LilyUserSerializer
 from .serializers import (EmailLabelSerializer, EmailAccountSerializer, EmailMessageSerializer,
                           EmailTemplateFolderSerializer, EmailTemplateSerializer, SharedEmailConfigSerializer,
                           TemplateVariableSerializer)
+from .. import label_counters, sync_scheduler
 from ..models.models import (EmailLabel, EmailAccount, EmailMessage, EmailTemplateFolder, EmailTemplate,
                              SharedEmailConfig, TemplateVariable)
 from ..tasks import (trash_email_message, toggle_read_email_message,
                      add_and_remove_labels_for_message, toggle_star_email_message, toggle_spam_email_message)
-from ..utils import get_filtered_message
+from ..utils import get_filtered_message, get_filtered_messages, get_metadata_only_message
 
 
 logger = logging.getLogger(__name__)
@@ -150,6 +155,53 @@ class EmailAccountViewSet(mixins.DestroyModelMixin,
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @detail_route(methods=['get'])
+    def sync_status(self, request, pk):
+        """
+        Return the sync state of the email account, with the seconds its last sync was queued as the 'lag'.
+        """
+        email_account = self.get_object()
+
+        return Response(sync_scheduler.get_sync_status(email_account.pk))
+
+
+class GmailPushNotification(APIView):
+    """
+    Endpoint of the Cloud Pub/Sub push subscription of the Gmail push notifications.
+
+    A notification tells the email address and history id of a mailbox that changed, the accounts of that mailbox
+    that didn't sync up to that history id yet are synced right away.
+    """
+    authentication_classes = ()
+    permission_classes = ()
+
+    def post(self, request):
+        token = request.query_params.get('token', '').encode('utf-8')
+        if not settings.GMAIL_PUSH_TOKEN or not hmac.compare_digest(token, settings.GMAIL_PUSH_TOKEN):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            data = anyjson.loads(b64decode(request.data['message']['data']))
+            email_address = data['emailAddress']
+            history_id = int(data['historyId'])
+        except (KeyError, TypeError, ValueError):
+            # Pub/Sub keeps delivering notifications that aren't acknowledged, so acknowledge invalid ones too.
+            logger.warning('Invalid Gmail push notification: %s', request.data)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        account_ids = EmailAccount.objects.filter(
+            email_address=email_address,
+            is_authorized=True,
+            is_deleted=False,
+            is_syncing=False,
+            history_id__lt=history_id,
+        ).values_list('pk', flat=True)
+
+        for account_id in account_ids:
+            sync_scheduler.request_sync(account_id)
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
 class EmailMessageViewSet(mixins.RetrieveModelMixin,
                           mixins.ListModelMixin,
@@ -184,20 +236,44 @@ class EmailMessageViewSet(mixins.RetrieveModelMixin,
         user = self.request.user
         email_messages = EmailMessage.objects.filter(account__tenant=user.tenant)
 
-        # Get all email accounts.
-        email_accounts = EmailAccount.objects.filter(tenant=user.tenant, is_deleted=False).distinct('id')
-
-        filtered_queryset = []
+        return get_filtered_messages(email_messages, user).order_by('-sent_date', '-pk')
 
-        for email_message in email_messages:
-            email_account = email_accounts.get(pk=email_message.account.id)
-
-            filtered_message = get_filtered_message(email_message, email_account, user)
+    def list(self, request, *args, **kwargs):
+        """
+        Paginate the ids of the visible messages in the database and only load the messages of the current page.
+        """
+        queryset = self.filter_queryset(self.get_queryset()).values_list('pk', 'is_metadata_only')
+
+        page = self.paginate_queryset(queryset)
+        rows = list(queryset) if page is None else page
+
+        full_messages = EmailMessage.objects.defer('search_body').select_related('sender').prefetch_related(
+            'received_by',
+            'received_by_cc',
+            'attachments',
+            'labels',
+            'headers',
+        ).in_bulk([pk for pk, is_metadata_only in rows if not is_metadata_only])
+        metadata_messages = EmailMessage.objects.only('id', 'sender', 'sent_date', 'account').select_related(
+            'sender',
+            'account',
+        ).prefetch_related(
+            'received_by',
+            'received_by_cc',
+        ).in_bulk([pk for pk, is_metadata_only in rows if is_metadata_only])
+
+        email_messages = []
+        for pk, is_metadata_only in rows:
+            if is_metadata_only:
+                email_messages.append(get_metadata_only_message(metadata_messages[pk]))
+            else:
+                email_messages.append(full_messages[pk])
 
-            if filtered_message:
-                filtered_queryset.append(filtered_message)
+        serializer = self.get_serializer(email_messages, many=True)
 
-        return filtered_queryset
+        if page is None:
+            return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
 
     def perform_update(self, serializer):
         """
@@ -206,8 +282,10 @@ class EmailMessageViewSet(mixins.RetrieveModelMixin,
         update database directly. Save will trigger an update of the search index.
         """
         email = self.get_object()
+        old_state = label_counters.get_state(email)
         email.read = self.request.data['read']
         email.save()
+        label_counters.update_message(old_state, (old_state[0], email.read))
         toggle_read_email_message.apply_async(args=(email.id, self.request.data['read']))
 
     def perform_destroy(self, instance):
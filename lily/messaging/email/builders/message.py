@@ -10,11 +10,13 @@ from bs4 import BeautifulSoup, UnicodeDammit
 from dateutil.parser import parse
 from django.conf import settings
 from django.core.files import File
-from django.db import transaction
+from django.db import IntegrityError, transaction
 import pytz
 
-from lily.messaging.email.utils import get_extensions_for_type
+from lily.messaging.email.utils import get_extensions_for_type, get_stored_search_body
+from lily.search.indexing import bulk_update_in_index
 
+from .. import label_counters
 from ..models.models import EmailMessage, EmailHeader, Recipient, EmailAttachment, NoEmailMessageId
 
 logger = logging.getLogger(__name__)
@@ -35,6 +37,7 @@ class MessageBuilder(object):
     def __init__(self, manager):
         self.manager = manager
         self.message = None
+        self.counted_state = (set(), True)
         self.labels = []
         self.headers = []
         self.received_by = None
@@ -79,6 +82,9 @@ class MessageBuilder(object):
             )
             created = True
 
+        # The labels and read status as counted by the label counters, to update them on save.
+        self.counted_state = label_counters.get_state(self.message)
+
         if 'threadId' in message_dict:
             self.message.thread_id = message_dict['threadId']
 
@@ -116,7 +122,7 @@ class MessageBuilder(object):
 
         # Get the available Label objects for the message from the database and the missing ones by the API.
         # First, get all labels from the database.
-        db_labels = self.manager.email_account.labels.all()
+        db_labels = self._get_db_labels()
 
         message_label_set = set(label for label in message_info.get('labelIds', []))
         db_label_set = set(label.label_id for label in db_labels)
@@ -138,6 +144,15 @@ class MessageBuilder(object):
             for label_id in available_label_ids:
                 self.labels.append(db_label_dict[label_id])
 
+    def _get_db_labels(self):
+        """
+        Get the labels of the email account from the database.
+
+        Returns:
+            iterable with EmailLabel instances
+        """
+        return self.manager.email_account.labels.all()
+
     def _save_message_payload(self, payload):
         """
         Walk through message and save headers and parts
@@ -409,6 +424,31 @@ class MessageBuilder(object):
         """
         header_name = header_name.lower()
 
+        for name, email_address in self._parse_recipients(header_value):
+            # Get or create recipient
+            recipient = Recipient.objects.get_or_create(
+                name=name,
+                email_address=email_address,
+            )[0]
+
+            # Set recipient to correct field
+            if header_name == 'from':
+                self.message.sender = recipient
+            elif header_name in ['to', 'delivered-to']:
+                self.received_by.add(recipient)
+            elif header_name == 'cc':
+                self.received_by_cc.add(recipient)
+
+    def _parse_recipients(self, header_value):
+        """
+        Split a recipient header into names and email addresses.
+
+        Args:
+            header_value (string): with value of header
+
+        Returns:
+            list of (name, email_address) tuples
+        """
         # Selects all comma's with the following conditions:
         # 1. Preceded by a TLD (with a max of 16 chars) or
         # 2. Preceded by an angle bracket (>)
@@ -418,23 +458,14 @@ class MessageBuilder(object):
         # 16 chars seems to be enough for now though
         recipients = re.sub(r'(\.[A-Z]{2,16}|>)(,)', r'\1;', header_value, flags=re.IGNORECASE).split('; ')
 
+        parsed_recipients = []
         for recipient in recipients:
-            # Get or create recipient
             email_address = email.utils.parseaddr(recipient)
 
             if email_address[1] != '':
-                recipient = Recipient.objects.get_or_create(
-                    name=email_address[0],
-                    email_address=email_address[1],
-                )[0]
-
-                # Set recipient to correct field
-                if header_name == 'from':
-                    self.message.sender = recipient
-                elif header_name in ['to', 'delivered-to']:
-                    self.received_by.add(recipient)
-                elif header_name == 'cc':
-                    self.received_by_cc.add(recipient)
+                parsed_recipients.append(email_address)
+
+        return parsed_recipients
 
     def save(self):
         # Only save if there is a sent date, otherwise it's a chat message.
@@ -446,6 +477,9 @@ class MessageBuilder(object):
             if self.attachments or self.inline_attachments:
                 self.message.has_attachment = True
 
+            self.message.search_body = get_stored_search_body(self.message)
+            self.message.label_flags = EmailMessage.get_label_flags(label.label_id for label in self.labels)
+
             if not self.message.pk:
                 # Save before we can add many-to-many and foreign keys.
                 self.message.save()
@@ -463,15 +497,22 @@ class MessageBuilder(object):
             elif self.message.labels:
                 self.message.labels.clear()
 
+            new_state = (set(label.pk for label in self.labels), self.message.read)
+            label_counters.update_message(self.counted_state, new_state)
+            self.counted_state = new_state
+
             # Save headers.
             if len(self.headers):
                 self.message.headers.all().delete()
                 self.message.headers.add(*self.headers)
 
-            # Save attachments.
+            # Save attachments, before the old ones are deleted, so files with the same content are kept.
             if len(self.attachments):
-                self.message.attachments.all().delete()
-                self.message.attachments.add(*self.attachments)
+                old_attachment_ids = list(self.message.attachments.values_list('pk', flat=True))
+                for attachment in self.attachments:
+                    attachment.message = self.message
+                    attachment.save()
+                self.message.attachments.filter(pk__in=old_attachment_ids).delete()
 
             self.message.skip_signal = False  # Re-enable indexing of the email on the last save.
             self.message.save()
@@ -527,3 +568,263 @@ class MessageBuilder(object):
         self.received_by_cc = None
         self.attachments = []
         self.inline_attachments = {}
+
+
+class BulkMessageBuilder(MessageBuilder):
+    """
+    Builder to create multiple new EmailMessages at once.
+
+    Messages are collected with store_message_info and written on save with a constant number of queries, instead of
+    several queries per message, recipient, label and header. Only use this builder for messages that aren't in the
+    database yet.
+    """
+    def __init__(self, manager):
+        super(BulkMessageBuilder, self).__init__(manager)
+        self.sender = None
+        self.db_labels = None
+        self.pending_messages = []
+
+    def get_or_create_message(self, message_dict):
+        """
+        Create a new EmailMessage, without looking it up in the database.
+
+        Arguments:
+            message_dict (dict): with label information
+
+        Returns:
+            message (instance): unsaved message
+            created (boolean): always True
+        """
+        self.message = EmailMessage(
+            message_id=message_dict['id'],
+            account=self.manager.email_account,
+        )
+        self.sender = None
+        self.labels = []
+        self.headers = []
+        self.received_by = set()
+        self.received_by_cc = set()
+        self.attachments = []
+        self.inline_attachments = {}
+
+        if 'threadId' in message_dict:
+            self.message.thread_id = message_dict['threadId']
+
+        return self.message, True
+
+    def store_message_info(self, message_info, message_id):
+        """
+        Parse the message info and keep it until the next save.
+
+        Args:
+            message_info (dict): with message info
+            message_id (string): message_id of email
+        """
+        super(BulkMessageBuilder, self).store_message_info(message_info, message_id)
+
+        # Labels retrieved from the API are in the database now, so don't retrieve them again for the next message.
+        db_label_ids = set(label.label_id for label in self.db_labels)
+        self.db_labels.extend(label for label in self.labels if label.label_id not in db_label_ids)
+
+        self.pending_messages.append({
+            'message': self.message,
+            'sender': self.sender,
+            'labels': self.labels,
+            'headers': self.headers,
+            'received_by': self.received_by,
+            'received_by_cc': self.received_by_cc,
+            'attachments': self.attachments,
+        })
+
+    def _get_db_labels(self):
+        """
+        Get the labels of the email account from the database, only once for all messages.
+
+        Returns:
+            list with EmailLabel instances
+        """
+        if self.db_labels is None:
+            self.db_labels = list(self.manager.email_account.labels.all())
+
+        return self.db_labels
+
+    def _create_recipients(self, header_name, header_value):
+        """
+        Keep the recipients based on header, they are resolved for all messages at once on save.
+
+        Args:
+            header_name (string): with name of header
+            header_value (string): with value of header
+        """
+        header_name = header_name.lower()
+
+        for recipient in self._parse_recipients(header_value):
+            if header_name == 'from':
+                self.sender = recipient
+            elif header_name in ['to', 'delivered-to']:
+                self.received_by.add(recipient)
+            elif header_name == 'cc':
+                self.received_by_cc.add(recipient)
+
+    def _get_or_create_recipients(self, recipient_keys):
+        """
+        Get or create the Recipients with a single lookup and a single insert of the missing ones.
+
+        Args:
+            recipient_keys (set): of (name, email_address) tuples
+
+        Returns:
+            dict with the (name, email_address) tuple as key and the Recipient as value
+        """
+        recipients = {}
+
+        def lookup(keys):
+            email_addresses = set(email_address for name, email_address in keys)
+            for recipient in Recipient.objects.filter(email_address__in=email_addresses):
+                key = (recipient.name, recipient.email_address)
+                if key in keys:
+                    recipients[key] = recipient
+
+        lookup(recipient_keys)
+
+        missing_keys = recipient_keys - set(recipients)
+        if missing_keys:
+            try:
+                with transaction.atomic():
+                    Recipient.objects.bulk_create([
+                        Recipient(name=name, email_address=email_address) for name, email_address in missing_keys
+                    ])
+            except IntegrityError:
+                # Some recipients were created by another sync in the meantime.
+                for name, email_address in missing_keys:
+                    Recipient.objects.get_or_create(name=name, email_address=email_address)
+
+            # Bulk create doesn't set the primary keys, so fetch the new recipients.
+            lookup(missing_keys)
+
+        return recipients
+
+    def save(self):
+        """
+        Save all stored messages, each message is written exactly once.
+
+        Raises:
+            IntegrityError if one of the messages was created in the meantime.
+        """
+        if not self.pending_messages:
+            return
+
+        email_account = self.manager.email_account
+        pending_emails = []
+        no_email_message_ids = []
+
+        for pending in self.pending_messages:
+            # Only save if there is a sent date, otherwise it's a chat message.
+            if pending['message'].sent_date and pending['sender']:
+                pending_emails.append(pending)
+            else:
+                logger.warning('Downloaded a message other than an email.')
+                no_email_message_ids.append(pending['message'].message_id)
+
+        with transaction.atomic():
+            if no_email_message_ids:
+                existing_ids = set(NoEmailMessageId.objects.filter(
+                    account=email_account,
+                    message_id__in=no_email_message_ids
+                ).values_list('message_id', flat=True))
+                NoEmailMessageId.objects.bulk_create([
+                    NoEmailMessageId(message_id=message_id, account=email_account)
+                    for message_id in set(no_email_message_ids) - existing_ids
+                ])
+
+            if pending_emails:
+                self._save_emails(pending_emails)
+
+        if pending_emails:
+            from ..search import EmailMessageMapping
+            bulk_update_in_index(EmailMessageMapping, [pending['message'].pk for pending in pending_emails])
+
+        self.pending_messages = []
+
+    def _save_emails(self, pending_emails):
+        """
+        Write the messages and their relations with bulk inserts.
+
+        Args:
+            pending_emails (list): of dicts with the message and its relations
+        """
+        recipient_keys = set()
+        for pending in pending_emails:
+            recipient_keys.add(pending['sender'])
+            recipient_keys.update(pending['received_by'])
+            recipient_keys.update(pending['received_by_cc'])
+
+        recipients = self._get_or_create_recipients(recipient_keys)
+
+        for pending in pending_emails:
+            pending['message'].sender = recipients[pending['sender']]
+            pending['message'].has_attachment = bool(pending['attachments'])
+            pending['message'].search_body = get_stored_search_body(pending['message'])
+            pending['message'].label_flags = EmailMessage.get_label_flags(
+                label.label_id for label in pending['labels']
+            )
+
+        EmailMessage.objects.bulk_create([pending['message'] for pending in pending_emails])
+
+        # Bulk create doesn't set the primary keys, so fetch them.
+        message_pks = dict(EmailMessage.objects.filter(
+            account=self.manager.email_account,
+            message_id__in=[pending['message'].message_id for pending in pending_emails]
+        ).values_list('message_id', 'pk'))
+
+        label_through = EmailMessage.labels.through
+        received_by_through = EmailMessage.received_by.through
+        received_by_cc_through = EmailMessage.received_by_cc.through
+
+        headers = []
+        label_rows = []
+        received_by_rows = []
+        received_by_cc_rows = []
+
+        for pending in pending_emails:
+            message_pk = message_pks[pending['message'].message_id]
+            pending['message'].pk = message_pk
+
+            for header in pending['headers']:
+                header.message_id = message_pk
+                headers.append(header)
+
+            for label_pk in set(label.pk for label in pending['labels']):
+                label_rows.append(label_through(emailmessage_id=message_pk, emaillabel_id=label_pk))
+
+            for key in pending['received_by']:
+                received_by_rows.append(
+                    received_by_through(emailmessage_id=message_pk, recipient_id=recipients[key].pk)
+                )
+
+            for key in pending['received_by_cc']:
+                received_by_cc_rows.append(
+                    received_by_cc_through(emailmessage_id=message_pk, recipient_id=recipients[key].pk)
+                )
+
+            # Attachments are written to the storage on save, unless the tenant has the same file already.
+            for attachment in pending['attachments']:
+                attachment.message_id = message_pk
+                attachment.save()
+
+        EmailHeader.objects.bulk_create(headers)
+        label_through.objects.bulk_create(label_rows)
+        label_counters.add_messages(
+            [(pending['message'], [label.pk for label in pending['labels']]) for pending in pending_emails]
+        )
+        received_by_through.objects.bulk_create(received_by_rows)
+        received_by_cc_through.objects.bulk_create(received_by_cc_rows)
+
+    def cleanup(self):
+        """
+        Cleanup references, to prevent reference cycle
+        """
+        super(BulkMessageBuilder, self).cleanup()
+        self.sender = None
+        self.db_labels = None
+        self.pending_messages = []
@@ -1,4 +1,5 @@
 import logging
+import os
 import random
 import time
 import anyjson
@@ -11,7 +12,7 @@ from googleapiclient.http import MediaIoBaseUpload
 from oauth2client.client import HttpAccessTokenRefreshError
 
 from .credentials import get_credentials, InvalidCredentialsError
-from .services import GmailService
+from .services import GmailService, authorized_http_cache
 
 logger = logging.getLogger(__name__)
 
@@ -47,13 +48,19 @@ class GmailConnector(object):
         self.email_account = email_account
         self.history_id = self.email_account.history_id
 
-        try:
-            credentials = get_credentials(self.email_account)
-        except InvalidCredentialsError:
-            logger.exception('cannot sync account, no valid credentials')
-            raise
-        else:
-            self.gmail_service = GmailService(credentials)
+        # Reuse the credentials and http instance of an earlier task for this account when possible.
+        credentials, http = authorized_http_cache.checkout(self.email_account.id)
+
+        if credentials is None:
+            try:
+                credentials = get_credentials(self.email_account)
+            except InvalidCredentialsError:
+                logger.exception('cannot sync account, no valid credentials')
+                raise
+            else:
+                authorized_http_cache.add(self.email_account.id, credentials)
+
+        self.gmail_service = GmailService(credentials, http=http)
 
     def execute_service_call(self, service):
         """
@@ -124,6 +131,7 @@ class GmailConnector(object):
                 self.email_account.is_authorized = False
                 self.email_account.is_syncing = False
                 self.email_account.save()
+                authorized_http_cache.invalidate(self.email_account.id)
                 logger.error('Invalid access token for account %s' % self.email_account)
                 raise
 
@@ -171,6 +179,21 @@ class GmailConnector(object):
         Returns:
             list with messageIds and threadIds
         """
+        messages = []
+        for page in self.get_message_id_pages():
+            messages.extend(page)
+
+        return messages
+
+    def get_message_id_pages(self):
+        """
+        Fetch all messageIds from the gmail api, one page at a time. Chat messages are filtered out.
+
+        The history id is only updated after the last page is fetched.
+
+        Yields:
+            list with messageIds and threadIds per page
+        """
         # First retrieve user profile including the latest history id.
         response = self.get_history_id()
         history_id = response.get('historyId', 0)
@@ -182,7 +205,7 @@ class GmailConnector(object):
                 q='!in:chats',
             ))
 
-        messages = response['messages'] if 'messages' in response else []
+        yield response.get('messages', [])
 
         # Check if there are more pages.
         while 'nextPageToken' in response:
@@ -193,14 +216,13 @@ class GmailConnector(object):
                 pageToken=page_token,
                 q='!in:chats',
             ))
-            messages.extend(response.get('messages', []))
+
+            yield response.get('messages', [])
 
         if history_id > self.history_id:
             # Store if it's past the current history id.
             self.history_id = history_id
 
-        return messages
-
     def get_message_info(self, message_id):
         """
         Fetch message information given message_id.
@@ -219,6 +241,69 @@ class GmailConnector(object):
 
         return response
 
+    def get_message_info_batch(self, message_ids):
+        """
+        Fetch message information for multiple messages using a single batch request.
+
+        Messages that fail inside the batch (e.g. because of rate limiting) are fetched again with a single request,
+        so the usual retry and backoff handling of execute_service_call applies to them.
+
+        Args:
+            message_ids (list): ids of the messages, at most 100 (Gmail batch limit)
+
+        Returns:
+            dict with the message_id as key and the message info as value, messages that no longer exist are
+            left out
+        """
+        message_infos = {}
+
+        if len(message_ids) == 1:
+            # No need for the overhead of a batch request.
+            try:
+                message_infos[message_ids[0]] = self.get_message_info(message_ids[0])
+            except NotFoundError:
+                pass
+
+            return message_infos
+
+        failed = {}
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                message_infos[request_id] = response
+            else:
+                failed[request_id] = exception
+
+        batch = self.gmail_service.service.new_batch_http_request(callback=callback)
+        for message_id in message_ids:
+            batch.add(self.gmail_service.service.users().messages().get(
+                userId='me',
+                id=message_id,
+                quotaUser=self.email_account.id,
+            ), request_id=message_id)
+
+        try:
+            self.gmail_service.execute_service(batch)
+        except (HttpError, HttpAccessTokenRefreshError):
+            # The batch as a whole failed, fall back on single requests for everything not yet received.
+            logger.warning('Batch request failed for account %s, retrying messages one by one' % self.email_account)
+
+        for message_id in message_ids:
+            if message_id in message_infos:
+                continue
+
+            error = failed.get(message_id)
+            if isinstance(error, HttpError) and error.resp.status == 404:
+                # Message was deleted in the meantime.
+                continue
+
+            try:
+                message_infos[message_id] = self.get_message_info(message_id)
+            except NotFoundError:
+                pass
+
+        return message_infos
+
     def get_label_list(self):
         """
         Fetch all labels from the email account.
@@ -323,17 +408,41 @@ class GmailConnector(object):
             ))
         return response
 
-    def send_email_message(self, message_string, thread_id=None):
-        # Possible TODO: only use MediaIOBaseUpload on large email bodys instead of always:
-        # http://stackoverflow.com/questions/27875858/#33155212
-        fd = StringIO(message_string)
-        media = MediaIoBaseUpload(
-            fd,
+    def _get_message_media(self, message):
+        """
+        Return the media upload for an RFC 822 message.
+
+        Messages larger than GMAIL_RESUMABLE_UPLOAD_SIZE are uploaded in chunks with a resumable upload, so the
+        message is never fully read into memory and a failed chunk is retried instead of the whole message.
+
+        Args:
+            message (string or file): the message, e.g. a file written by spool_message
+        """
+        if isinstance(message, basestring):
+            message = StringIO(message)
+
+        message.seek(0, os.SEEK_END)
+        size = message.tell()
+        message.seek(0)
+
+        if size > settings.GMAIL_RESUMABLE_UPLOAD_SIZE:
+            return MediaIoBaseUpload(
+                message,
+                mimetype='message/rfc822',
+                chunksize=settings.GMAIL_RESUMABLE_CHUNK_SIZE,
+                resumable=True
+            )
+
+        return MediaIoBaseUpload(
+            message,
             mimetype='message/rfc822',
             chunksize=settings.GMAIL_CHUNK_SIZE,
             resumable=settings.GMAIL_UPLOAD_RESUMABLE
         )
 
+    def send_email_message(self, message, thread_id=None):
+        media = self._get_message_media(message)
+
         message_dict = {}
         if thread_id:
             message_dict.update({'threadId': thread_id})
@@ -348,16 +457,8 @@ class GmailConnector(object):
 
         return response
 
-    def create_draft_email_message(self, message_string):
-        # Possible TODO: only use MediaIOBaseUpload on large email bodys instead of always:
-        # http://stackoverflow.com/questions/27875858/#33155212
-        fd = StringIO(message_string)
-        media = MediaIoBaseUpload(
-            fd,
-            mimetype='message/rfc822',
-            chunksize=settings.GMAIL_CHUNK_SIZE,
-            resumable=settings.GMAIL_UPLOAD_RESUMABLE
-        )
+    def create_draft_email_message(self, message):
+        media = self._get_message_media(message)
 
         response = self.execute_service_call(
             self.gmail_service.service.users().drafts().create(
@@ -367,16 +468,8 @@ class GmailConnector(object):
             ))
         return response
 
-    def update_draft_email_message(self, message_string, draft_id):
-        # Possible TODO: only use MediaIOBaseUpload on large email bodys instead of always:
-        # http://stackoverflow.com/questions/27875858/#33155212
-        fd = StringIO(message_string)
-        media = MediaIoBaseUpload(
-            fd,
-            mimetype='message/rfc822',
-            chunksize=settings.GMAIL_CHUNK_SIZE,
-            resumable=settings.GMAIL_UPLOAD_RESUMABLE
-        )
+    def update_draft_email_message(self, message, draft_id):
+        media = self._get_message_media(message)
 
         response = self.execute_service_call(
             self.gmail_service.service.users().drafts().update(
@@ -404,10 +497,34 @@ class GmailConnector(object):
             ))
         return response
 
+    def watch(self, topic_name):
+        """
+        Start or renew the push notifications of changes of the mailbox, Gmail stops them after a week.
+
+        Args:
+            topic_name (str): the Cloud Pub/Sub topic Gmail publishes the notifications to
+
+        Returns:
+            dict with the current historyId and the expiration of the watch in milliseconds since the epoch
+        """
+        return self.execute_service_call(self.gmail_service.service.users().watch(
+            userId='me',
+            body={'topicName': topic_name},
+            quotaUser=self.email_account.id,
+        ))
+
     def cleanup(self):
         """
         Cleanup references, to prevent reference cycle.
         """
+        if self.gmail_service and self.email_account:
+            # Return the http instance, so the next task for this account can reuse it.
+            authorized_http_cache.checkin(
+                self.email_account.id,
+                self.gmail_service.credentials,
+                self.gmail_service.http
+            )
+
         self.gmail_service = None
         self.email_account = None
         self.history_id = None
@@ -0,0 +1,151 @@
+"""
+Unread and total counters of the email messages per EmailLabel.
+
+The counters are changed with atomic increments whenever the labels or read status of messages change, so the count
+of a label is a single read. Code paths that bypass these functions make the counters drift, which reconcile repairs
+periodically.
+"""
+from collections import Counter, defaultdict
+
+from django.db.models import Case, Count, F, IntegerField, Sum, Value, When
+
+from .models.models import EmailLabel, EmailMessage
+
+
+def get_state(email_message):
+    """
+    Return the labels and read status of a stored message, as the counters have counted them.
+
+    Returns:
+        tuple: set of label pks and whether the message is read
+    """
+    if not email_message.pk:
+        return set(), True
+
+    return set(email_message.labels.values_list('pk', flat=True)), email_message.read
+
+
+def apply_changes(changes):
+    """
+    Change the counters of the labels.
+
+    Args:
+        changes (dict): label pk with a (total, unread) tuple to add to its counters
+    """
+    # Labels with the same change are updated at once.
+    labels_per_change = defaultdict(list)
+    for label_pk, change in changes.items():
+        if change != (0, 0):
+            labels_per_change[change].append(label_pk)
+
+    for (total, unread), label_pks in labels_per_change.items():
+        EmailLabel.objects.filter(pk__in=label_pks).update(
+            total=get_changed_count('total', total),
+            unread=get_changed_count('unread', unread),
+        )
+
+
+def get_changed_count(field_name, change):
+    if change >= 0:
+        return F(field_name) + change
+
+    # Counters that drifted are repaired by reconcile, they never go below zero meanwhile.
+    return Case(
+        When(**{'%s__gte' % field_name: -change, 'then': F(field_name) + change}),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def update_message(old_state, new_state):
+    """
+    Update the counters for a message which labels or read status changed.
+
+    Args:
+        old_state (tuple): the state of the message before the change, see get_state
+        new_state (tuple): the state of the message after the change
+    """
+    old_label_pks, old_read = old_state
+    new_label_pks, new_read = new_state
+
+    changes = {}
+    for label_pk in old_label_pks:
+        changes[label_pk] = (-1, -int(not old_read))
+
+    for label_pk in new_label_pks:
+        total, unread = changes.get(label_pk, (0, 0))
+        changes[label_pk] = (total + 1, unread + int(not new_read))
+
+    apply_changes(changes)
+
+
+def add_messages(messages_labels):
+    """
+    Count new messages.
+
+    Args:
+        messages_labels (list): of (message, label pks) tuples
+    """
+    totals = Counter()
+    unreads = Counter()
+    for email_message, label_pks in messages_labels:
+        for label_pk in set(label_pks):
+            totals[label_pk] += 1
+            if not email_message.read:
+                unreads[label_pk] += 1
+
+    apply_changes(dict((label_pk, (total, unreads[label_pk])) for label_pk, total in totals.items()))
+
+
+def remove_messages(email_messages):
+    """
+    Stop counting the messages, call this before they are deleted.
+
+    Args:
+        email_messages (QuerySet): the EmailMessage instances that are deleted
+    """
+    counts = EmailMessage.labels.through.objects.filter(
+        emailmessage__in=email_messages.values('pk'),
+    ).values('emaillabel').annotate(
+        total_count=Count('emailmessage'),
+        unread_count=get_unread_sum(),
+    ).order_by()
+
+    apply_changes(dict(
+        (count['emaillabel'], (-count['total_count'], -count['unread_count'])) for count in counts
+    ))
+
+
+def get_unread_sum():
+    return Sum(Case(
+        When(emailmessage__read=False, then=Value(1)),
+        default=Value(0),
+        output_field=IntegerField(),
+    ))
+
+
+def reconcile(email_account):
+    """
+    Recount the messages of every label of the email account.
+
+    Returns:
+        int: the number of labels which counters were wrong
+    """
+    counts = dict(
+        (count['emaillabel'], (count['total_count'], count['unread_count']))
+        for count in EmailMessage.labels.through.objects.filter(
+            emaillabel__account=email_account,
+        ).values('emaillabel').annotate(
+            total_count=Count('emailmessage'),
+            unread_count=get_unread_sum(),
+        ).order_by()
+    )
+
+    repaired = 0
+    for label_pk, total, unread in email_account.labels.values_list('pk', 'total', 'unread'):
+        count = counts.get(label_pk, (0, 0))
+        if count != (total, unread):
+            EmailLabel.objects.filter(pk=label_pk).update(total=count[0], unread=count[1])
+            repaired += 1
+
+    return repaired
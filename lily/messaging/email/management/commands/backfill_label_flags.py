@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Max
+
+from ...models.models import EmailMessage
+
+
+class Command(BaseCommand):
+    help = """Fill the label flags of the email messages that don't have them yet, one batch of messages at a time.
+
+    Messages without label flags query their labels instead, so this can run while the app is in use."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Number of message ids updated per query.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        max_pk = EmailMessage.objects.aggregate(max_pk=Max('pk'))['max_pk'] or 0
+        flag_per_label = EmailMessage.get_flag_per_label().items()
+        when_flags = ' '.join(['WHEN %s THEN %s'] * len(flag_per_label))
+        flag_params = [value for label_flag in flag_per_label for value in label_flag]
+
+        cursor = connection.cursor()
+        updated = 0
+        # Every batch is committed on its own, so only the rows of one batch are locked at a time.
+        for start in range(0, max_pk + 1, batch_size):
+            cursor.execute(
+                """
+                UPDATE email_emailmessage SET label_flags = COALESCE((
+                    SELECT BIT_OR(CASE email_emaillabel.label_id %s ELSE 0 END)
+                    FROM email_emailmessage_labels
+                    INNER JOIN email_emaillabel ON email_emaillabel.id = email_emailmessage_labels.emaillabel_id
+                    WHERE email_emailmessage_labels.emailmessage_id = email_emailmessage.id
+                ), 0)
+                WHERE id >= %%s AND id < %%s AND label_flags IS NULL
+                """ % when_flags,
+                flag_params + [start, start + batch_size]
+            )
+            updated += cursor.rowcount
+            self.stdout.write('Filled the label flags of %s messages (up to id %s).' % (updated, start + batch_size))
+
+        self.stdout.write('Done.')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ...tasks import reconcile_email_label_counters_scheduler
+
+
+class Command(BaseCommand):
+    help = """Queue a recount of the unread and total counters of the labels of every email account.
+
+    Every account is recounted in its own task, so this doesn't lock the labels of all accounts at once."""
+
+    def handle(self, *args, **options):
+        reconcile_email_label_counters_scheduler.delay()
+
+        self.stdout.write('Queued the recount of the label counters.')
@@ -2,13 +2,16 @@ import logging
 import gc
 
 from django.conf import settings
+from django.db import IntegrityError
 from googleapiclient.errors import HttpError
 
 from lily.celery import app
 from .builders.label import LabelBuilder
-from .builders.message import MessageBuilder
+from .builders.message import BulkMessageBuilder, MessageBuilder
+from . import label_counters
 from .connector import GmailConnector, NotFoundError, LabelNotFoundError
 from .credentials import InvalidCredentialsError
+from .mime import spool_message
 from .models.models import EmailLabel, EmailMessage, NoEmailMessageId
 
 logger = logging.getLogger(__name__)
@@ -40,43 +43,61 @@ class GmailManager(object):
             self.label_builder = LabelBuilder(self)
 
     def full_synchronize(self):
-        message_ids = self.connector.get_all_message_id_list()
+        """
+        Synchronize all messages of the EmailAccount.
 
-        # Check for message_ids that are saved as non email messages.
-        no_message_ids_in_db = set(
-            NoEmailMessageId.objects.filter(
-                account=self.email_account
-            ).values_list('message_id', flat='true')
-        )
+        Message ids are compared with the database and dispatched page by page while they are being listed, so memory
+        usage doesn't depend on the size of the mailbox and downloading starts right away.
+        """
+        batch_size = settings.GMAIL_DOWNLOAD_BATCH_SIZE
 
-        # Check for message_ids that are saved as email messages.
-        message_ids_in_db = set(
-            EmailMessage.objects.filter(
-                account=self.email_account
-            ).values_list('message_id', flat='true')
-        )
+        for page in self.connector.get_message_id_pages():
+            page_message_ids = [message_dict['id'] for message_dict in page]
 
-        # What do we need to do with every email message?
-        for i, message_dict in enumerate(message_ids):
-            logger.debug('Check for existing messages, %s/%s' % (i, len(message_ids)))
-            if message_dict['id'] in no_message_ids_in_db:
-                # Not an email, but chatmessage, skip.
-                pass
-            elif message_dict['id'] not in message_ids_in_db:
-                # Message is new.
-                app.send_task(
-                    'download_email_message',
-                    args=[self.email_account.id, message_dict['id']],
-                    queue='email_first_sync'
-                )
-            else:
-                # We only need to update the labels for this message.
+            # Check for message_ids that are saved as non email messages.
+            no_message_ids_in_db = set(
+                NoEmailMessageId.objects.filter(
+                    account=self.email_account,
+                    message_id__in=page_message_ids
+                ).values_list('message_id', flat=True)
+            )
+
+            # Check for message_ids that are saved as email messages.
+            message_ids_in_db = set(
+                EmailMessage.objects.filter(
+                    account=self.email_account,
+                    message_id__in=page_message_ids
+                ).order_by().values_list('message_id', flat=True)
+            )
+
+            new_message_ids = []
+
+            # What do we need to do with every email message?
+            for message_id in page_message_ids:
+                if message_id in no_message_ids_in_db:
+                    # Not an email, but chatmessage, skip.
+                    pass
+                elif message_id not in message_ids_in_db:
+                    # Message is new.
+                    new_message_ids.append(message_id)
+                else:
+                    # We only need to update the labels for this message.
+                    app.send_task(
+                        'update_labels_for_message',
+                        args=[self.email_account.id, message_id],
+                        queue='email_first_sync'
+                    )
+
+            # Download new messages in chunks, so each task fetches multiple messages with a single batch request.
+            for i in range(0, len(new_message_ids), batch_size):
                 app.send_task(
-                    'update_labels_for_message',
-                    args=[self.email_account.id, message_dict['id']],
+                    'download_email_messages',
+                    args=[self.email_account.id, new_message_ids[i:i + batch_size]],
                     queue='email_first_sync'
                 )
 
+            logger.debug('Queued %s messages for %s' % (len(page_message_ids), self.email_account))
+
         # Finally, add a task to keep track when the sync queue is finished.
         app.send_task(
             'full_sync_finished',
@@ -109,14 +130,59 @@ class GmailManager(object):
             self.message_builder.store_message_info(message_info, message_id)
             self.message_builder.save()
 
+    def download_messages(self, message_ids):
+        """
+        Download multiple messages from Google with a single batch request and parse them into EmailMessages.
+
+        Arguments:
+            message_ids (list): message_ids of the messages
+        """
+        # Messages that are already downloaded only need an update.
+        existing_message_ids = set(EmailMessage.objects.filter(
+            account=self.email_account,
+            message_id__in=message_ids
+        ).order_by().values_list('message_id', flat=True))
+
+        for message_id in existing_message_ids:
+            self.update_labels_for_message(message_id)
+
+        new_message_ids = [message_id for message_id in message_ids if message_id not in existing_message_ids]
+        if not new_message_ids:
+            return
+
+        # Fetch the info from the connector and only store the messages that are still out there.
+        message_infos = self.connector.get_message_info_batch(new_message_ids)
+
+        bulk_message_builder = BulkMessageBuilder(self)
+        try:
+            for message_id in new_message_ids:
+                if message_id not in message_infos:
+                    logger.debug('Message %s already deleted from remote' % message_id)
+                    continue
+
+                bulk_message_builder.store_message_info(message_infos[message_id], message_id)
+
+            bulk_message_builder.save()
+        except IntegrityError:
+            # Some messages were stored by another task in the meantime, so save the messages one by one.
+            logger.warning('Bulk save failed for account %s, saving messages one by one' % self.email_account)
+            for message_id in new_message_ids:
+                if message_id in message_infos:
+                    self.message_builder.store_message_info(message_infos[message_id], message_id)
+                    self.message_builder.save()
+        finally:
+            bulk_message_builder.cleanup()
+
     def sync_by_history(self):
         """
         Synchronize EmailAccount by history.
 
         Fetches the changes from the GMail api and creates tasks for the mutations.
+
+        Returns:
+            bool: whether the mailbox changed since the previous sync
         """
         logger.info('updating history for %s with history_id %s' % (self.email_account, self.email_account.history_id))
-        old_history_id = self.email_account.history_id
 
         try:
             history = self.connector.get_history()
@@ -134,11 +200,11 @@ class GmailManager(object):
                 self.email_account.save()
                 logger.error('Repeated 404 error on incremental syncing. Authorization revoked for account %s' %
                              self.email_account)
-            return
+            return False
 
         self.connector.save_history_id()
         if not len(history):
-            return
+            return False
 
         new_messages = set()
         edit_labels = set()
@@ -181,9 +247,11 @@ class GmailManager(object):
                 new_messages.discard(message['message']['id'])
                 edit_labels.discard(message['message']['id'])
 
-                EmailMessage.objects.filter(
+                deleted_messages = EmailMessage.objects.filter(
                     message_id=message['message']['id'], account=self.email_account
-                ).order_by().delete()
+                ).order_by()
+                label_counters.remove_messages(deleted_messages)
+                deleted_messages.delete()
 
         # Create tasks to download email messages.
         for message_id in new_messages:
@@ -195,11 +263,7 @@ class GmailManager(object):
             logger.info('creating update_labels_for_message for %s', message_id)
             app.send_task('update_labels_for_message', args=[self.email_account.id, message_id])
 
-        # Only update the unread count if the history id was updated.
-        if old_history_id != self.email_account.history_id:
-            # TODO: Find out if there is a better place to update unread count. download_email_message tasks aren't
-            # finished yet.
-            self.update_unread_count()
+        return True
 
     def sync_labels(self):
         """
@@ -260,14 +324,23 @@ class GmailManager(object):
 
     def update_unread_count(self):
         """
-        Update unread count on every label.
+        Recount the unread and total count of every label.
+
+        The counts are kept up to date incrementally, this repairs counts that drifted.
+        """
+        repaired = label_counters.reconcile(self.email_account)
+        if repaired:
+            logger.info('Repaired the counts of %s labels of account %s', repaired, self.email_account)
+
+    def watch(self):
         """
-        pass
-        # logger.debug('Updating unread count for every label, account %s' % self.email_account)
-        # for label in self.email_account.labels.all():
-        #     unread_count = label.messages.filter(read=False).count()
-        #     label.unread = unread_count
-        #     label.save()
+        Start or renew the push notifications of changes of the mailbox.
+
+        Returns:
+            float: the time the notifications expire, in seconds since the epoch
+        """
+        response = self.connector.watch(settings.GMAIL_PUSH_TOPIC)
+        return int(response['expiration']) / 1000.0
 
     def administer_sync_status(self, is_syncing):
         """
@@ -378,6 +451,7 @@ class GmailManager(object):
                 message_info = self.connector.get_short_message_info(email_message.message_id)
             except NotFoundError:
                 logger.debug('Message not available on remote.')
+                label_counters.remove_messages(EmailMessage.objects.filter(pk=email_message.id))
                 EmailMessage.objects.get(pk=email_message.id).delete()
                 return
 
@@ -406,6 +480,7 @@ class GmailManager(object):
                     raise
                 else:
                     # API call to update labelling successfull, so also update the labelling in the database.
+                    old_state = label_counters.get_state(email_message)
                     email_message.labels.remove(
                         *list(EmailLabel.objects.filter(label_id__in=labels['removeLabelIds'],
                                                         account=self.email_account))
@@ -414,11 +489,10 @@ class GmailManager(object):
                         *list(EmailLabel.objects.filter(label_id__in=labels['addLabelIds'],
                                                         account=self.email_account))
                     )
+                    label_counters.update_message(old_state, label_counters.get_state(email_message))
                     # Labels updated in the database, so no need to retry / continue the for-loop.
                     break
 
-        self.update_unread_count()
-
     def toggle_star_email_message(self, email_message, star=True):
         """
         (Un)star a message.
@@ -492,7 +566,6 @@ class GmailManager(object):
             # Store updated message.
             self.message_builder.store_message_info(full_message_dict, message_dict['id'])
             self.message_builder.save()
-            self.update_unread_count()
 
     def delete_email_message(self, email_message):
         """
@@ -505,8 +578,6 @@ class GmailManager(object):
             self.connector.delete_email_message(email_message.message_id)
         except NotFoundError:
             logger.debug('Message already deleted from remote')
-        else:
-            self.update_unread_count()
 
     def send_email_message(self, email_message, thread_id=None):
         """
@@ -517,7 +588,9 @@ class GmailManager(object):
             thread_id (string): Thread ID of original message that is replied or forwarded on
         """
         # Send message.
-        message_dict = self.connector.send_email_message(email_message.as_string(), thread_id)
+        with spool_message(email_message) as message_file:
+            message_dict = self.connector.send_email_message(message_file, thread_id)
+
         try:
             full_message_dict = self.connector.get_message_info(message_dict['id'])
         except NotFoundError:
@@ -526,7 +599,6 @@ class GmailManager(object):
             # Store updated message.
             self.message_builder.store_message_info(full_message_dict, message_dict['id'])
             self.message_builder.save()
-            self.update_unread_count()
 
     def create_draft_email_message(self, email_message):
         """
@@ -536,7 +608,8 @@ class GmailManager(object):
             email_message (instance): Email instance
         """
         # Create draft message.
-        draft_dict = self.connector.create_draft_email_message(email_message.as_string())
+        with spool_message(email_message) as message_file:
+            draft_dict = self.connector.create_draft_email_message(message_file)
 
         try:
             message_dict = self.connector.get_message_info(draft_dict['message']['id'])
@@ -547,7 +620,6 @@ class GmailManager(object):
             self.message_builder.store_message_info(message_dict, draft_dict['message']['id'])
             self.message_builder.message.draft_id = draft_dict.get('id', '')
             self.message_builder.save()
-            self.update_unread_count()
 
     def update_draft_email_message(self, email_message, draft_id):
         """
@@ -558,7 +630,8 @@ class GmailManager(object):
             draft_id (string): id of current draft
         """
         # Update draft message.
-        draft_dict = self.connector.update_draft_email_message(email_message.as_string(), draft_id)
+        with spool_message(email_message) as message_file:
+            draft_dict = self.connector.update_draft_email_message(message_file, draft_id)
 
         try:
             message_dict = self.connector.get_message_info(draft_dict['message']['id'])
@@ -569,7 +642,6 @@ class GmailManager(object):
             self.message_builder.store_message_info(message_dict, draft_dict['message']['id'])
             self.message_builder.message.draft_id = draft_dict.get('id', '')
             self.message_builder.save()
-            self.update_unread_count()
 
     def delete_draft_email_message(self, email_message):
         """
@@ -583,9 +655,11 @@ class GmailManager(object):
         except NotFoundError:
             # Draft exists in Lily but not anymore on remote, so remove it from the database.
             logger.debug('Draft already deleted from remote.')
-            EmailMessage.objects.filter(message_id=email_message.message_id, account=self.email_account).delete()
-        else:
-            self.update_unread_count()
+            deleted_messages = EmailMessage.objects.filter(
+                message_id=email_message.message_id, account=self.email_account
+            )
+            label_counters.remove_messages(deleted_messages)
+            deleted_messages.delete()
 
     def cleanup(self):
         """
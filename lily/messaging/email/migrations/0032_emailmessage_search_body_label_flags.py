@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('email', '0031_auto_20170801_0900'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailmessage',
+            name='search_body',
+            field=models.TextField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='emailmessage',
+            name='label_flags',
+            field=models.IntegerField(null=True),
+        ),
+    ]
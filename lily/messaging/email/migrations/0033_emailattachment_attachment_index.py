@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import lily.messaging.email.models.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('email', '0032_emailmessage_search_body_label_flags'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='emailattachment',
+            name='attachment',
+            field=models.FileField(db_index=True, max_length=255, upload_to=lily.messaging.email.models.models.get_attachment_upload_path),
+        ),
+    ]
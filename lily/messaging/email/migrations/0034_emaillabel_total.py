@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('email', '0033_emailattachment_attachment_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emaillabel',
+            name='total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,95 @@
+import base64
+from email.generator import Generator, _make_boundary
+from email.mime.base import MIMEBase
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+# Number of bytes read from storage at once, a multiple of 57 bytes so every chunk encodes to full 76 character lines.
+BASE64_CHUNK_SIZE = 57 * 1024
+
+
+class MIMEStorageFile(MIMEBase):
+    """
+    Base64 encoded MIME part of which the content is read from storage when the message is written.
+    """
+    def __init__(self, main_type, sub_type, storage_name, **params):
+        MIMEBase.__init__(self, main_type, sub_type, **params)
+        self['Content-Transfer-Encoding'] = 'base64'
+        self.storage_name = storage_name
+
+    def write_payload(self, fp):
+        storage_file = default_storage._open(self.storage_name)
+        storage_file.open()
+
+        try:
+            chunk = storage_file.read(BASE64_CHUNK_SIZE)
+            while chunk:
+                next_chunk = storage_file.read(BASE64_CHUNK_SIZE)
+                encoded = base64.encodestring(chunk)
+                if not next_chunk and not chunk.endswith('\n'):
+                    # Like email.encoders.encode_base64, don't end the payload with a newline.
+                    encoded = encoded[:-1]
+                fp.write(encoded)
+                chunk = next_chunk
+        finally:
+            storage_file.close()
+
+
+class MessageWriter(object):
+    """
+    Write a MIME message to a file without building the whole message in memory.
+
+    The email Generator renders every multipart in memory before writing it, so multiparts are written here and
+    only the other parts are written with a Generator. MIMEStorageFile parts are streamed from storage.
+    """
+    def __init__(self, fp):
+        self.fp = fp
+
+    def flatten(self, msg):
+        if isinstance(msg, MIMEStorageFile):
+            self._write_headers(msg)
+            msg.write_payload(self.fp)
+        elif msg.is_multipart():
+            self._write_multipart(msg)
+        else:
+            Generator(self.fp, mangle_from_=False).flatten(msg)
+
+    def _write_headers(self, msg):
+        Generator(self.fp, mangle_from_=False)._write_headers(msg)
+
+    def _write_multipart(self, msg):
+        boundary = msg.get_boundary()
+        if not boundary:
+            boundary = _make_boundary()
+            msg.set_boundary(boundary)
+
+        self._write_headers(msg)
+
+        if msg.preamble is not None:
+            self.fp.write(msg.preamble + '\n')
+
+        self.fp.write('--' + boundary + '\n')
+        for index, part in enumerate(msg.get_payload()):
+            if index:
+                self.fp.write('\n--' + boundary + '\n')
+            self.flatten(part)
+        self.fp.write('\n--' + boundary + '--\n')
+
+        if msg.epilogue is not None:
+            self.fp.write(msg.epilogue)
+
+
+def spool_message(msg):
+    """
+    Write a MIME message to a temporary file, which is only kept in memory for small messages.
+
+    Returns:
+        file: the RFC 822 message, positioned at the start
+    """
+    fp = tempfile.SpooledTemporaryFile(max_size=settings.EMAIL_SPOOL_MAX_MEMORY_SIZE)
+    MessageWriter(fp).flatten(msg)
+    fp.seek(0)
+
+    return fp
@@ -1,10 +1,6 @@
 import anyjson
-from email import Encoders
 from email.header import Header
-from email.mime.audio import MIMEAudio
-from email.mime.base import MIMEBase
-from email.mime.image import MIMEImage
-from email.mime.text import MIMEText
+import hashlib
 from email.utils import parseaddr
 import logging
 import mimetypes
@@ -16,8 +12,8 @@ from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUpload
 from django.core.files.storage import default_storage
 from django.core.mail import SafeMIMEText, SafeMIMEMultipart
 from django.core.urlresolvers import reverse
-from django.db import models
-from django.db.models.signals import post_delete
+from django.db import connection, models, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 from django_extensions.db.models import TimeStampedModel
 from django.utils.translation import ugettext_lazy as _
@@ -27,6 +23,7 @@ from lily.tenant.models import TenantMixin
 from lily.users.models import LilyUser
 from lily.utils.models.mixins import DeletedMixin
 
+from ..mime import MIMEStorageFile
 from ..sanitize import sanitize_html_email
 
 
@@ -46,6 +43,72 @@ def get_attachment_upload_path(instance, filename):
     }
 
 
+def save_attachment_blob(tenant_id, content, filename):
+    """
+    Store the content of an email attachment, unless the tenant already has an attachment with the same content and
+    filename.
+
+    The file is locked until the end of the transaction, so save the attachment in the same transaction, see
+    lock_attachment_blob.
+
+    Args:
+        tenant_id (int): the tenant of the attachment
+        content (File): the content of the attachment
+        filename (str): the filename of the attachment
+
+    Returns:
+        str: the name of the file in the storage
+    """
+    content_hash = hashlib.sha1()
+    for chunk in content.chunks():
+        content_hash.update(chunk)
+
+    path_kwargs = {
+        'tenant_id': tenant_id,
+        'content_hash': content_hash.hexdigest(),
+        'filename': '',
+    }
+    max_filename_length = EmailAttachment._meta.get_field('attachment').max_length - len(
+        settings.EMAIL_ATTACHMENT_BLOB_UPLOAD_TO % path_kwargs
+    )
+    if len(filename) > max_filename_length:
+        root, ext = os.path.splitext(filename)
+        filename = root[:max_filename_length - len(ext)] + ext
+
+    path_kwargs['filename'] = filename
+    name = settings.EMAIL_ATTACHMENT_BLOB_UPLOAD_TO % path_kwargs
+
+    lock_attachment_blob(name)
+    if not default_storage.exists(name):
+        content.seek(0)
+        name = default_storage.save(name, content)
+
+    return name
+
+
+def lock_attachment_blob(name):
+    """
+    Lock the stored file with the given name until the end of the transaction.
+
+    Reusing a file for a new attachment and deleting the file of the last attachment that referred to it are
+    serialized this way, otherwise the file could be deleted while the new attachment is saved.
+    """
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+
+    # Postgres advisory locks are identified by a bigint.
+    lock_id = int(hashlib.sha1(name).hexdigest()[:15], 16)
+    connection.cursor().execute('SELECT pg_advisory_xact_lock(%s)', [lock_id])
+
+
+def is_attachment_blob_referenced(name):
+    """
+    Return whether any attachment still refers to the stored file with the given name.
+    """
+    return (EmailAttachment.objects.filter(attachment=name).exists() or
+            EmailOutboxAttachment.objects.filter(attachment=name).exists())
+
+
 def get_template_attachment_upload_path(instance, filename):
     return settings.EMAIL_TEMPLATE_ATTACHMENT_UPLOAD_TO % {
         'tenant_id': instance.tenant_id,
@@ -151,7 +214,9 @@ class EmailLabel(models.Model):
     label_type = models.IntegerField(choices=LABEL_TYPES, default=LABEL_SYSTEM)
     label_id = models.CharField(max_length=255)
     name = models.CharField(max_length=255)
-    unread = models.PositiveIntegerField(default=0)  # Number of unread email messages with this label.
+    # Number of unread and all email messages with this label, see lily.messaging.email.label_counters.
+    unread = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
 
     def __unicode__(self):
         return self.name
@@ -180,12 +245,25 @@ class EmailMessage(models.Model):
     """
     EmailMessage has all information from an email message.
     """
+    # Bits of label_flags, the system labels which are checked for every message.
+    FLAG_INBOX = 1
+    FLAG_TRASH = 2
+    FLAG_STAR = 4
+    FLAG_SPAM = 8
+    FLAG_DRAFT = 16
+    FLAG_IMPORTANT = 32
+
     account = models.ForeignKey(EmailAccount, related_name='messages')
     body_html = models.TextField(default='')
     body_text = models.TextField(default='')
+    # Plain text version of the html body which is indexed, so the html doesn't have to be parsed on every index.
+    # Messages with a plain text body are indexed with that body instead, so they don't have a search body.
+    search_body = models.TextField(null=True, blank=True)
     draft_id = models.CharField(max_length=50, db_index=True, default='')
     has_attachment = models.BooleanField(default=False)
     labels = models.ManyToManyField(EmailLabel, related_name='messages')
+    # Flags of the system labels of the message, None if they weren't determined yet.
+    label_flags = models.IntegerField(null=True)
     message_id = models.CharField(max_length=50, db_index=True)
     read = models.BooleanField(default=False, db_index=True)
     received_by = models.ManyToManyField(Recipient, related_name='received_messages')
@@ -234,12 +312,46 @@ class EmailMessage(models.Model):
         else:
             return ''
 
+    @classmethod
+    def get_label_flags(cls, label_ids):
+        """
+        Return the label_flags for a message with the given label ids.
+        """
+        label_flags = 0
+        label_ids = set(label_ids)
+        for label_id, flag in cls.get_flag_per_label().items():
+            if label_id in label_ids:
+                label_flags |= flag
+
+        return label_flags
+
+    @classmethod
+    def get_flag_per_label(cls):
+        return {
+            settings.GMAIL_LABEL_INBOX: cls.FLAG_INBOX,
+            settings.GMAIL_LABEL_TRASH: cls.FLAG_TRASH,
+            settings.GMAIL_LABEL_STAR: cls.FLAG_STAR,
+            settings.GMAIL_LABEL_SPAM: cls.FLAG_SPAM,
+            settings.GMAIL_LABEL_DRAFT: cls.FLAG_DRAFT,
+            settings.GMAIL_LABEL_IMPORTANT: cls.FLAG_IMPORTANT,
+        }
+
+    def update_label_flags(self):
+        """
+        Determine the label_flags from the labels in the database and store them.
+        """
+        self.label_flags = self.get_label_flags(self.labels.values_list('label_id', flat=True))
+        EmailMessage.objects.filter(pk=self.pk).update(label_flags=self.label_flags)
+
     def fast_label_check(self, label_name):
         """
         Do a label check that checks if a field is prefetched, making it way
         faster for optimized queries.
         """
-        if hasattr(self, '_prefetched_objects_cache') and 'labels' in self._prefetched_objects_cache:
+        flag = self.get_flag_per_label().get(label_name)
+        if flag and self.label_flags is not None:
+            return bool(self.label_flags & flag)
+        elif hasattr(self, '_prefetched_objects_cache') and 'labels' in self._prefetched_objects_cache:
             return label_name in [label.label_id for label in self.labels.all()]
         else:
             return self.labels.filter(label_id=label_name).exists()
@@ -298,7 +410,12 @@ class EmailMessage(models.Model):
         """
         Return the reply to address if it is present as a header, otherwise use email address of the sender.
         """
-        header = self.headers.filter(name__istartswith='reply-to').first()
+        if hasattr(self, '_prefetched_objects_cache') and 'headers' in self._prefetched_objects_cache:
+            headers = [header for header in self.headers.all() if header.name.lower().startswith('reply-to')]
+            header = headers[0] if headers else None
+        else:
+            header = self.headers.filter(name__istartswith='reply-to').first()
+
         if header:
             # A reply-to header can contain a plain email address, an email address enclosed by brackets,
             # or has a "name" <foo@bar.com> construction.
@@ -335,12 +452,23 @@ class EmailAttachment(models.Model):
     """
     Email attachment for an EmailMessage.
     """
-    attachment = models.FileField(upload_to=get_attachment_upload_path, max_length=255)
+    # Attachments with the same content and filename share their file, see save_attachment_blob.
+    attachment = models.FileField(upload_to=get_attachment_upload_path, max_length=255, db_index=True)
     cid = models.TextField(default='')
     inline = models.BooleanField(default=False)
     message = models.ForeignKey(EmailMessage, related_name='attachments')
     size = models.PositiveIntegerField(default=0)
 
+    def save(self, *args, **kwargs):
+        # The stored file stays locked until the attachment refers to it.
+        with transaction.atomic():
+            if self.attachment and not self.attachment._committed:
+                tenant_id = getattr(self, 'tenant_id', None) or self.message.tenant_id
+                self.attachment.name = save_attachment_blob(tenant_id, self.attachment.file, self.attachment.name)
+                self.attachment._committed = True
+
+            super(EmailAttachment, self).save(*args, **kwargs)
+
     def __unicode__(self):
         return self.attachment.name.split('/')[-1]
 
@@ -534,34 +662,19 @@ class EmailOutboxMessage(TenantMixin, models.Model):
             if attachment.inline:
                 continue
 
-            try:
-                storage_file = default_storage._open(attachment.attachment.name)
-            except IOError:
-                logger.exception('Couldn\'t get attachment, not sending %s' % self.id)
+            if not default_storage.exists(attachment.attachment.name):
+                logger.error('Couldn\'t get attachment, not sending %s' % self.id)
                 return False
 
             filename = get_attachment_filename_from_url(attachment.attachment.name)
 
-            storage_file.open()
-            content = storage_file.read()
-            storage_file.close()
-
             content_type, encoding = mimetypes.guess_type(filename)
             if content_type is None or encoding is not None:
                 content_type = 'application/octet-stream'
             main_type, sub_type = content_type.split('/', 1)
 
-            if main_type == 'text':
-                msg = MIMEText(content, _subtype=sub_type)
-            elif main_type == 'image':
-                msg = MIMEImage(content, _subtype=sub_type)
-            elif main_type == 'audio':
-                msg = MIMEAudio(content, _subtype=sub_type)
-            else:
-                msg = MIMEBase(main_type, sub_type)
-                msg.set_payload(content)
-                Encoders.encode_base64(msg)
-
+            # The content is read from storage when the message is written, see spool_message.
+            msg = MIMEStorageFile(main_type, sub_type, attachment.attachment.name)
             msg.add_header('Content-Disposition', 'attachment', filename=os.path.basename(filename))
 
             email_message.attach(msg)
@@ -570,9 +683,10 @@ class EmailOutboxMessage(TenantMixin, models.Model):
         for inline_header in inline_headers:
             main_type, sub_type = inline_header['content-type'].split('/', 1)
             if main_type == 'image':
-                msg = MIMEImage(
-                    inline_header['content'],
-                    _subtype=sub_type,
+                msg = MIMEStorageFile(
+                    main_type,
+                    sub_type,
+                    inline_header['storage-name'],
                     name=os.path.basename(inline_header['content-filename'])
                 )
                 msg.add_header(
@@ -612,4 +726,40 @@ class EmailOutboxAttachment(TenantMixin):
 def post_delete_mail_attachment_handler(sender, **kwargs):
     attachment = kwargs['instance']
     storage, filename = attachment.attachment.storage, attachment.attachment.name
-    storage.delete(filename)
+
+    # The file can be shared with other attachments, so only delete it when the last reference is gone. Deletes run
+    # in a transaction, so the lock is held until the attachment is gone.
+    lock_attachment_blob(filename)
+    if not is_attachment_blob_referenced(filename):
+        storage.delete(filename)
+
+
+@receiver(m2m_changed, sender=EmailMessage.labels.through)
+def m2m_changed_email_message_labels_handler(sender, instance, action, reverse, pk_set, **kwargs):
+    # Keep the label flags of the messages in sync with their labels.
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+
+    if not reverse:
+        # The message builder sets the flags itself once all labels are saved.
+        if not getattr(instance, 'skip_signal', False):
+            instance.update_label_flags()
+    elif pk_set:
+        for email_message in EmailMessage.objects.filter(pk__in=pk_set):
+            email_message.update_label_flags()
+
+
+@receiver(post_save, sender=EmailAccount)
+def post_save_email_account_handler(sender, instance, **kwargs):
+    if not instance.is_authorized or instance.is_deleted:
+        # Don't reuse cached credentials of accounts that aren't authorized anymore.
+        from ..services import authorized_http_cache
+        authorized_http_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=GmailCredentialsModel)
+@receiver(post_delete, sender=GmailCredentialsModel)
+def post_change_gmail_credentials_handler(sender, instance, **kwargs):
+    # New credentials were stored (e.g. the account was authorized again), so drop the cached ones.
+    from ..services import authorized_http_cache
+    authorized_http_cache.invalidate(instance.pk)
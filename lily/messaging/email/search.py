@@ -1,8 +1,7 @@
-from bs4 import BeautifulSoup
 from lily.search.base_mapping import BaseMapping
 
 from .models.models import EmailMessage
-from lily.messaging.email.utils import convert_br_to_newline
+from lily.messaging.email.utils import get_search_body
 
 
 class EmailMessageMapping(BaseMapping):
@@ -163,7 +162,8 @@ class EmailMessageMapping(BaseMapping):
             'received_by_cc_name': [receiver.name for receiver in received_by_cc if receiver.name],
             'message_id': obj.message_id,
             'thread_id': obj.thread_id,
-            'body': obj.body_text or cls.body_html_parsed(obj),
+            # Html messages stored before the search body existed still need their body parsed.
+            'body': obj.body_text or obj.search_body or get_search_body(obj),
             'is_trashed': obj.is_trashed,
             'is_starred': obj.is_starred,
             'is_spam': obj.is_spam,
@@ -174,9 +174,3 @@ class EmailMessageMapping(BaseMapping):
     @classmethod
     def has_deleted(cls):
         return False
-
-    @classmethod
-    def body_html_parsed(cls, obj):
-        soup = BeautifulSoup(obj.body_html, 'lxml')
-        soup = convert_br_to_newline(soup)
-        return soup.get_text()
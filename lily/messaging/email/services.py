@@ -1,21 +1,129 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
 import httplib2
+from django.conf import settings
+from googleapiclient.discovery import DISCOVERY_URI, build_from_document
+from googleapiclient.errors import HttpError
+
+_discovery_document = None
+_discovery_document_lock = threading.Lock()
+
+
+def get_discovery_document():
+    """
+    Return the parsed discovery document of the Gmail API.
+
+    The document is only retrieved once per process, instead of on every build of a service.
+
+    Returns:
+        dict with the discovery document
+    """
+    global _discovery_document
+
+    with _discovery_document_lock:
+        if _discovery_document is None:
+            uri = DISCOVERY_URI.format(api='gmail', apiVersion='v1')
+            response, content = httplib2.Http().request(uri)
+
+            if response.status >= 400:
+                raise HttpError(response, content, uri=uri)
+
+            _discovery_document = json.loads(content)
+
+    return _discovery_document
+
+
+class AuthorizedHttpCache(object):
+    """
+    Bounded LRU cache with the credentials and idle authorized http instances per email account.
+
+    An http instance is checked out for the lifetime of a connector and returned on cleanup, so concurrent tasks for
+    the same email account never share an http instance.
+    """
+    max_idle_per_account = 4
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, account_id, credentials):
+        """
+        Cache freshly loaded credentials for the email account.
+        """
+        with self.lock:
+            self.entries.pop(account_id, None)
+            self.entries[account_id] = {
+                'credentials': credentials,
+                'idle': [],
+                'created': time.time(),
+            }
+
+            while len(self.entries) > settings.GMAIL_SERVICE_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def checkout(self, account_id):
+        """
+        Get the cached credentials and an idle http instance for the email account.
+
+        Returns:
+            tuple with the credentials (or None when not cached) and an http instance (or None when none is idle)
+        """
+        with self.lock:
+            entry = self.entries.pop(account_id, None)
+            if entry is None:
+                return None, None
+
+            if time.time() - entry['created'] > settings.GMAIL_SERVICE_CACHE_TIMEOUT or entry['credentials'].invalid:
+                return None, None
+
+            # Mark the entry as most recently used.
+            self.entries[account_id] = entry
+
+            http = entry['idle'].pop() if entry['idle'] else None
+            return entry['credentials'], http
+
+    def checkin(self, account_id, credentials, http):
+        """
+        Return an http instance for reuse, unless the cache entry was invalidated in the meantime.
+        """
+        if http is None:
+            return
+
+        with self.lock:
+            entry = self.entries.get(account_id)
+            if entry and entry['credentials'] is credentials and len(entry['idle']) < self.max_idle_per_account:
+                entry['idle'].append(http)
+
+    def invalidate(self, account_id):
+        with self.lock:
+            self.entries.pop(account_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
 
-from googleapiclient.discovery import build
+authorized_http_cache = AuthorizedHttpCache()
 
 
 class GmailService(object):
+    credentials = None
     http = None
     service = None
 
-    def __init__(self, credentials):
-        self.http = self.authorize(credentials)
+    def __init__(self, credentials, http=None):
+        self.credentials = credentials
+        self.http = http or self.authorize(credentials)
         self.service = self.build_service()
 
     def authorize(self, credentials):
         return credentials.authorize(httplib2.Http())
 
     def build_service(self):
-        return build('gmail', 'v1', http=self.http)
+        return build_from_document(get_discovery_document(), http=self.http)
 
     def execute_service(self, service):
         return service.execute(http=self._get_http())
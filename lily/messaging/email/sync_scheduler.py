@@ -0,0 +1,186 @@
+"""
+Scheduling of the incremental synchronization of email accounts.
+
+Every account has a sync interval that starts at GMAIL_SYNC_MIN_INTERVAL and doubles after each sync that found no
+changes, up to GMAIL_SYNC_MAX_INTERVAL, so idle mailboxes are polled less often. Gmail push notifications request a
+sync as soon as a mailbox changes, so accounts with an active watch are only polled at the maximum interval.
+
+The state is kept in the cache, losing it only makes the accounts sync sooner.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+SYNC_STATE_KEY = 'email_sync_state_%s'
+SYNC_LOCK_KEY = 'email_sync_lock_%s'
+SYNC_REQUESTED_KEY = 'email_sync_requested_%s'
+WATCH_EXPIRES_KEY = 'email_watch_expires_%s'
+LABELS_SYNCED_KEY = 'email_labels_synced_%s'
+
+# Seconds a sync is considered queued or running, when the task doesn't finish (e.g. the worker was killed).
+SYNC_LOCK_TIMEOUT = 15 * 60
+# Seconds the state of an account is kept, accounts without state are synced at the minimum interval.
+SYNC_STATE_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def get_state(account_id):
+    """
+    Return the sync state of an account.
+
+    Returns:
+        dict: with the time of the 'last_sync' and the 'last_change', the current 'interval' and the queue 'lag' of
+            the last sync in seconds, empty if the account wasn't synced yet
+    """
+    return cache.get(SYNC_STATE_KEY % account_id) or {}
+
+
+def get_due_account_ids(account_ids):
+    """
+    Return the ids of the accounts that are due for an incremental sync.
+    """
+    keys = [SYNC_STATE_KEY % account_id for account_id in account_ids]
+    keys += [WATCH_EXPIRES_KEY % account_id for account_id in account_ids]
+    values = cache.get_many(keys)
+    now = time.time()
+
+    due_account_ids = []
+    for account_id in account_ids:
+        state = values.get(SYNC_STATE_KEY % account_id, {})
+        interval = state.get('interval', settings.GMAIL_SYNC_MIN_INTERVAL)
+
+        if values.get(WATCH_EXPIRES_KEY % account_id, 0) > now:
+            # Push notifications trigger the syncs, polling is only a fallback for missed notifications.
+            interval = settings.GMAIL_SYNC_MAX_INTERVAL
+
+        if state.get('last_sync', 0) + interval <= now:
+            due_account_ids.append(account_id)
+
+    return due_account_ids
+
+
+def enqueue_sync(account_id):
+    """
+    Enqueue an incremental sync of the account, unless one is queued or running already.
+
+    Returns:
+        bool: whether a sync was enqueued
+    """
+    from .tasks import incremental_synchronize_email_account
+
+    # The lock holds the enqueue time, to determine the queue lag when the sync starts.
+    if not cache.add(SYNC_LOCK_KEY % account_id, time.time(), SYNC_LOCK_TIMEOUT):
+        return False
+
+    incremental_synchronize_email_account.apply_async(
+        args=(account_id,),
+        max_retries=1,
+        default_retry_delay=100,
+    )
+    return True
+
+
+def request_sync(account_id):
+    """
+    Sync the account as soon as possible, e.g. after a push notification that the mailbox changed.
+    """
+    if not enqueue_sync(account_id):
+        # The running sync might have missed the change, so sync again when it's done.
+        cache.set(SYNC_REQUESTED_KEY % account_id, True, SYNC_LOCK_TIMEOUT)
+
+
+def start_sync(account_id):
+    """
+    Mark the start of the sync of an account.
+
+    Returns:
+        float: the seconds the sync was queued, or None if unknown
+    """
+    # The sync covers all changes requested so far.
+    cache.delete(SYNC_REQUESTED_KEY % account_id)
+
+    enqueued = cache.get(SYNC_LOCK_KEY % account_id)
+    return time.time() - enqueued if enqueued else None
+
+
+def finish_sync(account_id, changed, lag):
+    """
+    Adapt the sync interval of an account to whether the mailbox changed, and release the sync.
+    """
+    state = get_state(account_id)
+    now = time.time()
+
+    if changed:
+        state['interval'] = settings.GMAIL_SYNC_MIN_INTERVAL
+        state['last_change'] = now
+    else:
+        state['interval'] = min(
+            state.get('interval', settings.GMAIL_SYNC_MIN_INTERVAL) * 2,
+            settings.GMAIL_SYNC_MAX_INTERVAL
+        )
+
+    state['last_sync'] = now
+    state['lag'] = lag
+    cache.set(SYNC_STATE_KEY % account_id, state, SYNC_STATE_TIMEOUT)
+    cache.delete(SYNC_LOCK_KEY % account_id)
+
+    if cache.get(SYNC_REQUESTED_KEY % account_id):
+        request_sync(account_id)
+
+
+def set_watch_expires(account_id, expires):
+    cache.set(WATCH_EXPIRES_KEY % account_id, expires, max(int(expires - time.time()), 1))
+
+
+def get_watch_expires(account_id):
+    return cache.get(WATCH_EXPIRES_KEY % account_id)
+
+
+def get_watch_renewal_account_ids(account_ids):
+    """
+    Return the ids of the accounts without push notifications or with notifications that expire within a day.
+    """
+    values = cache.get_many([WATCH_EXPIRES_KEY % account_id for account_id in account_ids])
+    renew_before = time.time() + 24 * 60 * 60
+
+    return [
+        account_id for account_id in account_ids
+        if values.get(WATCH_EXPIRES_KEY % account_id, 0) < renew_before
+    ]
+
+
+def get_label_sync_account_ids(account_ids):
+    """
+    Return the ids of the accounts that changed since their labels were synced, or whose labels are outdated.
+
+    Renamed labels don't show up in the history of a mailbox, so the labels of idle accounts are synced every
+    GMAIL_LABEL_SYNC_MAX_AGE seconds, when the time of their last label sync expires.
+    """
+    keys = [SYNC_STATE_KEY % account_id for account_id in account_ids]
+    keys += [LABELS_SYNCED_KEY % account_id for account_id in account_ids]
+    values = cache.get_many(keys)
+
+    label_sync_account_ids = []
+    for account_id in account_ids:
+        labels_synced = values.get(LABELS_SYNCED_KEY % account_id)
+        last_change = values.get(SYNC_STATE_KEY % account_id, {}).get('last_change', 0)
+
+        if labels_synced is None or last_change >= labels_synced:
+            label_sync_account_ids.append(account_id)
+
+    return label_sync_account_ids
+
+
+def set_labels_synced(account_id, synced):
+    cache.set(LABELS_SYNCED_KEY % account_id, synced, settings.GMAIL_LABEL_SYNC_MAX_AGE)
+
+
+def get_sync_status(account_id):
+    """
+    Return the sync state of an account with the expiration of its push notifications, see get_state.
+    """
+    status = get_state(account_id)
+    status['watch_expires'] = get_watch_expires(account_id)
+    status['sync_in_progress'] = cache.get(SYNC_LOCK_KEY % account_id) is not None
+
+    return status
@@ -1,15 +1,17 @@
 import logging
+import time
 import traceback
 
 from celery.task import task
-from django.core.files.base import ContentFile
-from django.core.files.storage import default_storage
+from django.conf import settings
+from django.db import transaction
 from oauth2client.client import HttpAccessTokenRefreshError
 
 from lily.utils.functions import post_intercom_event
+from . import label_counters, sync_scheduler
 from .manager import GmailManager
 from .models.models import (EmailAccount, EmailMessage, EmailOutboxMessage, EmailTemplateAttachment,
-                            EmailOutboxAttachment, EmailAttachment)
+                            EmailOutboxAttachment, EmailAttachment, lock_attachment_blob)
 
 logger = logging.getLogger(__name__)
 
@@ -17,9 +19,12 @@ logger = logging.getLogger(__name__)
 @task(name='synchronize_email_account_scheduler')
 def synchronize_email_account_scheduler():
     """
-    Start new tasks for every active mailbox to synchronize.
+    Start new tasks for every mailbox that is due to synchronize, see lily.messaging.email.sync_scheduler.
     """
-    for email_account in EmailAccount.objects.filter(is_authorized=True, is_deleted=False):
+    email_accounts = list(EmailAccount.objects.filter(is_authorized=True, is_deleted=False))
+    due_account_ids = set(sync_scheduler.get_due_account_ids([email_account.pk for email_account in email_accounts]))
+
+    for email_account in email_accounts:
         logger.debug('Scheduling sync for %s', email_account)
 
         if email_account.full_sync_needed:
@@ -30,25 +35,55 @@ def synchronize_email_account_scheduler():
                 max_retries=1,
                 default_retry_delay=100,
             )
-        elif not email_account.is_syncing:
+        elif not email_account.is_syncing and email_account.pk in due_account_ids:
             # The email account is done with a full synchroniazation, so initiate an incremental synchronization.
-            logger.info('Adding task for incremental sync for: %s', email_account)
-            incremental_synchronize_email_account.apply_async(
-                args=(email_account.pk,),
-                max_retries=1,
-                default_retry_delay=100,
-            )
+            # Accounts with a sync in progress already are skipped.
+            if sync_scheduler.enqueue_sync(email_account.pk):
+                logger.info('Adding task for incremental sync for: %s', email_account)
 
 
 @task(name='synchronize_labels_scheduler')
 def synchronize_labels_scheduler():
-    for email_account in EmailAccount.objects.filter(is_authorized=True, is_deleted=False):
+    email_accounts = EmailAccount.objects.filter(is_authorized=True, is_deleted=False).values_list('pk', flat=True)
+
+    # Only sync the labels of accounts that changed since their last label sync.
+    for account_id in sync_scheduler.get_label_sync_account_ids(list(email_accounts)):
         synchronize_labels.apply_async(
-            args=(email_account.pk,),
+            args=(account_id,),
             max_retries=1,
             default_retry_delay=100,
         )
-        logger.info('Adding task for label sync for: %s', email_account)
+        logger.info('Adding task for label sync for: %s', account_id)
+
+
+@task(name='renew_email_account_watches_scheduler')
+def renew_email_account_watches_scheduler():
+    """
+    Start or renew the push notifications of every mailbox without notifications or with expiring notifications.
+    """
+    if not settings.GMAIL_PUSH_TOPIC:
+        return
+
+    email_accounts = EmailAccount.objects.filter(is_authorized=True, is_deleted=False).values_list('pk', flat=True)
+
+    for account_id in sync_scheduler.get_watch_renewal_account_ids(list(email_accounts)):
+        watch_email_account.apply_async(
+            args=(account_id,),
+            max_retries=1,
+            default_retry_delay=100,
+        )
+        logger.info('Adding task for watch renewal for: %s', account_id)
+
+
+@task(name='reconcile_email_label_counters_scheduler')
+def reconcile_email_label_counters_scheduler():
+    """
+    Recount the unread and total counts of the labels of every mailbox, to repair counts that drifted.
+    """
+    email_accounts = EmailAccount.objects.filter(is_deleted=False).values_list('pk', flat=True)
+
+    for account_id in email_accounts:
+        reconcile_email_label_counters.apply_async(args=(account_id,))
 
 
 @task(name='incremental_synchronize_email_account', logger=logger)
@@ -59,18 +94,22 @@ def incremental_synchronize_email_account(account_id):
     Args:
         account_id (int): id of the EmailAccount
     """
+    lag = sync_scheduler.start_sync(account_id)
+    changed = False
+
     try:
         email_account = EmailAccount.objects.get(pk=account_id, is_deleted=False)
     except EmailAccount.DoesNotExist:
         logger.warning('EmailAccount no longer exists: %s', account_id)
+        sync_scheduler.finish_sync(account_id, changed, lag)
         return False
     else:
         if email_account.is_authorized:
             manager = None
             try:
                 manager = GmailManager(email_account)
-                manager.sync_by_history()
-                logger.info('History page sync done for: %s', email_account)
+                changed = manager.sync_by_history()
+                logger.info('History page sync done for: %s (queued for %s seconds)', email_account, lag)
             except HttpAccessTokenRefreshError:
                 logger.warning('Not syncing, no authorization for: %s', email_account)
                 pass
@@ -82,6 +121,8 @@ def incremental_synchronize_email_account(account_id):
         else:
             logger.warning('Not syncing, no authorization for: %s', email_account)
 
+    sync_scheduler.finish_sync(account_id, changed, lag)
+
 
 @task(name='full_synchronize_email_account', logger=logger)
 def full_synchronize_email_account(account_id):
@@ -163,7 +204,9 @@ def synchronize_labels(account_id):
             manager = None
             try:
                 manager = GmailManager(email_account)
+                synced = time.time()
                 manager.sync_labels()
+                sync_scheduler.set_labels_synced(account_id, synced)
                 logger.debug('Label synchronize for: %s', email_account)
             except HttpAccessTokenRefreshError:
                 logger.warning('Not syncing, no authorization for: %s', email_account)
@@ -177,6 +220,55 @@ def synchronize_labels(account_id):
             logger.warning('Not syncing, no authorization for: %s', email_account)
 
 
+@task(name='watch_email_account', logger=logger)
+def watch_email_account(account_id):
+    """
+    Start or renew the push notifications of changes of the email account.
+
+    Args:
+        account_id (int): id of the EmailAccount
+    """
+    try:
+        email_account = EmailAccount.objects.get(pk=account_id, is_deleted=False)
+    except EmailAccount.DoesNotExist:
+        logger.warning('EmailAccount no longer exists: %s', account_id)
+    else:
+        if email_account.is_authorized:
+            manager = None
+            try:
+                manager = GmailManager(email_account)
+                sync_scheduler.set_watch_expires(account_id, manager.watch())
+                logger.debug('Watch renewed for: %s', email_account)
+            except HttpAccessTokenRefreshError:
+                logger.warning('Not watching, no authorization for: %s', email_account)
+                pass
+            except Exception:
+                logger.exception('Could not watch account %s' % email_account)
+            finally:
+                if manager:
+                    manager.cleanup()
+        else:
+            logger.warning('Not watching, no authorization for: %s', email_account)
+
+
+@task(name='reconcile_email_label_counters', logger=logger)
+def reconcile_email_label_counters(account_id):
+    """
+    Recount the unread and total counts of the labels of the email account.
+
+    Args:
+        account_id (int): id of the EmailAccount
+    """
+    try:
+        email_account = EmailAccount.objects.get(pk=account_id, is_deleted=False)
+    except EmailAccount.DoesNotExist:
+        logger.warning('EmailAccount no longer exists: %s', account_id)
+    else:
+        repaired = label_counters.reconcile(email_account)
+        if repaired:
+            logger.info('Repaired the counts of %s labels of account %s', repaired, email_account)
+
+
 @task(name='download_email_message', logger=logger, acks_late=True, bind=True)
 def download_email_message(self, account_id, message_id):
     """
@@ -210,6 +302,39 @@ def download_email_message(self, account_id, message_id):
             logger.warning('Not syncing, no authorization for: %s', email_account)
 
 
+@task(name='download_email_messages', logger=logger, acks_late=True, bind=True)
+def download_email_messages(self, account_id, message_ids):
+    """
+    Download multiple messages with a single batch request.
+
+    Args:
+        account_id (int): id of the EmailAccount
+        message_ids (list): google ids of the EmailMessages
+    """
+    try:
+        email_account = EmailAccount.objects.get(pk=account_id, is_deleted=False)
+    except EmailAccount.DoesNotExist:
+        logger.warning('EmailAccount no longer exists: %s', account_id)
+    else:
+        if email_account.is_authorized:
+            manager = None
+            try:
+                manager = GmailManager(email_account)
+                logger.debug('Fetch %s messages for: %s' % (len(message_ids), email_account))
+                manager.download_messages(message_ids)
+            except HttpAccessTokenRefreshError:
+                logger.warning('Not syncing, no authorization for: %s', email_account)
+                pass
+            except Exception as exc:
+                logger.exception('Fetch %s messages for: %s failed' % (len(message_ids), email_account))
+                raise self.retry(exc=exc)
+            finally:
+                if manager:
+                    manager.cleanup()
+        else:
+            logger.warning('Not syncing, no authorization for: %s', email_account)
+
+
 @task(name='update_labels_for_message', logger=logger, bind=True)
 def update_labels_for_message(self, account_id, email_id):
     """
@@ -408,22 +533,24 @@ def send_message(email_outbox_message_id, original_message_id=None):
             except EmailAttachment.DoesNotExist:
                 pass
             else:
-                outbox_attachment = EmailOutboxAttachment()
-                outbox_attachment.email_outbox_message = email_outbox_message
-                outbox_attachment.tenant_id = original_attachment.message.tenant_id
-
-                file = default_storage._open(original_attachment.attachment.name)
-                file.open()
-                content = file.read()
-                file.close()
-
-                file = ContentFile(content)
-                file.name = original_attachment.attachment.name
-
-                outbox_attachment.attachment = file
-                outbox_attachment.inline = original_attachment.inline
-                outbox_attachment.size = file.size
-                outbox_attachment.save()
+                name = original_attachment.attachment.name
+                with transaction.atomic():
+                    # Lock the file while linking it, so it can't be deleted with the original attachment in the
+                    # meantime, see post_delete_mail_attachment_handler.
+                    lock_attachment_blob(name)
+                    if not EmailAttachment.objects.filter(pk=original_attachment.pk).exists():
+                        logger.warning('Attachment %s was deleted, not forwarding it', attachment_id)
+                        continue
+
+                    outbox_attachment = EmailOutboxAttachment()
+                    outbox_attachment.email_outbox_message = email_outbox_message
+                    outbox_attachment.tenant_id = original_attachment.message.tenant_id
+                    # Link to the file of the original attachment instead of copying it, the file is only deleted
+                    # when no attachment refers to it anymore.
+                    outbox_attachment.attachment = name
+                    outbox_attachment.inline = original_attachment.inline
+                    outbox_attachment.size = original_attachment.size
+                    outbox_attachment.save()
 
     manager = None
     try:
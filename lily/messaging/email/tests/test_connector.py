@@ -1,14 +1,15 @@
 import json
+import tempfile
 
 from googleapiclient.discovery import build
-from googleapiclient.http import HttpMock
+from googleapiclient.http import HttpMock, HttpMockSequence
 from oauth2client.client import HttpAccessTokenRefreshError
 from rest_framework.test import APITestCase
 
 from lily.messaging.email.connector import GmailConnector, FailedServiceCallException
 from lily.messaging.email.factories import EmailAccountFactory
 from lily.messaging.email.models.models import EmailAccount
-from lily.messaging.email.services import GmailService
+from lily.messaging.email.services import GmailService, authorized_http_cache
 from lily.tests.utils import UserBasedTest, get_dummy_credentials
 
 from mock import patch
@@ -23,8 +24,8 @@ class GmailConnectorTests(UserBasedTest, APITestCase):
         # Patch the creation of a Gmail API service without the need for authorized credentials.
         credentials = get_dummy_credentials()
         self.get_credentials_mock_patcher = patch('lily.messaging.email.connector.get_credentials')
-        get_credentials_mock = self.get_credentials_mock_patcher.start()
-        get_credentials_mock.return_value = credentials
+        self.get_credentials_mock = self.get_credentials_mock_patcher.start()
+        self.get_credentials_mock.return_value = credentials
 
         self.authorize_mock_patcher = patch.object(GmailService, 'authorize')
         authorize_mock = self.authorize_mock_patcher.start()
@@ -164,6 +165,27 @@ class GmailConnectorTests(UserBasedTest, APITestCase):
 
         self.assertFalse(email_account.is_authorized, "Email account shouldn't be authorized.")
 
+    def test_credentials_cache(self):
+        """
+        Test if the credentials are reused by successive connectors until the email account is deauthorized.
+        """
+        email_account = EmailAccount.objects.first()
+        authorized_http_cache.invalidate(email_account.id)
+
+        GmailConnector(email_account).cleanup()
+        GmailConnector(email_account).cleanup()
+
+        # Verify that the credentials are only loaded once.
+        self.assertEqual(self.get_credentials_mock.call_count, 1)
+
+        email_account.is_authorized = False
+        email_account.save()
+
+        GmailConnector(email_account).cleanup()
+
+        # Verify that the credentials are loaded again after the email account was deauthorized.
+        self.assertEqual(self.get_credentials_mock.call_count, 2)
+
     @patch.object(GmailService, '_get_http')
     def test_get_all_message_id_list(self, get_http_mock):
         """
@@ -285,6 +307,45 @@ class GmailConnectorTests(UserBasedTest, APITestCase):
         # Verify that the history id is not retrieved from the get API response.
         self.assertEqual(connector.history_id, None)
 
+    @patch.object(GmailService, '_get_http')
+    def test_get_message_info_batch(self, get_http_mock):
+        """
+        Test the GmailConnector in retrieving the info of multiple email messages with a single batch request.
+        """
+        message_ids = ['15a6008a4baa65f3', '15a600737124149d']
+
+        # Build a multipart batch response with a part for every message.
+        boundary = 'batch_boundary'
+        content = ''
+        json_objs = {}
+        for message_id in message_ids:
+            with open('lily/messaging/email/tests/data/get_message_info_{0}.json'.format(message_id)) as infile:
+                body = infile.read()
+                json_objs[message_id] = json.loads(body)
+
+            content += (
+                '--{0}\r\n'
+                'Content-Type: application/http\r\n'
+                'Content-ID: <response-batch+{1}>\r\n\r\n'
+                'HTTP/1.1 200 OK\r\n'
+                'Content-Type: application/json\r\n\r\n'
+                '{2}\r\n'
+            ).format(boundary, message_id, body)
+        content += '--{0}--'.format(boundary)
+
+        get_http_mock.return_value = HttpMockSequence([
+            ({'status': '200', 'content-type': 'multipart/mixed; boundary="{0}"'.format(boundary)}, content),
+        ])
+
+        email_account = EmailAccount.objects.first()
+
+        connector = GmailConnector(email_account)
+        response = connector.get_message_info_batch(message_ids)
+
+        # Verify that the batch call returned the correct json objects, keyed by message id.
+        self.assertEqual(response, json_objs)
+        self.assertEqual(get_http_mock.call_count, 1)
+
     @patch.object(GmailService, '_get_http')
     def test_get_label_info(self, get_http_mock):
         """
@@ -499,6 +560,24 @@ per inceptos himenaeos. Ut aliquet elit sed augue bibendum malesuada.</body></ht
             json_obj = json.load(infile)
             self.assertEqual(response, json_obj)
 
+    def test_message_media_resumable(self):
+        """
+        Test that only large messages are uploaded with a resumable upload.
+        """
+        connector = GmailConnector(EmailAccount.objects.first())
+
+        with self.settings(GMAIL_RESUMABLE_UPLOAD_SIZE=1024, GMAIL_RESUMABLE_CHUNK_SIZE=256 * 1024):
+            media = connector._get_message_media('Subject: small\n\nbody')
+            self.assertFalse(media.resumable())
+
+            message = 'Subject: large\n\n' + 'x' * 2048
+            message_file = tempfile.TemporaryFile()
+            message_file.write(message)
+            media = connector._get_message_media(message_file)
+            self.assertTrue(media.resumable())
+            self.assertEqual(media.size(), len(message))
+            self.assertEqual(media.chunksize(), 256 * 1024)
+
     @patch.object(GmailService, '_get_http')
     def test_trash_email_message(self, get_http_mock):
         """
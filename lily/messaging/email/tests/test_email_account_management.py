@@ -2,7 +2,7 @@ import json
 from base64 import b64encode
 
 from django.core.urlresolvers import reverse
-from django.test import RequestFactory
+from django.test import RequestFactory, override_settings
 from googleapiclient.discovery import build
 from googleapiclient.http import HttpMock
 from oauth2client.client import OAuth2WebServerFlow
@@ -343,3 +343,57 @@ class EmailAccountManagementTests(UserBasedTest, APITestCase):
         self.user_obj.refresh_from_db()
         primary_email_account_id = json.loads(response.content).get('primary_email_account').get('id')
         self.assertEqual(self.user_obj.primary_email_account.pk, primary_email_account_id)
+
+
+@override_settings(GMAIL_PUSH_TOKEN='secret')
+@patch('lily.messaging.email.sync_scheduler.request_sync')
+class GmailPushNotificationTests(APITestCase):
+    """
+    Class for unit testing the endpoint of the Gmail push notifications.
+    """
+    url = '/api/messaging/email/push/'
+
+    def get_data(self, email_address, history_id):
+        return {
+            'message': {
+                'data': b64encode(json.dumps({'emailAddress': email_address, 'historyId': history_id})),
+                'message_id': '1',
+            },
+            'subscription': 'projects/lily/subscriptions/gmail',
+        }
+
+    def test_notification(self, request_sync_mock):
+        """
+        Test that a notification syncs the accounts of the mailbox that aren't up to date.
+        """
+        email_account = EmailAccountFactory(is_authorized=True, history_id=100)
+        # Another account of the same mailbox that synced up to the notification already.
+        EmailAccountFactory(
+            email_address=email_account.email_address,
+            is_authorized=True,
+            history_id=200,
+        )
+
+        response = self.client.post(
+            '%s?token=secret' % self.url,
+            self.get_data(email_account.email_address, 150),
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        request_sync_mock.assert_called_once_with(email_account.pk)
+
+    def test_notification_invalid_token(self, request_sync_mock):
+        """
+        Test that notifications without the right token are refused.
+        """
+        email_account = EmailAccountFactory(is_authorized=True, history_id=100)
+
+        response = self.client.post(
+            '%s?token=wrong' % self.url,
+            self.get_data(email_account.email_address, 150),
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(request_sync_mock.called)
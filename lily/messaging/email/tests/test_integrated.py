@@ -1,5 +1,6 @@
 import anyjson
 from django.conf import settings
+from django.test import override_settings
 from googleapiclient.discovery import build
 from googleapiclient.http import HttpMock
 from oauth2client.client import HttpAccessTokenRefreshError
@@ -15,11 +16,13 @@ from lily.tests.utils import UserBasedTest, get_dummy_credentials
 from mock import patch
 
 
+@override_settings(GMAIL_DOWNLOAD_BATCH_SIZE=1)
 class EmailTests(UserBasedTest, APITestCase):
     """
     Class for integrated email testing.
 
-    API calls to Google are mocked.
+    API calls to Google are mocked. Messages are downloaded one per batch, so the mocked responses can be served in
+    the same order as the API calls are made.
     """
 
     verify_label_data_default = {
@@ -144,10 +147,9 @@ class EmailTests(UserBasedTest, APITestCase):
         mock_api_calls = [
             # Retrieve the history_id.
             HttpMock('lily/messaging/email/tests/data/get_history_id.json', {'status': '200'}),
-            # Retrieve a list of all the messages in the email box.
+            # Retrieve the first page of the messages in the email box.
             HttpMock('lily/messaging/email/tests/data/all_message_id_list_paged_1.json', {'status': '200'}),
-            HttpMock('lily/messaging/email/tests/data/all_message_id_list_paged_2.json', {'status': '200'}),
-            # Retrieve all 10 email messages and their labels.
+            # Retrieve the 6 email messages of the first page and their labels.
             HttpMock('lily/messaging/email/tests/data/get_message_info_15a6008a4baa65f3.json', {'status': '200'}),
             HttpMock('lily/messaging/email/tests/data/get_label_info_UNREAD.json', {'status': '200'}),
             HttpMock('lily/messaging/email/tests/data/get_label_info_IMPORTANT.json', {'status': '200'}),
@@ -162,6 +164,9 @@ class EmailTests(UserBasedTest, APITestCase):
             HttpMock('lily/messaging/email/tests/data/get_message_info_15a600543e10c8e4.json', {'status': '200'}),
             HttpMock('lily/messaging/email/tests/data/get_message_info_15a60053f67f5de4.json', {'status': '200'}),
             HttpMock('lily/messaging/email/tests/data/get_label_info_Label_1.json', {'status': '200'}),
+            # Retrieve the second page of the messages in the email box.
+            HttpMock('lily/messaging/email/tests/data/all_message_id_list_paged_2.json', {'status': '200'}),
+            # Retrieve the 4 email messages of the second page and their labels.
             HttpMock('lily/messaging/email/tests/data/get_message_info_15a60053dea565fa.json', {'status': '200'}),
             HttpMock('lily/messaging/email/tests/data/get_message_info_15a60044bb3e2a7a.json', {'status': '200'}),
             HttpMock('lily/messaging/email/tests/data/get_message_info_15a60025b255c626.json', {'status': '200'}),
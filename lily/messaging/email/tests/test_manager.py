@@ -48,9 +48,9 @@ class GmailManagerTests(UserBasedTest, APITestCase):
         self.authorize_mock_patcher.stop()
         self.build_service_mock_patcher.stop()
 
-    @patch.object(GmailConnector, 'get_all_message_id_list')
+    @patch.object(GmailConnector, 'get_message_id_pages')
     @patch('lily.messaging.email.manager.app.send_task')
-    def test_full_synchronize(self, send_task_mock, get_all_message_id_list_mock):
+    def test_full_synchronize(self, send_task_mock, get_message_id_pages_mock):
         """
         Test the GmailManager full synchronize. Verify that the message id's are processed correct by lookng at the
         correct number of calls on the http mock object.
@@ -60,22 +60,62 @@ class GmailManagerTests(UserBasedTest, APITestCase):
         with open('lily/messaging/email/tests/data/all_message_id_list_single_page.json') as infile:
             json_obj = json.load(infile)
             messages = json_obj['messages']
-            get_all_message_id_list_mock.return_value = messages
+            get_message_id_pages_mock.return_value = iter([messages])
 
         email_account = EmailAccount.objects.first()
         manager = GmailManager(email_account)
         manager.full_synchronize()
 
-        # Count the number of times the send_task mock was called to download a new message or to administer the
-        # synchronization finished.
-        call_download_email_message_count = sum(
-            call[0][0] == 'download_email_message' for call in send_task_mock.call_args_list)
+        # Count the number of messages the send_task mock was called with to download new messages or to administer
+        # the synchronization finished.
+        downloaded_message_ids = []
+        for call in send_task_mock.call_args_list:
+            if call[0][0] == 'download_email_messages':
+                downloaded_message_ids.extend(call[1]['args'][1])
         call_full_sync_finished_count = sum(
             call[0][0] == 'full_sync_finished' for call in send_task_mock.call_args_list)
 
-        self.assertEqual(call_download_email_message_count, len(messages))
+        self.assertEqual(downloaded_message_ids, [message['id'] for message in messages])
         self.assertEqual(call_full_sync_finished_count, 1)
 
+    @patch.object(GmailConnector, 'get_message_info_batch')
+    def test_download_messages(self, get_message_info_batch_mock):
+        """
+        Test the GmailManager on downloading multiple messages at once and that they are stored in the database.
+        """
+        message_ids = ['15a6008a4baa65f3', '15a600737124149d']
+
+        message_infos = {}
+        for message_id in message_ids:
+            with open('lily/messaging/email/tests/data/get_message_info_{0}.json'.format(message_id)) as infile:
+                message_infos[message_id] = json.load(infile)
+        get_message_info_batch_mock.return_value = message_infos
+
+        email_account = EmailAccount.objects.first()
+
+        labels = [settings.GMAIL_LABEL_UNREAD, settings.GMAIL_LABEL_IMPORTANT, settings.GMAIL_LABEL_PERSONAL,
+                  settings.GMAIL_LABEL_INBOX, settings.GMAIL_LABEL_DRAFT]
+        for label in labels:
+            EmailLabelFactory.create(account=email_account, label_id=label)
+
+        manager = GmailManager(email_account)
+        manager.download_messages(message_ids)
+
+        # Verify that all messages are fetched with a single call and stored in the db.
+        get_message_info_batch_mock.assert_called_once_with(message_ids)
+        self.assertEqual(
+            set(EmailMessage.objects.filter(account=email_account).values_list('message_id', flat=True)),
+            set(message_ids)
+        )
+
+        # Verify that the labels and sender are stored with the bulk inserts.
+        email_message = EmailMessage.objects.get(account=email_account, message_id=message_ids[0])
+        email_message_labels = set(email_message.labels.all().values_list('label_id', flat=True))
+        self.assertEqual(email_message_labels, set(
+            [settings.GMAIL_LABEL_UNREAD, settings.GMAIL_LABEL_IMPORTANT, settings.GMAIL_LABEL_PERSONAL,
+             settings.GMAIL_LABEL_INBOX]))
+        self.assertIsNotNone(email_message.sender_id)
+
     @patch.object(GmailConnector, 'get_message_info')
     def test_download_message(self, get_message_info_mock):
         """
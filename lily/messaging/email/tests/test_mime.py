@@ -0,0 +1,75 @@
+from email import encoders
+from email.mime.base import MIMEBase
+import os
+import shutil
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.mail import SafeMIMEMultipart, SafeMIMEText
+from django.test import SimpleTestCase
+from mock import patch
+
+from lily.messaging.email.mime import BASE64_CHUNK_SIZE, MIMEStorageFile, spool_message
+
+
+class SpoolMessageTests(SimpleTestCase):
+    """
+    Class for unit testing the writing of MIME messages with attachments read from storage.
+    """
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        self.storage = FileSystemStorage(location=self.storage_dir)
+
+        # Larger than one chunk and not a multiple of the chunk size, so the last chunk is padded.
+        self.content = os.urandom(BASE64_CHUNK_SIZE * 2 + 1000)
+        self.storage_name = self.storage.save('attachments/report.pdf', ContentFile(self.content))
+
+        self.image_content = os.urandom(100)
+        self.image_storage_name = self.storage.save('attachments/logo.png', ContentFile(self.image_content))
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_dir)
+
+    def get_message(self, get_attachment):
+        email_message = SafeMIMEMultipart('related', boundary='related-boundary')
+        email_message['Subject'] = 'Report'
+        email_message['From'] = 'john@example.com'
+        email_message['To'] = 'jane@example.com'
+
+        email_message_alternative = SafeMIMEMultipart('alternative', boundary='alternative-boundary')
+        email_message.attach(email_message_alternative)
+        email_message_alternative.attach(SafeMIMEText('Hello', 'plain', 'utf-8'))
+        email_message_alternative.attach(SafeMIMEText('<p>Hello</p><img src="cid:logo">', 'html', 'utf-8'))
+
+        msg = get_attachment('application', 'pdf', self.storage_name, self.content)
+        msg.add_header('Content-Disposition', 'attachment', filename='report.pdf')
+        email_message.attach(msg)
+
+        msg = get_attachment('image', 'png', self.image_storage_name, self.image_content, name='logo.png')
+        msg.add_header('Content-Disposition', 'inline', filename='logo.png')
+        msg.add_header('Content-ID', '<logo>')
+        email_message.attach(msg)
+
+        return email_message
+
+    def get_storage_attachment(self, main_type, sub_type, storage_name, content, **params):
+        return MIMEStorageFile(main_type, sub_type, storage_name, **params)
+
+    def get_encoded_attachment(self, main_type, sub_type, storage_name, content, **params):
+        msg = MIMEBase(main_type, sub_type, **params)
+        msg.set_payload(content)
+        encoders.encode_base64(msg)
+        return msg
+
+    def test_spool_message(self):
+        """
+        Test that the spooled message is the same as the message rendered in memory.
+        """
+        expected = self.get_message(self.get_encoded_attachment).as_string()
+
+        with patch('lily.messaging.email.mime.default_storage', self.storage):
+            with spool_message(self.get_message(self.get_storage_attachment)) as message_file:
+                spooled = message_file.read()
+
+        self.assertEqual(spooled, expected)
@@ -1,9 +1,14 @@
 from datetime import datetime
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from rest_framework.test import APITestCase
 
+from lily.messaging.email import label_counters
 from lily.messaging.email.factories import EmailAccountFactory, EmailMessageFactory
-from lily.messaging.email.models.models import EmailMessage, Recipient, EmailLabel, EmailHeader, EmailAccount
-from lily.messaging.email.utils import get_filtered_message
+from lily.messaging.email.models.models import (EmailMessage, Recipient, EmailLabel, EmailHeader, EmailAccount,
+                                                EmailAttachment)
+from lily.messaging.email.utils import get_filtered_message, get_filtered_messages
 from lily.settings import settings
 from lily.tenant.factories import TenantFactory
 from lily.tests.utils import UserBasedTest
@@ -157,6 +162,78 @@ class EmailMessageTests(UserBasedTest, APITestCase):
         # Verify that the email is not archived.
         self.assertFalse(self.email_message.is_archived)
 
+    def test_email_message_label_flags(self):
+        """
+        Test if the label flags are kept in sync with the labels, so the properties don't need the labels.
+        """
+        self._add_label(settings.GMAIL_LABEL_SPAM)
+        self._add_label(settings.GMAIL_LABEL_STAR)
+
+        email_message = EmailMessage.objects.get(pk=self.email_message.pk)
+        self.assertEqual(email_message.label_flags, EmailMessage.FLAG_SPAM | EmailMessage.FLAG_STAR)
+
+        email_message.labels.remove(*email_message.labels.filter(label_id=settings.GMAIL_LABEL_SPAM))
+
+        email_message = EmailMessage.objects.get(pk=self.email_message.pk)
+        with self.assertNumQueries(0):
+            self.assertFalse(email_message.is_spam)
+            self.assertTrue(email_message.is_starred)
+            self.assertTrue(email_message.is_archived)
+
+    def test_email_label_counters(self):
+        """
+        Test if the unread and total counts of the labels follow the changes of the messages and can be repaired.
+        """
+        inbox = EmailLabel.objects.create(account=self.email_account, label_id=settings.GMAIL_LABEL_INBOX)
+        star = EmailLabel.objects.create(account=self.email_account, label_id=settings.GMAIL_LABEL_STAR)
+
+        old_state = label_counters.get_state(self.email_message)
+        self.email_message.labels.add(inbox, star)
+        label_counters.update_message(old_state, label_counters.get_state(self.email_message))
+        self._assert_counts(inbox, 1, 1)
+        self._assert_counts(star, 1, 1)
+
+        # Read the message and remove the star.
+        old_state = label_counters.get_state(self.email_message)
+        self.email_message.read = True
+        self.email_message.save()
+        self.email_message.labels.remove(star)
+        label_counters.update_message(old_state, label_counters.get_state(self.email_message))
+        self._assert_counts(inbox, 1, 0)
+        self._assert_counts(star, 0, 0)
+
+        label_counters.remove_messages(EmailMessage.objects.filter(pk=self.email_message.pk))
+        self._assert_counts(inbox, 0, 0)
+
+        # The message isn't deleted, so reconciliation counts it again.
+        self.assertEqual(label_counters.reconcile(self.email_account), 1)
+        self._assert_counts(inbox, 1, 0)
+
+    def _assert_counts(self, label, total, unread):
+        label.refresh_from_db()
+        self.assertEqual((label.total, label.unread), (total, unread))
+
+    def test_email_attachment_blob(self):
+        """
+        Test if attachments with the same content share a file, which is only deleted with the last attachment.
+        """
+        attachments = []
+        for i in range(2):
+            attachment = EmailAttachment(message=self.email_message, size=7)
+            attachment.attachment = ContentFile('content', name='document.txt')
+            attachment.save()
+            attachments.append(attachment)
+
+        name = attachments[0].attachment.name
+        self.assertEqual(attachments[1].attachment.name, name)
+        self.assertTrue(default_storage.exists(name))
+
+        attachments[0].delete()
+        self.assertTrue(default_storage.exists(name))
+
+        attachments[1].delete()
+        self.assertFalse(default_storage.exists(name))
+
     def _add_label(self, label):
         # Add the provided label to the email message.
         label = EmailLabel.objects.create(
@@ -414,6 +491,36 @@ class EmailAccountTests(UserBasedTest, APITestCase):
             else:
                 self.assertEqual(filtered_messages, [])
 
+    def test_filtered_messages(self):
+        """
+        Test if filtering messages in the database gives the same result as filtering every message.
+        """
+        users = LilyUserFactory.create_batch(size=3, tenant=self.tenant)
+        email_messages = []
+
+        for privacy in [EmailAccount.PUBLIC, EmailAccount.READ_ONLY, EmailAccount.METADATA, EmailAccount.PRIVATE]:
+            email_account = EmailAccountFactory.create(tenant=self.tenant, privacy=privacy, owner=users[0])
+            # Share the email account with a user.
+            email_account.sharedemailconfig_set.create(
+                user=users[1],
+                email_account=email_account,
+                privacy=EmailAccount.METADATA,
+                tenant=self.tenant
+            )
+            email_messages += EmailMessageFactory.create_batch(account=email_account, size=2)
+
+        for user in users:
+            expected = {}
+            for email_message in email_messages:
+                filtered_message = get_filtered_message(email_message, email_message.account, user)
+
+                if filtered_message:
+                    expected[email_message.pk] = not isinstance(filtered_message, EmailMessage)
+
+            filtered_messages = get_filtered_messages(EmailMessage.objects.filter(account__tenant=self.tenant), user)
+
+            self.assertEqual(dict(filtered_messages.values_list('pk', 'is_metadata_only')), expected)
+
     def _can_view_full_message(self, email_account, user):
         shared_config = email_account.sharedemailconfig_set.filter(user=user).first()
 
@@ -0,0 +1,70 @@
+from django.test import RequestFactory, SimpleTestCase
+from mock import Mock, patch
+
+from lily.messaging.email.utils import (extract_script_tags, get_rendered_email_body, render_email_body,
+                                        replace_anchors_in_html, replace_cid_in_html)
+
+
+class RenderEmailBodyTests(SimpleTestCase):
+    """
+    Class for unit testing the rendering of email bodies.
+    """
+    body_html = (
+        '<html><head><script>alert(1);</script></head><body>'
+        '<p>Hello <a href="https://example.com">there</a>,</p>'
+        '<script type="text/javascript">document.write("x");</script>'
+        '<img src="cid:logo@example.com"><img src="cid:unknown@example.com">'
+        '<p>Regards</p></body></html>'
+    )
+
+    def setUp(self):
+        self.request = RequestFactory().get('/', HTTP_HOST='lily.example.com')
+        self.attachments = [Mock(pk=1, cid='<logo@example.com>')]
+
+    def test_render_email_body(self):
+        """
+        Test that the single parse gives the same output as the separate steps did.
+        """
+        email_body = extract_script_tags(self.body_html)
+        email_body = replace_anchors_in_html(email_body)
+        email_body = replace_cid_in_html(email_body, self.attachments, self.request)
+
+        rendered = render_email_body(self.body_html, self.attachments, self.request)
+
+        self.assertEqual(rendered, email_body)
+        self.assertNotIn('<script', rendered)
+        self.assertIn('target="_blank"', rendered)
+        self.assertIn('http://lily.example.com/messaging/email/attachment/1/', rendered)
+
+    def get_cache_key(self, email_message, request):
+        with patch('lily.messaging.email.utils.cache') as cache_mock:
+            cache_mock.get.return_value = None
+            get_rendered_email_body(email_message, request)
+
+        return cache_mock.get.call_args[0][0]
+
+    def get_email_message(self, body_html=None, attachments=None):
+        email_message = Mock(pk=1, body_html=body_html or self.body_html)
+        email_message.attachments.all.return_value = self.attachments if attachments is None else attachments
+        return email_message
+
+    def test_rendered_email_body_cache_key(self):
+        """
+        Test that the rendered body is cached per body, host, secure flag and attachment set.
+        """
+        cache_key = self.get_cache_key(self.get_email_message(), self.request)
+
+        self.assertEqual(cache_key, self.get_cache_key(self.get_email_message(), self.request))
+
+        other_keys = [
+            self.get_cache_key(self.get_email_message(body_html='<p>Other</p>'), self.request),
+            self.get_cache_key(self.get_email_message(), RequestFactory().get('/', HTTP_HOST='other.example.com')),
+            self.get_cache_key(self.get_email_message(), RequestFactory().get(
+                '/', HTTP_HOST='lily.example.com', secure=True
+            )),
+            self.get_cache_key(self.get_email_message(attachments=[]), self.request),
+            self.get_cache_key(self.get_email_message(attachments=[Mock(pk=2, cid='<logo@example.com>')]),
+                               self.request),
+        ]
+
+        self.assertEqual(len(set(other_keys + [cache_key])), len(other_keys) + 1)
@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import re
 import mimetypes
@@ -11,8 +12,10 @@ from urllib import unquote
 
 from django.apps import apps
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files.storage import default_storage
 from django.core.urlresolvers import reverse
+from django.db.models import BooleanField, Case, Value, When
 from django.template import engines, Context, TemplateSyntaxError
 from django.template.base import VARIABLE_TAG_START, VARIABLE_TAG_END
 from django.template.loader_tags import BlockNode, ExtendsNode
@@ -24,7 +27,7 @@ from lily.search.scan_search import ModelMappings
 from lily.search.indexing import update_in_index
 
 from .decorators import get_safe_template
-from .models.models import EmailAttachment, EmailMessage, EmailAccount
+from .models.models import EmailAttachment, EmailMessage, EmailAccount, SharedEmailConfig
 from .sanitize import sanitize_html_email
 
 _EMAIL_PARAMETER_DICT = {}
@@ -229,15 +232,16 @@ def get_attachment_filename_from_url(url):
     return unquote(url).split('/')[-1]
 
 
-def render_email_body(html, mapped_attachments, request):
+def render_email_body(html, mapped_attachments, request, replace_anchors=True):
     """
-    Update all the target attributes in the <a> tag.
-    After that replace the cid information in the html.
+    Remove script tags, update all the target attributes in the <a> tag and replace the cid information in the html.
+    The html is parsed once for all these steps and sanitized afterwards.
 
     Args:
         html (string): HTML string of the email body to be sent.
         mapped_attachments (list): List of linked attachments to the email.
         request (instance): The Django request.
+        replace_anchors (boolean): Make all anchors open outside the iframe.
 
     Returns:
         html body (string)
@@ -245,11 +249,51 @@ def render_email_body(html, mapped_attachments, request):
     if html is None:
         return None
 
-    email_body = extract_script_tags(html)
-    email_body = replace_anchors_in_html(email_body)
-    email_body = replace_cid_in_html(email_body, mapped_attachments, request)
+    soup = create_a_beautiful_soup_object(html)
+
+    if not soup:
+        return sanitize_html_email(html)
+
+    remove_script_tags_from_soup(soup)
+    if replace_anchors:
+        replace_anchors_in_soup(soup)
+    replace_cid_in_soup(soup, mapped_attachments, request)
 
-    return email_body
+    return sanitize_html_email(soup.encode_contents())
+
+
+def get_rendered_email_body(email_message, request):
+    """
+    Return the rendered html body of an email message, see render_email_body.
+
+    The result is cached per body and attachment set, so opening the same email again doesn't parse it at all.
+
+    Args:
+        email_message (EmailMessage): The email message to render.
+        request (instance): The Django request.
+
+    Returns:
+        html body (string)
+    """
+    attachments = list(email_message.attachments.all())
+    body_html = email_message.body_html or ''
+    if isinstance(body_html, unicode):
+        body_html = body_html.encode('utf-8')
+
+    cache_key = 'email_body_%s_%s' % (email_message.pk, hashlib.md5(repr([
+        hashlib.md5(body_html).hexdigest(),
+        request.is_secure(),
+        request.META.get('HTTP_HOST'),
+        sorted((attachment.pk, attachment.cid) for attachment in attachments),
+    ])).hexdigest())
+
+    body_html = cache.get(cache_key)
+
+    if body_html is None:
+        body_html = render_email_body(email_message.body_html, attachments, request)
+        cache.set(cache_key, body_html, settings.EMAIL_BODY_CACHE_TIMEOUT)
+
+    return body_html
 
 
 def replace_cid_in_html(html, mapped_attachments, request):
@@ -268,15 +312,27 @@ def replace_cid_in_html(html, mapped_attachments, request):
         return None
 
     soup = create_a_beautiful_soup_object(html)
-    cid_done = []
-    inline_images = []
 
-    if soup and mapped_attachments:
-        inline_images = soup.findAll('img', {'src': lambda src: src and src.startswith('cid:')})
+    if not soup:
+        return sanitize_html_email(html)
 
-    if (not soup or soup.get_text() == '') and not inline_images:
-        html = sanitize_html_email(html)
-        return html
+    replace_cid_in_soup(soup, mapped_attachments, request)
+
+    return sanitize_html_email(soup.encode_contents())
+
+
+def replace_cid_in_soup(soup, mapped_attachments, request):
+    """
+    Replace all the cid image information in a parsed html body with a link to the image.
+    """
+    if not mapped_attachments:
+        return
+
+    cid_done = []
+    inline_images = soup.findAll('img', {'src': lambda src: src and src.startswith('cid:')})
+
+    if not inline_images:
+        return
 
     protocol = 'http'
     if request.is_secure():
@@ -293,11 +349,6 @@ def replace_cid_in_html(html, mapped_attachments, request):
                 image['cid'] = image_cid
                 cid_done.append(attachment.cid)
 
-    html = soup.encode_contents()
-    html = sanitize_html_email(html)
-
-    return html
-
 
 def replace_cid_and_change_headers(html, pk):
     """
@@ -347,10 +398,7 @@ def replace_cid_and_change_headers(html, pk):
                     else:
                         content_type = mimetypes.guess_type(storage_file.file.name)[0]
 
-                    storage_file.open()
-                    content = storage_file.read()
-                    storage_file.close()
-
+                    # The content itself is streamed from storage when the message is written.
                     response = {
                         'content-type': content_type,
                         'content-disposition': 'inline',
@@ -358,7 +406,7 @@ def replace_cid_and_change_headers(html, pk):
                         'content-id': file.cid,
                         'x-attachment-id': image_cid,
                         'content-transfer-encoding': 'base64',
-                        'content': content
+                        'storage-name': file.attachment.name,
                     }
 
                     dummy_headers.append(response)
@@ -415,17 +463,21 @@ def replace_anchors_in_html(html):
 
     soup = create_a_beautiful_soup_object(html)
 
-    if not soup or soup.get_text == '':
+    if not soup:
         return html
 
+    replace_anchors_in_soup(soup)
+
+    return soup.encode_contents()
+
+
+def replace_anchors_in_soup(soup):
     for anchor in soup.findAll('a'):
         anchor.attrs.update({
             'target': '_blank',
             'rel': 'noopener noreferrer',
         })
 
-    return soup.encode_contents()
-
 
 def extract_script_tags(html):
     if html is None:
@@ -433,15 +485,19 @@ def extract_script_tags(html):
 
     soup = create_a_beautiful_soup_object(html)
 
-    if not soup or soup.get_text == '':
+    if not soup:
         return html
 
-    for item in soup.findAll('script'):
-        item.extract()
+    remove_script_tags_from_soup(soup)
 
     return soup.encode_contents()
 
 
+def remove_script_tags_from_soup(soup):
+    for item in soup.findAll('script'):
+        item.extract()
+
+
 def create_reply_body_header(email_message):
     """
     Create a body reply header with a date and name
@@ -549,11 +605,11 @@ def write_json_to_disk(path, data):
         logger.info("JSON written: %s" % path)
 
 
-def get_filtered_message(email_message, email_account, user):
-    shared_config = email_account.sharedemailconfig_set.filter(user=user).first()
-
-    # If the email account or sharing is set to metadata only, just return these fields.
-    metadata_only_message = {
+def get_metadata_only_message(email_message):
+    """
+    Return the fields of an email message that are visible when its email account is shared as metadata only.
+    """
+    return {
         'id': email_message.id,
         'sender': email_message.sender,
         'received_by': email_message.received_by.all(),
@@ -562,6 +618,10 @@ def get_filtered_message(email_message, email_account, user):
         'account': email_message.account,
     }
 
+
+def get_filtered_message(email_message, email_account, user):
+    shared_config = email_account.sharedemailconfig_set.filter(user=user).first()
+
     if email_account.owner != user:
         if shared_config:
             privacy = shared_config.privacy
@@ -569,7 +629,8 @@ def get_filtered_message(email_message, email_account, user):
             privacy = email_account.privacy
 
         if privacy == EmailAccount.METADATA:
-            return metadata_only_message
+            # If the email account or sharing is set to metadata only, just return these fields.
+            return get_metadata_only_message(email_message)
         elif privacy == EmailAccount.PRIVATE:
             # Sharing for this user is set to private, so don't return a message.
             return None
@@ -579,6 +640,52 @@ def get_filtered_message(email_message, email_account, user):
     return email_message
 
 
+def get_filtered_messages(queryset, user):
+    """
+    Filter email messages by the privacy of their email account for the user, the database equivalent of
+    get_filtered_message.
+
+    The email accounts of a tenant are few, so their privacy is determined up front. Messages of private accounts are
+    left out and the other messages are annotated with `is_metadata_only`.
+
+    Args:
+        queryset (QuerySet): the email messages to filter
+        user (LilyUser): the user that wants to view the messages
+
+    Returns:
+        QuerySet: the filtered and annotated email messages
+    """
+    shared_privacy = dict(SharedEmailConfig.objects.filter(
+        tenant=user.tenant_id,
+        user=user
+    ).values_list('email_account_id', 'privacy'))
+
+    full_account_ids = []
+    metadata_account_ids = []
+    for account_id, owner_id, privacy in EmailAccount.objects.filter(
+            tenant=user.tenant_id, is_deleted=False).values_list('id', 'owner_id', 'privacy'):
+        if owner_id == user.pk:
+            full_account_ids.append(account_id)
+            continue
+
+        privacy = shared_privacy.get(account_id, privacy)
+        if privacy == EmailAccount.METADATA:
+            metadata_account_ids.append(account_id)
+        elif privacy != EmailAccount.PRIVATE:
+            full_account_ids.append(account_id)
+
+    queryset = queryset.filter(account_id__in=full_account_ids + metadata_account_ids)
+
+    if metadata_account_ids:
+        return queryset.annotate(is_metadata_only=Case(
+            When(account_id__in=metadata_account_ids, then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField()
+        ))
+
+    return queryset.annotate(is_metadata_only=Value(False, output_field=BooleanField()))
+
+
 def convert_br_to_newline(soup, newline='\n'):
     """
     Replace html line breaks with spaces to prevent lines appended after one another.
@@ -589,6 +696,30 @@ def convert_br_to_newline(soup, newline='\n'):
     return soup
 
 
+def get_search_body(email_message):
+    """
+    Return the plain text body of an email message which is used for searching.
+    """
+    if email_message.body_text:
+        return email_message.body_text
+    elif email_message.body_html:
+        soup = BeautifulSoup(email_message.body_html, 'lxml')
+        soup = convert_br_to_newline(soup)
+        return soup.get_text()
+
+    return ''
+
+
+def get_stored_search_body(email_message):
+    """
+    Return the search body to store for an email message, messages with a plain text body are searched on that body.
+    """
+    if email_message.body_text:
+        return None
+
+    return get_search_body(email_message)
+
+
 def get_extensions_for_type(general_type):
     # For known mimetypes, use some extensions we know to be good or we prefer
     # above others.. This solves some issues when the first of the available
@@ -35,6 +35,7 @@ from lily.tenant.middleware import get_current_user
 from lily.utils.functions import is_ajax, post_intercom_event, send_get_request, send_post_request
 from lily.utils.views.mixins import LoginRequiredMixin, FormActionMixin
 
+from . import label_counters
 from .forms import (ComposeEmailForm, CreateUpdateEmailTemplateForm, CreateUpdateTemplateVariableForm,
                     EmailAccountCreateUpdateForm, EmailTemplateFileForm)
 from .models.models import (EmailMessage, EmailAttachment, EmailAccount, EmailTemplate, DefaultEmailTemplate,
@@ -44,8 +45,7 @@ from .services import GmailService
 from .tasks import (send_message, create_draft_email_message, update_draft_email_message,
                     add_and_remove_labels_for_message, trash_email_message)
 from .utils import (get_attachment_filename_from_url, get_email_parameter_choices, create_recipients,
-                    render_email_body, replace_cid_in_html, create_reply_body_header, reindex_email_message,
-                    extract_script_tags)
+                    render_email_body, get_rendered_email_body, create_reply_body_header, reindex_email_message)
 
 
 logger = logging.getLogger(__name__)
@@ -173,7 +173,7 @@ class EmailMessageHTMLView(LoginRequiredMixin, DetailView):
 
     def get_context_data(self, **kwargs):
         context = super(EmailMessageHTMLView, self).get_context_data(**kwargs)
-        context['body_html'] = render_email_body(self.object.body_html, self.object.attachments.all(), self.request)
+        context['body_html'] = get_rendered_email_body(self.object, self.request)
         return context
 
 
@@ -235,8 +235,12 @@ class EmailMessageComposeView(LoginRequiredMixin, FormView):
                 attachments = EmailAttachment.objects.filter(message_id=self.object.pk)
 
                 # Strip malicious/unwanted content when replying.
-                self.object.body_html = extract_script_tags(self.object.body_html)
-                self.object.body_html = replace_cid_in_html(self.object.body_html, attachments, request)
+                self.object.body_html = render_email_body(
+                    self.object.body_html,
+                    attachments,
+                    request,
+                    replace_anchors=False
+                )
             except EmailMessage.DoesNotExist:
                 pass
 
@@ -629,7 +633,9 @@ class EmailMessageReplyOrForwardView(EmailMessageComposeView):
             email_message._is_archived = True
             labels_to_remove = EmailLabel.objects.filter(label_id__in=remove_labels,
                                                          account=self.object.account)
+            old_state = label_counters.get_state(email_message)
             email_message.labels.remove(*labels_to_remove)
+            label_counters.update_message(old_state, label_counters.get_state(email_message))
             reindex_email_message(email_message)
             add_and_remove_labels_for_message.delay(self.object.id, remove_labels=remove_labels)
 
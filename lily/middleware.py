@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AnonymousUser
 from django.utils.functional import SimpleLazyObject
-from rest_framework.authtoken.models import Token
+
+from lily.users import auth_cache
 
 
 class SetRemoteAddrFromForwardedFor(object):
@@ -17,18 +18,12 @@ class SetRemoteAddrFromForwardedFor(object):
 
 
 def get_user(token):
-    model = Token
-
-    try:
-        token = model.objects.select_related('user').get(key=token)
-        user = token.user
+    token = auth_cache.get_token(token)
 
-        if not user.is_active:
-            user = AnonymousUser()
-    except model.DoesNotExist:
-        user = AnonymousUser()
+    if token is None or not token.user.is_active:
+        return AnonymousUser()
 
-    return user
+    return token.user
 
 
 class TokenAuthenticationMiddleware(object):
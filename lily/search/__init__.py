@@ -1 +1 @@
-from . import signals
+from . import phone_number_index, signals
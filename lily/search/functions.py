@@ -2,29 +2,39 @@ from lily.accounts.models import Account
 from lily.contacts.models import Contact
 from lily.utils.functions import parse_phone_number
 
+from . import phone_number_index
+
 
 def search_number(tenant_id, number, return_related=True):
     """
     If the phone number belongs to an account, this returns the first account and all its contacts
     Else if the number belongs to a contact, this returns the first contact and all its accounts
+
+    The accounts and contacts with the number are looked up in the phone number index.
     """
     phone_number = parse_phone_number(number)
-    accounts = Account.objects.filter(phone_numbers__number=phone_number, is_deleted=False)
-    contacts = Contact.objects.filter(phone_numbers__number=phone_number, is_deleted=False)
+    entry = phone_number_index.get_entry(tenant_id, phone_number)
+    account, contact = get_first_account_or_contact(tenant_id, entry)
+
+    if not account and not contact and (entry['accounts'] or entry['contacts']):
+        # The entry is outdated, e.g. the account or contact was removed from the database.
+        phone_number_index.invalidate(tenant_id, [phone_number])
+        entry = phone_number_index.get_entry(tenant_id, phone_number)
+        account, contact = get_first_account_or_contact(tenant_id, entry)
 
     accounts_result = []
     contacts_result = []
 
-    if accounts:
-        accounts_result = [accounts[0]]
+    if account:
+        accounts_result = [account]
 
         if return_related:
-            contacts_result = accounts[0].contacts.filter(is_deleted=False)
-    elif contacts:
-        contacts_result = [contacts[0]]
+            contacts_result = account.contacts.filter(is_deleted=False)
+    elif contact:
+        contacts_result = [contact]
 
         if return_related:
-            accounts_result = contacts[0].accounts.filter(is_deleted=False)
+            accounts_result = contact.accounts.filter(is_deleted=False)
 
     return {
         'data': {
@@ -32,3 +42,18 @@ def search_number(tenant_id, number, return_related=True):
             'contacts': contacts_result,
         },
     }
+
+
+def get_first_account_or_contact(tenant_id, entry):
+    """
+    Return the first account of a phone number index entry, or else its first contact.
+
+    Returns:
+        tuple: the account and the contact, None when they don't exist
+    """
+    if entry['accounts']:
+        return Account.objects.filter(tenant_id=tenant_id, pk=entry['accounts'][0][0]).first(), None
+    elif entry['contacts']:
+        return None, Contact.objects.filter(tenant_id=tenant_id, pk=entry['contacts'][0][0]).first()
+
+    return None, None
@@ -1,10 +1,13 @@
+from collections import OrderedDict, defaultdict
 from datetime import date
 import logging
+from threading import local
 import traceback
 
 from django.conf import settings
+from django.db import connection
+from elasticsearch import helpers
 from elasticsearch.exceptions import NotFoundError
-from elasticutils.contrib.django import tasks
 
 from lily.search.connections_utils import get_es_client, get_index_name
 from lily.utils import logutil
@@ -12,71 +15,265 @@ from lily.utils import logutil
 
 logger = logging.getLogger('search')
 main_index = settings.ES_INDEXES['default']
-es = get_es_client(maxsize=1)
+es = get_es_client()
+
+UPDATE, REMOVE = 'update', 'remove'
+
+
+class IndexQueue(local):
+    """
+    Deduplicating buffer of index operations for the current thread.
+
+    Signals add (mapping, pk, operation) entries, which are sent to a single update_index task at the end of the
+    request (IndexQueueMiddleware) or celery task (signals in lily.search.tasks). That way Elasticsearch latency is
+    kept out of the request and every object is indexed once, however often it was saved. Outside of a request or
+    task every operation is sent right away, or applied right away in a transaction because a worker could run the
+    task before the transaction commits.
+    """
+    def __init__(self):
+        self.operations = OrderedDict()
+        self.depth = 0
+
+    def defer(self):
+        """
+        Hold operations until the matching release.
+        """
+        self.depth += 1
+
+    def release(self):
+        """
+        Send the held operations when the outermost defer is released.
+        """
+        self.depth = max(self.depth - 1, 0)
+        if not self.depth:
+            self.flush(synchronous=connection.in_atomic_block)
+
+    def add(self, mapping, pk, operation):
+        # The last operation for an object wins.
+        key = (mapping.get_mapping_type_name(), pk)
+        self.operations.pop(key, None)
+        self.operations[key] = operation
+
+        if not self.depth:
+            self.flush(synchronous=connection.in_atomic_block)
+        elif len(self.operations) >= settings.ES_INDEX_QUEUE_MAX_SIZE and not connection.in_atomic_block:
+            # Keep memory bounded for long running requests and tasks.
+            self.flush()
+
+    def flush(self, synchronous=False):
+        if not self.operations:
+            return
+
+        operations = [[mapping_name, pk, operation] for (mapping_name, pk), operation in self.operations.items()]
+        self.operations = OrderedDict()
+
+        if synchronous:
+            # Failures are logged, so they don't interfere with the regular model updates.
+            apply_operations(operations)
+            return
+
+        from .tasks import update_index
+        try:
+            update_index.apply_async(args=(operations,))
+        except Exception, e:
+            logger.error(traceback.format_exc(e))
+
+
+index_queue = IndexQueue()
 
 
 def update_in_index(instance, mapping):
     """
-    Utility function for signal listeners index to Elasticsearch.
-    Currently uses synchronous tasks. And because of that all exceptions are
-    caught, so failures will not interfere with the regular model updates.
+    Utility function for signal listeners to queue an instance for (re)indexing in Elasticsearch.
+    Deleted instances are queued for removal instead.
     """
     if settings.ES_DISABLED:
         return
     if hasattr(instance, 'is_deleted') and instance.is_deleted:
         remove_from_index(instance, mapping)
     else:
-        logger.info(u'Updating instance %s: %s' % (instance.__class__.__name__, instance.pk))
-
-        try:
-            main_index_with_type = get_index_name(main_index, mapping)
-            try:
-                document = mapping.extract_document(instance.id, instance)
-            except Exception as exc:
-                logger.exception('Unable to extract document {0}: {1}'.format(
-                    instance, repr(exc)))
-            else:
-                # Index object direct instead of bulk_index, to prevent multiple reads from db
-                mapping.index(document, id_=instance.id, es=es, index=main_index_with_type)
-                es.indices.refresh(main_index_with_type)
-        except Exception, e:
-            logger.error(traceback.format_exc(e))
+        logger.info(u'Queueing update of instance %s: %s' % (instance.__class__.__name__, instance.pk))
+        index_queue.add(mapping, instance.pk, UPDATE)
 
 
 def remove_from_index(instance, mapping):
     """
-    Utility function for signal listeners to remove from Elasticsearch.
-    Currently uses synchronous tasks. And because of that all exceptions are
-    caught, so failures will not interfere with the regular model updates.
+    Utility function for signal listeners to queue an instance for removal from Elasticsearch.
+    """
+    if settings.ES_DISABLED:
+        return
+    logger.info(u'Queueing removal of instance %s: %s' % (instance.__class__.__name__, instance.pk))
+    index_queue.add(mapping, instance.pk, REMOVE)
+
+
+def bulk_update_in_index(mapping, pks):
+    """
+    Utility function to queue multiple objects for indexing, for writes that don't send signals (e.g. bulk_create).
     """
     if settings.ES_DISABLED:
         return
-    logger.info(u'Removing instance %s: %s' % (instance.__class__.__name__, instance.pk))
+    for pk in pks:
+        index_queue.add(mapping, pk, UPDATE)
 
-    try:
-        main_index_with_type = get_index_name(main_index, mapping)
-        tasks.unindex_objects(mapping, [instance.id], es=es, index=main_index_with_type)
-        es.indices.refresh(main_index_with_type)
-    except NotFoundError, e:
-        logger.warn('Not found in index instance %s: %s' % (instance.__class__.__name__, instance.pk))
-    except Exception, e:
-        logger.error(traceback.format_exc(e))
 
+def apply_operations(operations):
+    """
+    Apply index operations in bulk, grouped per mapping.
+
+    Args:
+        operations (list): [mapping type name, pk, operation] entries, see IndexQueue.
 
-def index_objects(mapping, queryset, index, print_progress=False):
+    Returns:
+        set: the names of the mappings of which the operations failed
+    """
+    from .scan_search import ModelMappings
+
+    updates = defaultdict(list)
+    removals = defaultdict(list)
+    for mapping_name, pk, operation in operations:
+        if operation == REMOVE:
+            removals[mapping_name].append(pk)
+        else:
+            updates[mapping_name].append(pk)
+
+    failed_mappings = set()
+    for grouped, apply_operation in ((updates, update_documents), (removals, remove_documents)):
+        for mapping_name, pks in grouped.items():
+            mapping = ModelMappings.name_to_mappings.get(mapping_name)
+            if not mapping:
+                logger.warning('No mapping found for %s', mapping_name)
+                continue
+
+            try:
+                apply_operation(mapping, pks)
+            except Exception:
+                logger.exception('Failed to update %s documents in index', mapping_name)
+                failed_mappings.add(mapping_name)
+
+    return failed_mappings
+
+
+def update_documents(mapping, pks):
+    """
+    Index the objects with the given pks in bulk.
+
+    Objects that aren't found or are deleted are skipped, they are only removed by a REMOVE operation. An object
+    that isn't found may be in a transaction that hasn't been committed yet.
+    """
+    index = get_index_name(main_index, mapping)
+    pks = sorted(pks)
+
+    for i in range(0, len(pks), settings.ES_INDEX_BULK_SIZE):
+        chunk = pks[i:i + settings.ES_INDEX_BULK_SIZE]
+        queryset = mapping.prepare_batch(mapping.get_model().objects.filter(pk__in=chunk))
+
+        documents = []
+        for instance in queryset:
+            if hasattr(instance, 'is_deleted') and instance.is_deleted:
+                continue
+
+            try:
+                documents.append(mapping.extract_document(instance.pk, instance))
+            except Exception as exc:
+                logger.exception('Unable to extract document {0}: {1}'.format(instance, repr(exc)))
+
+        if documents:
+            mapping.bulk_index(documents, id_field='id', index=index, es=es)
+
+
+def remove_documents(mapping, pks):
+    """
+    Remove the documents with the given pks in bulk, documents that aren't in the index are ignored.
+    """
+    index = get_index_name(main_index, mapping)
+    actions = [{
+        '_op_type': 'delete',
+        '_index': index,
+        '_type': mapping.get_mapping_type_name(),
+        '_id': pk,
+    } for pk in pks]
+
+    helpers.bulk(es, actions, chunk_size=settings.ES_INDEX_BULK_SIZE, raise_on_error=False)
+
+
+def index_objects(mapping, queryset, index, print_progress=False, bulk_size=100, es_client=None,
+                  on_bulk_indexed=None):
     """
     Index synchronously model specified mapping type with an optimized query.
+
+    Args:
+        mapping (BaseMapping): the mapping of the objects to index
+        queryset (QuerySet): the objects to index
+        index (str): the base name of the index
+        print_progress (boolean): print a progress bar while indexing
+        bulk_size (int): the number of documents per bulk request
+        es_client (Elasticsearch): the client to use, defaults to the module client
+        on_bulk_indexed (function): called with the last pk and number of documents after every bulk request
+
+    Returns:
+        int: the number of indexed documents
     """
+    es_client = es_client or es
+    index_name = get_index_name(index, mapping)
     documents = []
-    for instance in queryset_iterator(mapping, queryset, print_progress=print_progress):
+    count = 0
+    last_pk = None
+
+    for instance in queryset_iterator(mapping, queryset, chunksize=bulk_size, print_progress=print_progress):
         documents.append(mapping.extract_document(instance.id, instance))
+        last_pk = instance.pk
 
-        if len(documents) >= 100:
-            mapping.bulk_index(documents, id_field='id', index=get_index_name(index, mapping), es=es)
+        if len(documents) >= bulk_size:
+            mapping.bulk_index(documents, id_field='id', index=index_name, es=es_client)
+            count += len(documents)
+            if on_bulk_indexed:
+                on_bulk_indexed(last_pk, len(documents))
             documents = []
 
-    mapping.bulk_index(documents, id_field='id', index=get_index_name(index, mapping), es=es)
-    documents = []
+    if documents:
+        mapping.bulk_index(documents, id_field='id', index=index_name, es=es_client)
+        count += len(documents)
+        if on_bulk_indexed:
+            on_bulk_indexed(last_pk, len(documents))
+
+    return count
+
+
+def update_changed_in_index(mapping, since, bulk_size=None, print_progress=False):
+    """
+    Bring the live index up to date with the objects modified since the given time.
+
+    Changed objects are indexed and soft deleted objects are removed, in bulk. The model of the mapping needs a
+    `modified` field, see BaseMapping.has_modified.
+
+    Args:
+        mapping (BaseMapping): the mapping to update
+        since (datetime): objects modified since this time are updated
+        bulk_size (int): the number of documents per bulk request
+        print_progress (boolean): print a progress bar while indexing
+
+    Returns:
+        tuple: the number of indexed and removed documents
+    """
+    queryset = mapping.get_model().objects.filter(modified__gte=since)
+
+    removed = 0
+    if mapping.has_deleted():
+        deleted_pks = list(queryset.filter(is_deleted=True).values_list('pk', flat=True))
+        if deleted_pks:
+            remove_documents(mapping, deleted_pks)
+            removed = len(deleted_pks)
+        queryset = queryset.filter(is_deleted=False)
+
+    indexed = index_objects(
+        mapping,
+        queryset,
+        main_index,
+        print_progress=print_progress,
+        bulk_size=bulk_size or settings.ES_INDEX_BULK_SIZE
+    )
+
+    return indexed, removed
 
 
 def unindex_objects(mapping, queryset, index, print_progress=False):
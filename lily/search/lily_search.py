@@ -2,6 +2,7 @@ import logging
 
 from django.conf import settings
 from django.db.models.query_utils import Q
+from elasticsearch import helpers
 from elasticsearch.exceptions import RequestError
 from elasticutils import S
 
@@ -28,7 +29,7 @@ class LilySearch(object):
         Arguments:
             tenant_id (int): ID of the tenant
             model_type (string): limit the search to a model
-            sort (string): sort option for results
+            sort (string or list): sort option(s) for results
             page (int): page number of pagination
             size (int): max number of returned results
         """
@@ -50,7 +51,9 @@ class LilySearch(object):
         self.model_type = model_type
 
         # Add sorting.
-        if sort:
+        if isinstance(sort, (list, tuple)):
+            self.search = self.search.order_by(*sort)
+        elif sort:
             self.search = self.search.order_by(sort)
 
         # Pagination.
@@ -71,16 +74,8 @@ class LilySearch(object):
             took (int): milliseconds Elastic search took to get the results
         """
         if settings.ES_DISABLED:
-            return [], 0, 0
-        self.search = self.search.filter_raw({'and': self.raw_filters})
-
-        if self.model_type:
-            self.search = self.search.doctypes(self.model_type)
-            # Also limit the search to just the index with the right type.
-            # This is faster than asking every index, also prevents some
-            # annoying "cannot find field" errors in the elasticsearch logs.
-            index_name = get_index_name(main_index, self.model_type)
-            self.search = self.search.indexes(index_name)
+            return [], None, 0, 0
+        self.search = self.get_filtered_search()
 
         if self.facet:
             facet_raw = {
@@ -222,6 +217,64 @@ class LilySearch(object):
             }
             self.search = self.search.query_raw(raw_query)
 
+    def get_filtered_search(self):
+        """
+        Return the search with the filters and model type applied.
+        """
+        search = self.search.filter_raw({'and': self.raw_filters})
+
+        if self.model_type:
+            search = search.doctypes(self.model_type)
+            # Also limit the search to just the index with the right type.
+            # This is faster than asking every index, also prevents some
+            # annoying "cannot find field" errors in the elasticsearch logs.
+            index_name = get_index_name(main_index, self.model_type)
+            search = search.indexes(index_name)
+
+        return search
+
+    def scan(self, return_fields=None):
+        """
+        Iterate over all results with the scroll API, so they're fetched in batches instead of in one response.
+
+        The page, size and sort of the search are ignored.
+
+        Arguments:
+            return_fields (list): strings of fieldnames to return from result
+
+        Yields:
+            dict: search result, like the hits of do_search
+        """
+        if settings.ES_DISABLED:
+            return
+
+        search = self.get_filtered_search()
+        query = search.build_search()
+        for key in ('from', 'size', 'sort'):
+            query.pop(key, None)
+
+        results = helpers.scan(
+            search.get_es(),
+            query=query,
+            scroll=settings.ES_SCROLL_TIMEOUT,
+            size=settings.ES_SCROLL_SIZE,
+            index=search.get_indexes(),
+            doc_type=search.get_doctypes(),
+        )
+
+        for result in results:
+            source = result.get('_source', {})
+            hit = {
+                'id': source.get('id', result['_id']),
+            }
+            if not self.model_type:
+                hit['type'] = result['_type']
+            for field, value in source.items():
+                if not return_fields or field in return_fields:
+                    hit[field] = value
+
+            yield hit
+
     def filter_query(self, filterquery):
         """
         Add a filterquery to the raw_filters.
@@ -0,0 +1,17 @@
+from .indexing import index_queue
+
+
+class IndexQueueMiddleware(object):
+    """
+    Hold the index operations of a request and send them to the update_index task once the response is ready.
+    """
+    def process_request(self, request):
+        index_queue.defer()
+        request._index_queue_deferred = True
+
+    def process_response(self, request, response):
+        # process_request is skipped when an earlier middleware returned a response.
+        if getattr(request, '_index_queue_deferred', False):
+            request._index_queue_deferred = False
+            index_queue.release()
+        return response
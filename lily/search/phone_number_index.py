@@ -0,0 +1,212 @@
+"""
+Index of the phone numbers of accounts and contacts per tenant, for caller ID lookups.
+
+Every normalized phone number of a tenant has a cache entry with the accounts and contacts that have the number, so
+answering an incoming call takes a single cache lookup. Entries are built from the database on a miss, warmed in
+bulk when the workers start, and removed by the signals below whenever their data might have changed.
+"""
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+PHONE_NUMBER_INDEX_KEY = 'phone_number_index_%s_%s'
+PHONE_NUMBER_ROUTING_VERSION_KEY = 'phone_number_routing_version_%s'
+
+
+def get_key(tenant_id, number):
+    return PHONE_NUMBER_INDEX_KEY % (tenant_id, number)
+
+
+def build_entries(tenant_id, numbers=None):
+    """
+    Build the index entries of the given numbers, or of all numbers of the tenant, from the database.
+
+    Returns:
+        dict: number with a dict containing (id, name) tuples of its 'accounts' and 'contacts'
+    """
+    from lily.accounts.models import Account
+    from lily.contacts.models import Contact
+
+    entries = defaultdict(lambda: {'accounts': [], 'contacts': []})
+    if numbers is not None:
+        for number in numbers:
+            entries[number]
+
+    accounts = Account.objects.filter(tenant_id=tenant_id, is_deleted=False)
+    contacts = Contact.objects.filter(tenant_id=tenant_id, is_deleted=False)
+    if numbers is not None:
+        accounts = accounts.filter(phone_numbers__number__in=numbers)
+        contacts = contacts.filter(phone_numbers__number__in=numbers)
+    else:
+        accounts = accounts.exclude(phone_numbers=None)
+        contacts = contacts.exclude(phone_numbers=None)
+
+    # Keep the default ordering of the models, the first account or contact is used for caller ID.
+    for number, pk, name in accounts.values_list('phone_numbers__number', 'pk', 'name'):
+        entries[number]['accounts'].append((pk, name))
+
+    for number, pk, first_name, last_name in contacts.values_list(
+            'phone_numbers__number', 'pk', 'first_name', 'last_name'):
+        entries[number]['contacts'].append((pk, ' '.join([first_name, last_name]).strip()))
+
+    return dict(entries)
+
+
+def get_entry(tenant_id, number):
+    """
+    Return the index entry of a normalized phone number, see build_entries.
+    """
+    key = get_key(tenant_id, number)
+    entry = cache.get(key)
+
+    if entry is None:
+        entry = build_entries(tenant_id, [number])[number]
+        cache.set(key, entry, settings.PHONE_NUMBER_INDEX_TIMEOUT)
+
+    return entry
+
+
+def get_routing(tenant_id, number, find_routing):
+    """
+    Return the cached routing of a call from the number, e.g. the internal number of the user to forward it to.
+
+    Routing depends on recent cases and deals, so it's kept shorter than the rest of the entry. It also depends on
+    the users of the tenant, so all routing of the tenant is invalidated when a user changes, see invalidate_routing.
+
+    Args:
+        find_routing (function): called with the number to determine the routing on a miss
+    """
+    key = get_key(tenant_id, number)
+    entry = get_entry(tenant_id, number)
+    routing_version = get_routing_version(tenant_id)
+
+    if entry.get('routing_expires', 0) < time.time() or entry.get('routing_version') != routing_version:
+        entry['routing'] = find_routing(number)
+        entry['routing_expires'] = time.time() + settings.PHONE_NUMBER_ROUTING_TIMEOUT
+        entry['routing_version'] = routing_version
+        cache.set(key, entry, settings.PHONE_NUMBER_INDEX_TIMEOUT)
+
+    return entry['routing']
+
+
+def get_routing_version(tenant_id):
+    return cache.get(PHONE_NUMBER_ROUTING_VERSION_KEY % tenant_id, 0)
+
+
+def invalidate_routing(tenant_id):
+    """
+    Invalidate the routing of all numbers of the tenant, routing with another version is determined again.
+    """
+    cache.set(PHONE_NUMBER_ROUTING_VERSION_KEY % tenant_id, time.time(), None)
+
+
+def warm(tenant_id):
+    """
+    Store the entries of all phone numbers of the tenant.
+    """
+    entries = build_entries(tenant_id)
+    cache.set_many(
+        dict((get_key(tenant_id, number), entry) for number, entry in entries.items()),
+        settings.PHONE_NUMBER_INDEX_TIMEOUT
+    )
+
+    return len(entries)
+
+
+def invalidate(tenant_id, numbers):
+    numbers = set(number for number in numbers if number)
+    if numbers:
+        cache.delete_many([get_key(tenant_id, number) for number in numbers])
+
+
+def get_numbers(*instances):
+    """
+    Return the phone numbers of the accounts and contacts, None values are skipped.
+    """
+    numbers = set()
+    for instance in instances:
+        if instance is not None:
+            numbers.update(instance.phone_numbers.values_list('number', flat=True))
+
+    return numbers
+
+
+def get_contact_numbers(account):
+    """
+    Return the phone numbers of the contacts of the account.
+    """
+    from lily.contacts.models import Contact
+
+    return set(Contact.objects.filter(functions__account=account).exclude(phone_numbers=None).values_list(
+        'phone_numbers__number', flat=True
+    ))
+
+
+def get_model_name(model):
+    # Deferred and proxy models send signals with their own class.
+    model = model._meta.concrete_model
+    return '%s.%s' % (model._meta.app_label, model._meta.model_name)
+
+
+@receiver(pre_save)
+def pre_save_phone_number(sender, instance, **kwargs):
+    # The entry of the old number is invalid too when a number is changed.
+    if get_model_name(sender) == 'utils.phonenumber' and instance.pk:
+        old_number = sender.objects.filter(pk=instance.pk).values_list('number', flat=True).first()
+        if old_number != instance.number:
+            invalidate(instance.tenant_id, [old_number])
+
+
+@receiver(pre_delete)
+def pre_delete_phone_number_data(sender, instance, **kwargs):
+    # The phone numbers and contacts of a deleted account or contact are unlinked before post_delete.
+    model_name = get_model_name(sender)
+    if model_name == 'accounts.account':
+        invalidate(instance.tenant_id, get_numbers(instance) | get_contact_numbers(instance))
+    elif model_name == 'contacts.contact':
+        invalidate(instance.tenant_id, get_numbers(instance))
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def post_change_phone_number_data(sender, instance, **kwargs):
+    model_name = get_model_name(sender)
+
+    if model_name == 'utils.phonenumber':
+        invalidate(instance.tenant_id, [instance.number])
+    elif model_name == 'accounts.account':
+        # The name or deleted status changed, calls to the numbers of its contacts can be routed to the assignee.
+        invalidate(instance.tenant_id, get_numbers(instance) | get_contact_numbers(instance))
+    elif model_name == 'contacts.contact':
+        # The name or deleted status changed.
+        invalidate(instance.tenant_id, get_numbers(instance))
+    elif model_name == 'contacts.function':
+        invalidate(instance.account.tenant_id, get_numbers(instance.account, instance.contact))
+    elif model_name in ['cases.case', 'deals.deal']:
+        # The routing of calls depends on the cases and deals.
+        invalidate(instance.tenant_id, get_numbers(instance.account, instance.contact))
+    elif model_name == 'notes.note':
+        # The latest note decides between an open case and an open deal of a contact.
+        if instance.content_type.model in ['case', 'deal']:
+            invalidate_routing(instance.tenant_id)
+    elif model_name == 'users.lilyuser':
+        # The routing contains the internal number of a user, logging in only changes the last login.
+        if kwargs.get('update_fields') != frozenset(['last_login']):
+            invalidate_routing(instance.tenant_id)
+
+
+@receiver(m2m_changed)
+def m2m_changed_phone_numbers(sender, instance, action, reverse, model, pk_set, **kwargs):
+    # Functions have phone numbers too, but those aren't part of the index.
+    if reverse or get_model_name(instance.__class__) not in ['accounts.account', 'contacts.contact']:
+        return
+
+    if get_model_name(model) == 'utils.phonenumber':
+        if action in ['post_add', 'post_remove']:
+            invalidate(instance.tenant_id, model.objects.filter(pk__in=pk_set).values_list('number', flat=True))
+        elif action == 'pre_clear':
+            invalidate(instance.tenant_id, get_numbers(instance))
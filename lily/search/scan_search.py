@@ -10,6 +10,9 @@ class ModelMappings(object):
     mappings = []
     model_to_mappings = {}
     app_to_mappings = {}
+    name_to_mappings = {}
+    # Model -> [(mapping, function returning the objects of the mapping related to an instance of the model)].
+    related_mappings = {}
 
     @classmethod
     def scan(cls, apps_to_scan=settings.INSTALLED_APPS):
@@ -31,5 +34,12 @@ class ModelMappings(object):
                         cls.mappings.append(member)
                         cls.model_to_mappings[member.get_model()] = member
                         cls.app_to_mappings[app] = member
+                        cls.name_to_mappings[member.get_mapping_type_name()] = member
             except Exception:
                 pass
+
+        # Precompute which mappings to update for a change of a model, so signals don't have to check every mapping.
+        cls.related_mappings = {}
+        for mapping in set(cls.mappings):
+            for model, related in mapping.get_related_models().items():
+                cls.related_mappings.setdefault(model, []).append((mapping, related))
@@ -1,7 +1,8 @@
+from django.db.models.query import QuerySet
 from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch.dispatcher import receiver
 
-from .indexing import update_in_index, remove_from_index
+from .indexing import bulk_update_in_index, update_in_index, remove_from_index
 from .scan_search import ModelMappings
 from django.conf import settings
 
@@ -56,16 +57,21 @@ def post_delete_generic(sender, instance, **kwargs):
 
 def check_related(sender, instance):
     """
-    Check related models by checking if the sender is in the relations of the
-    mappings.
+    Queue the objects of other mappings that contain data of the instance for reindexing.
+
+    The related mappings of every model are collected by ModelMappings.scan. The objects are queued by pk, so every
+    object is indexed once, in bulk, no matter how many of its related objects change.
     """
-    for mapping in ModelMappings.mappings:
-        # Use type(instance) because of sender, because m2m sender differs
-        # from type(instance).
-        related = mapping.get_related_models().get(type(instance))
-        if related:
-            for obj in related(instance):
-                # Some related objects are not specific to one model, such as
-                # 'subject' of Tag, so we do a double check to match the model.
-                if type(obj) is mapping.get_model():
-                    update_in_index(obj, mapping)
+    # Use type(instance) because of sender, because m2m sender differs
+    # from type(instance).
+    for mapping, related in ModelMappings.related_mappings.get(type(instance), []):
+        objects = related(instance)
+
+        if isinstance(objects, QuerySet):
+            # The documents are built by the index task, so only fetch the pks.
+            if objects.model is mapping.get_model():
+                bulk_update_in_index(mapping, objects.values_list('pk', flat=True))
+        else:
+            # Some related objects are not specific to one model, such as
+            # 'subject' of Tag, so we do a double check to match the model.
+            bulk_update_in_index(mapping, [obj.pk for obj in objects if type(obj) is mapping.get_model()])
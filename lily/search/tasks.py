@@ -0,0 +1,94 @@
+import logging
+from datetime import timedelta
+
+from celery.signals import task_postrun, task_prerun, worker_ready
+from celery.task import task
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import phone_number_index
+from .indexing import apply_operations, index_queue, update_changed_in_index
+from .scan_search import ModelMappings
+
+logger = logging.getLogger(__name__)
+
+LAST_CHANGED_UPDATE_CACHE_KEY = 'search_last_changed_update'
+PHONE_NUMBER_INDEX_WARM_CACHE_KEY = 'phone_number_index_warm'
+
+
+@task(name='update_index', logger=logger, bind=True, default_retry_delay=30, max_retries=5)
+def update_index(self, operations):
+    """
+    Apply queued index operations in bulk.
+
+    Args:
+        operations (list): [mapping type name, pk, operation] entries, see lily.search.indexing.IndexQueue.
+    """
+    failed_mappings = apply_operations(operations)
+    if failed_mappings:
+        # Only retry the operations that failed.
+        raise self.retry(args=([operation for operation in operations if operation[0] in failed_mappings],))
+
+
+def get_last_changed_update():
+    """
+    Return the time of the last update of changed objects, or None if unknown.
+    """
+    return cache.get(LAST_CHANGED_UPDATE_CACHE_KEY)
+
+
+def set_last_changed_update(value):
+    cache.set(LAST_CHANGED_UPDATE_CACHE_KEY, value, None)
+
+
+@task(name='update_changed_in_index', logger=logger)
+def update_changed_in_index_task():
+    """
+    Periodically bring the search index up to date with the changed objects, to repair missed index updates.
+    """
+    if settings.ES_DISABLED:
+        return
+
+    start = timezone.now()
+    since = get_last_changed_update() or start - timedelta(seconds=settings.ES_UPDATE_CHANGED_INTERVAL * 2)
+    # Overlap with the previous run, for transactions that were committed during it.
+    since -= timedelta(minutes=1)
+
+    for mapping in ModelMappings.mappings:
+        if not mapping.has_modified():
+            continue
+
+        indexed, removed = update_changed_in_index(mapping, since)
+        logger.info('Updated %s: %s indexed, %s removed', mapping.get_mapping_type_name(), indexed, removed)
+
+    set_last_changed_update(start)
+
+
+@task(name='warm_phone_number_index', logger=logger)
+def warm_phone_number_index():
+    """
+    Store the phone number index entries of all tenants, so caller ID lookups don't have to query the database.
+    """
+    from lily.tenant.models import Tenant
+
+    for tenant_id in Tenant.objects.values_list('pk', flat=True):
+        count = phone_number_index.warm(tenant_id)
+        logger.info('Warmed phone number index of tenant %s with %s numbers', tenant_id, count)
+
+
+@worker_ready.connect
+def warm_phone_number_index_on_start(**kwargs):
+    # Every worker sends this signal, only warm the index once when they start together.
+    if cache.add(PHONE_NUMBER_INDEX_WARM_CACHE_KEY, True, 5 * 60):
+        warm_phone_number_index.delay()
+
+
+@task_prerun.connect
+def defer_index_operations(**kwargs):
+    index_queue.defer()
+
+
+@task_postrun.connect
+def send_index_operations(**kwargs):
+    index_queue.release()
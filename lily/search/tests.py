@@ -0,0 +1,289 @@
+from datetime import timedelta
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from mock import Mock, patch
+
+from lily.accounts.factories import AccountFactory
+from lily.accounts.models import Account
+from lily.cases.factories import CaseFactory
+from lily.contacts.factories import FunctionFactory
+from lily.management.commands.index import Command as IndexCommand, create_partitions
+from lily.notes.factories import NoteFactory
+from lily.users.factories import LilyUserFactory
+from lily.utils.functions import parse_phone_number
+from lily.accounts.search import AccountMapping
+from lily.contacts.search import ContactMapping
+from lily.utils.models.models import PhoneNumber
+from . import phone_number_index
+from .functions import search_number
+from .indexing import IndexQueue, REMOVE, UPDATE, update_changed_in_index, update_documents
+from .signals import check_related
+from .tasks import get_last_changed_update, update_changed_in_index_task
+
+
+@override_settings(ES_INDEX_QUEUE_MAX_SIZE=100)
+@patch('lily.search.indexing.connection', Mock(in_atomic_block=False))
+@patch('lily.search.tasks.update_index.apply_async')
+class IndexQueueTests(TestCase):
+    def test_deduplicate_operations(self, apply_async_mock):
+        """
+        Test that deferred operations are sent once per object, with the last operation winning.
+        """
+        queue = IndexQueue()
+        queue.defer()
+        queue.add(AccountMapping, 1, UPDATE)
+        queue.add(AccountMapping, 1, UPDATE)
+        queue.add(ContactMapping, 1, UPDATE)
+        queue.add(AccountMapping, 2, UPDATE)
+        queue.add(AccountMapping, 2, REMOVE)
+
+        self.assertFalse(apply_async_mock.called)
+
+        queue.release()
+
+        apply_async_mock.assert_called_once_with(args=([
+            [AccountMapping.get_mapping_type_name(), 1, UPDATE],
+            [ContactMapping.get_mapping_type_name(), 1, UPDATE],
+            [AccountMapping.get_mapping_type_name(), 2, REMOVE],
+        ],))
+
+    def test_nested_defer(self, apply_async_mock):
+        """
+        Test that operations are only sent when the outermost defer is released.
+        """
+        queue = IndexQueue()
+        queue.defer()
+        queue.defer()
+        queue.add(AccountMapping, 1, UPDATE)
+        queue.release()
+
+        self.assertFalse(apply_async_mock.called)
+
+        queue.release()
+
+        self.assertEqual(apply_async_mock.call_count, 1)
+
+    def test_without_defer(self, apply_async_mock):
+        """
+        Test that operations are sent right away outside of a request or task.
+        """
+        queue = IndexQueue()
+        queue.add(AccountMapping, 1, UPDATE)
+
+        self.assertEqual(apply_async_mock.call_count, 1)
+        self.assertFalse(queue.operations)
+
+    @patch('lily.search.indexing.connection', Mock(in_atomic_block=True))
+    @patch('lily.search.indexing.apply_operations')
+    def test_without_defer_in_transaction(self, apply_operations_mock, apply_async_mock):
+        """
+        Test that operations are applied right away in a transaction outside of a request or task.
+        """
+        queue = IndexQueue()
+        queue.add(AccountMapping, 1, UPDATE)
+
+        self.assertFalse(apply_async_mock.called)
+        apply_operations_mock.assert_called_once_with([[AccountMapping.get_mapping_type_name(), 1, UPDATE]])
+        self.assertFalse(queue.operations)
+
+    @patch('lily.search.indexing.remove_documents')
+    @patch.object(AccountMapping, 'bulk_index')
+    def test_update_missing_object(self, bulk_index_mock, remove_documents_mock, apply_async_mock):
+        """
+        Test that updating an object that isn't found, e.g. because it isn't committed yet, doesn't remove it.
+        """
+        account = AccountFactory.create()
+        bulk_index_mock.reset_mock()
+        remove_documents_mock.reset_mock()
+
+        update_documents(AccountMapping, [account.pk, account.pk + 1000])
+
+        self.assertEqual(len(bulk_index_mock.call_args[0][0]), 1)
+        self.assertFalse(remove_documents_mock.called)
+
+
+class CheckRelatedTests(TestCase):
+    @patch('lily.search.signals.bulk_update_in_index')
+    def test_related_pks_queued(self, bulk_update_mock):
+        """
+        Test that a change of a related model queues the pks of the objects that contain its data.
+        """
+        account = AccountFactory.create()
+        phone_number = account.phone_numbers.first()
+
+        check_related(PhoneNumber, phone_number)
+
+        queued = {call[0][0]: list(call[0][1]) for call in bulk_update_mock.call_args_list}
+        self.assertEqual(queued[AccountMapping], [account.pk])
+        self.assertEqual(queued[ContactMapping], [])
+
+
+@patch('lily.search.phone_number_index.cache', LocMemCache('phone_number_index_tests', {}))
+class PhoneNumberIndexTests(TestCase):
+    def test_entry_invalidated(self):
+        """
+        Test that an entry is cached and rebuilt after the accounts of the number change.
+        """
+        account = AccountFactory.create()
+        phone_number = account.phone_numbers.first()
+        key = phone_number_index.get_key(account.tenant_id, phone_number.number)
+
+        entry = phone_number_index.get_entry(account.tenant_id, phone_number.number)
+        self.assertEqual(entry, {'accounts': [(account.pk, account.name)], 'contacts': []})
+        self.assertEqual(phone_number_index.cache.get(key), entry)
+
+        account.name = 'Renamed'
+        account.save()
+        self.assertIsNone(phone_number_index.cache.get(key))
+        entry = phone_number_index.get_entry(account.tenant_id, phone_number.number)
+        self.assertEqual(entry['accounts'], [(account.pk, 'Renamed')])
+
+        account.phone_numbers.remove(phone_number)
+        entry = phone_number_index.get_entry(account.tenant_id, phone_number.number)
+        self.assertEqual(entry, {'accounts': [], 'contacts': []})
+
+    def test_routing_invalidated_by_user(self):
+        """
+        Test that the cached routing is determined again after a user of the tenant changed.
+        """
+        account = AccountFactory.create()
+        user = LilyUserFactory.create(tenant=account.tenant)
+        number = account.phone_numbers.first().number
+        find_routing = Mock(side_effect=[{'internal_number': 201}, {'internal_number': 202}])
+
+        def get_internal_number():
+            return phone_number_index.get_routing(account.tenant_id, number, find_routing)['internal_number']
+
+        self.assertEqual(get_internal_number(), 201)
+
+        user.save(update_fields=['last_login'])
+        self.assertEqual(get_internal_number(), 201)
+
+        user.internal_number = 202
+        user.save()
+        self.assertEqual(get_internal_number(), 202)
+        self.assertEqual(find_routing.call_count, 2)
+
+    def test_entry_invalidated_by_account_of_contact(self):
+        """
+        Test that the entries of the contacts of an account are rebuilt after the account changes.
+        """
+        function = FunctionFactory.create()
+        contact = function.contact
+        phone_number = PhoneNumber.objects.create(tenant=contact.tenant, type='work', number='+31612345678')
+        contact.phone_numbers.add(phone_number)
+        key = phone_number_index.get_key(contact.tenant_id, phone_number.number)
+
+        phone_number_index.get_entry(contact.tenant_id, phone_number.number)
+        self.assertIsNotNone(phone_number_index.cache.get(key))
+
+        function.account.assigned_to = LilyUserFactory.create(tenant=contact.tenant)
+        function.account.save()
+        self.assertIsNone(phone_number_index.cache.get(key))
+
+    def test_routing_invalidated_by_note(self):
+        """
+        Test that the cached routing is determined again after a note of a case changed.
+        """
+        case = CaseFactory.create()
+        number = case.account.phone_numbers.first().number
+        find_routing = Mock(side_effect=[{'internal_number': 201}, {'internal_number': 202}])
+
+        def get_internal_number():
+            return phone_number_index.get_routing(case.tenant_id, number, find_routing)['internal_number']
+
+        self.assertEqual(get_internal_number(), 201)
+
+        NoteFactory.create(tenant=case.tenant, subject=case)
+        self.assertEqual(get_internal_number(), 202)
+
+    def test_search_number_outdated_entry(self):
+        """
+        Test that an entry of an account that no longer exists is rebuilt instead of failing.
+        """
+        account = AccountFactory.create()
+        number = parse_phone_number(account.phone_numbers.first().number)
+        phone_number_index.cache.set(phone_number_index.get_key(account.tenant_id, number), {
+            'accounts': [(0, 'Removed')],
+            'contacts': [],
+        })
+
+        results = search_number(account.tenant_id, number, return_related=False)
+
+        self.assertEqual(results['data']['accounts'], [account])
+
+
+class IndexCommandTests(TestCase):
+    def test_partitions_cover_pks(self):
+        """
+        Test that the partitions of an index cover the pk of every object exactly once.
+        """
+        AccountFactory.create_batch(7)
+        pks = set(Account.objects.filter(is_deleted=False).values_list('pk', flat=True))
+
+        for workers in [1, 2, 3, 8]:
+            partitions = create_partitions(AccountMapping, 'index_1', workers)
+            covered = []
+            for partition in partitions:
+                covered += [pk for pk in pks if partition['last_pk'] < pk <= partition['end_pk']]
+
+            self.assertLessEqual(len(partitions), workers)
+            self.assertEqual(sorted(covered), sorted(pks))
+
+    @patch('lily.management.commands.index.index_partition')
+    def test_resume_skips_done_partitions(self, index_partition_mock):
+        """
+        Test that resuming only indexes the partitions that weren't done.
+        """
+        index_partition_mock.side_effect = lambda partition, bulk_size, print_progress: dict(partition, indexed=1)
+        partitions = [
+            {'id': 'index_1-0', 'last_pk': 0, 'end_pk': 10, 'count': 10, 'done': True},
+            {'id': 'index_1-1', 'last_pk': 15, 'end_pk': 20, 'count': 5, 'done': False},
+        ]
+        command = IndexCommand()
+        command.workers = 1
+        command.bulk_size = 10
+
+        command.index_documents(AccountMapping, 'index_1', partitions)
+
+        self.assertEqual([call[0][0]['id'] for call in index_partition_mock.call_args_list], ['index_1-1'])
+
+
+class UpdateChangedInIndexTests(TestCase):
+    @patch('lily.search.indexing.remove_documents')
+    @patch('lily.search.indexing.index_objects', return_value=1)
+    def test_update_changed(self, index_objects_mock, remove_documents_mock):
+        """
+        Test that objects modified since the cutoff are indexed and deleted objects are removed.
+        """
+        unchanged, changed, deleted = AccountFactory.create_batch(3)
+        since = timezone.now() - timedelta(hours=1)
+        Account.objects.filter(pk=unchanged.pk).update(modified=since - timedelta(hours=1))
+        Account.objects.filter(pk=deleted.pk).update(is_deleted=True)
+
+        self.assertEqual(update_changed_in_index(AccountMapping, since), (1, 1))
+
+        queryset = index_objects_mock.call_args[0][1]
+        self.assertEqual(list(queryset.values_list('pk', flat=True)), [changed.pk])
+        remove_documents_mock.assert_called_once_with(AccountMapping, [deleted.pk])
+
+    @override_settings(ES_DISABLED=False)
+    @patch('lily.search.tasks.cache', LocMemCache('update_changed_in_index_tests', {}))
+    @patch('lily.search.tasks.update_changed_in_index', return_value=(0, 0))
+    def test_update_changed_task(self, update_changed_mock):
+        """
+        Test that the periodic task updates every mapping with a modified date since its previous run.
+        """
+        update_changed_in_index_task()
+        last_update = get_last_changed_update()
+
+        update_changed_in_index_task()
+
+        mappings = set(call[0][0] for call in update_changed_mock.call_args_list)
+        self.assertIn(AccountMapping, mappings)
+        self.assertTrue(all(mapping.has_modified() for mapping in mappings))
+        # The second run overlaps with the first.
+        self.assertEqual(update_changed_mock.call_args[0][1], last_update - timedelta(minutes=1))
+        self.assertGreater(get_last_changed_update(), last_update)
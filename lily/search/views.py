@@ -15,6 +15,7 @@ from lily.utils.functions import parse_phone_number
 from lily.utils.views.mixins import LoginRequiredMixin
 from lily.search.functions import search_number
 
+from . import phone_number_index
 from .lily_search import LilySearch
 
 
@@ -325,7 +326,8 @@ class InternalNumberSearchView(LoginRequiredMixin, View):
             # In the future we might change how we handle phone numbers.
             number = parse_phone_number(number)
 
-        results = self._search_number(number)
+        tenant_id = request.user.tenant_id
+        results = dict(phone_number_index.get_routing(tenant_id, number, self._get_routing))
 
         response_format = request.GET.get('format')
 
@@ -333,15 +335,13 @@ class InternalNumberSearchView(LoginRequiredMixin, View):
             name = ''
             internal_number = results.get('internal_number', '')
 
-            result = search_number(request.user.tenant_id, number, False)
-            data = result.get('data')
-            accounts = data.get('accounts')
-            contacts = data.get('contacts')
+            # The first account or contact of the number is the same as the one search_number returns.
+            entry = phone_number_index.get_entry(tenant_id, number)
 
-            if contacts:
-                name = contacts[0].full_name
-            elif accounts:
-                name = accounts[0].name
+            if entry['accounts']:
+                name = entry['accounts'][0][1]
+            elif entry['contacts']:
+                name = entry['contacts'][0][1]
 
             if name:
                 response = 'status=ACK&callername=%s' % name
@@ -352,14 +352,20 @@ class InternalNumberSearchView(LoginRequiredMixin, View):
                 response = 'status=NAK'
 
             return HttpResponse(response, content_type='text/plain; charset=utf-8')
-        else:
-            user = results.get('user')
-
-            if user:
-                results['user'] = user.id
 
         return HttpResponse(anyjson.dumps(results), content_type='application/json; charset=utf-8')
 
+    def _get_routing(self, number):
+        """
+        Return the result of _search_number with the id of the user, so it can be kept in the phone number index.
+        """
+        results = self._search_number(number)
+
+        if results:
+            results['user'] = results['user'].id
+
+        return results
+
     def _get_last_contacted(self, number):
         """
         Look for an account with the given number.
@@ -4,7 +4,8 @@ from datetime import timedelta
 from celery.schedules import crontab
 from kombu import Queue
 
-from .settings import DEBUG, TIME_ZONE, REDIS_URL
+from .settings import (DEBUG, TIME_ZONE, REDIS_URL, ES_UPDATE_CHANGED_INTERVAL, PHONE_NUMBER_INDEX_TIMEOUT,
+                       WEBHOOK_DELIVERY_INTERVAL)
 
 
 # The broker env var name to use for fetching the broker url.
@@ -45,6 +46,8 @@ CELERY_QUEUES = (
     Queue('email_first_sync', routing_key='email_first_sync'),
     # Miscellaneous tasks.
     Queue('other_tasks', routing_key='other_tasks'),
+    # Queued updates of the search index.
+    Queue('search_index', routing_key='search_index'),
 )
 CELERY_ROUTES = (
     {'synchronize_email_account_scheduler': {
@@ -61,6 +64,22 @@ CELERY_ROUTES = (
         # When task is created in first sync, this task will be routed to email_first_sync.
         'queue': 'email_scheduled_tasks'
     }},
+    {'download_email_messages': {
+        # When task is created in first sync, this task will be routed to email_first_sync.
+        'queue': 'email_scheduled_tasks'
+    }},
+    {'watch_email_account': {
+        'queue': 'email_scheduled_tasks'
+    }},
+    {'renew_email_account_watches_scheduler': {
+        'queue': 'email_scheduled_tasks'
+    }},
+    {'reconcile_email_label_counters_scheduler': {
+        'queue': 'email_scheduled_tasks'
+    }},
+    {'reconcile_email_label_counters': {
+        'queue': 'email_scheduled_tasks'
+    }},
     {'update_labels_for_message': {
         # When task is created in first sync, this task will be routed to email_first_sync.
         'queue': 'email_scheduled_tasks'
@@ -68,6 +87,33 @@ CELERY_ROUTES = (
     {'check_subscriptions': {
         'queue': 'other_tasks'
     }},
+    {'update_index': {
+        'queue': 'search_index'
+    }},
+    {'update_changed_in_index': {
+        'queue': 'search_index'
+    }},
+    {'warm_phone_number_index': {
+        'queue': 'other_tasks'
+    }},
+    {'export_list': {
+        'queue': 'other_tasks'
+    }},
+    {'delete_expired_exports_scheduler': {
+        'queue': 'other_tasks'
+    }},
+    {'deliver_webhook_events': {
+        'queue': 'other_tasks'
+    }},
+    {'deliver_pending_webhook_events': {
+        'queue': 'other_tasks'
+    }},
+    {'refresh_stats_rollups': {
+        'queue': 'other_tasks'
+    }},
+    {'refresh_stats_rollups_scheduler': {
+        'queue': 'other_tasks'
+    }},
 )
 CELERYBEAT_SCHEDULE = {
     'synchronize_email_account_scheduler': {
@@ -82,6 +128,10 @@ CELERYBEAT_SCHEDULE = {
         'task': 'synchronize_labels_scheduler',
         'schedule': timedelta(seconds=3600),  # Once every hour.
     },
+    'renew_email_account_watches_scheduler': {
+        'task': 'renew_email_account_watches_scheduler',
+        'schedule': timedelta(seconds=3600),  # Once every hour.
+    },
     'clear_sessions_scheduler': {
         'task': 'clear_sessions_scheduler',
         'schedule': crontab(hour=1, minute=0),  # Every night at one o'clock.
@@ -90,4 +140,29 @@ CELERYBEAT_SCHEDULE = {
         'task': 'cleanup_deleted_email_accounts',
         'schedule': crontab(hour=1, minute=0),  # Every night at one o'clock.
     },
+    'update_changed_in_index_scheduler': {
+        'task': 'update_changed_in_index',
+        'schedule': timedelta(seconds=ES_UPDATE_CHANGED_INTERVAL),
+    },
+    'deliver_pending_webhook_events_scheduler': {
+        'task': 'deliver_pending_webhook_events',
+        'schedule': timedelta(seconds=WEBHOOK_DELIVERY_INTERVAL),
+    },
+    'warm_phone_number_index_scheduler': {
+        'task': 'warm_phone_number_index',
+        # Warm before the entries expire, so the index stays complete.
+        'schedule': timedelta(seconds=PHONE_NUMBER_INDEX_TIMEOUT / 2),
+    },
+    'refresh_stats_rollups_scheduler': {
+        'task': 'refresh_stats_rollups_scheduler',
+        'schedule': crontab(hour=2, minute=0),  # Every night at two o'clock.
+    },
+    'delete_expired_exports_scheduler': {
+        'task': 'delete_expired_exports_scheduler',
+        'schedule': crontab(hour=2, minute=0),  # Every night at two o'clock.
+    },
+    'reconcile_email_label_counters_scheduler': {
+        'task': 'reconcile_email_label_counters_scheduler',
+        'schedule': crontab(hour=3, minute=0),  # Every night at three o'clock.
+    },
 }
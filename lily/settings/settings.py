@@ -176,10 +176,17 @@ LILYUSER_PICTURE_UPLOAD_TO = 'users/lilyuser/%(tenant_id)d/%(user_id)d/%(filenam
 LILYUSER_PICTURE_MAX_SIZE = os.environ.get('MAX_AVATAR_SIZE', 300 * 1024)
 
 EMAIL_ATTACHMENT_UPLOAD_TO = 'messaging/email/attachments/%(tenant_id)d/%(message_id)d/%(filename)s'
+# Attachments of email messages are stored once per tenant, content hash and filename.
+EMAIL_ATTACHMENT_BLOB_UPLOAD_TO = 'messaging/email/attachments/%(tenant_id)d/blobs/%(content_hash)s/%(filename)s'
 
 EMAIL_TEMPLATE_ATTACHMENT_UPLOAD_TO = ('messaging/email/templates/attachments'
                                        '/%(tenant_id)d/%(template_id)d/%(filename)s')
 
+# Exports that are too large to stream in a request are written here by a task.
+EXPORT_UPLOAD_TO = 'exports/%(tenant_id)d/%(job_id)s/%(filename)s'
+# Seconds the status and the file of an export job are kept.
+EXPORT_JOB_TIMEOUT = int(os.environ.get('EXPORT_JOB_TIMEOUT', 24 * 60 * 60))
+
 
 STATICFILES_DIRS = (
     local_path('static/'),
@@ -260,6 +267,7 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.messages.middleware.MessageMiddleware',
     'lily.tenant.middleware.TenantMiddleware',
     'two_factor.middleware.threadlocals.ThreadLocals',
+    'lily.search.middleware.IndexQueueMiddleware',
 )
 
 #######################################################################################################################
@@ -574,6 +582,45 @@ ES_MAXSIZE = os.environ.get('ES_MAXSIZE', 2)  # Default is 10
 
 ES_BLOCK = os.environ.get('ES_BLOCK', True)  # Default is False
 
+# Number of documents sent to Elasticsearch per bulk request.
+ES_INDEX_BULK_SIZE = int(os.environ.get('ES_INDEX_BULK_SIZE', 500))
+
+# Number of queued index operations after which they are sent to the update_index task before the request ends.
+ES_INDEX_QUEUE_MAX_SIZE = int(os.environ.get('ES_INDEX_QUEUE_MAX_SIZE', 1000))
+
+# How often Elasticsearch makes indexed documents searchable, instead of refreshing after every update.
+ES_REFRESH_INTERVAL = os.environ.get('ES_REFRESH_INTERVAL', '1s')
+
+# Number of replicas of every index, replication is disabled while (re)building an index.
+ES_NUMBER_OF_REPLICAS = int(os.environ.get('ES_NUMBER_OF_REPLICAS', 1))
+
+# Seconds between the periodic updates of objects changed since the last update, to repair missed index updates.
+ES_UPDATE_CHANGED_INTERVAL = int(os.environ.get('ES_UPDATE_CHANGED_INTERVAL', 15 * 60))
+
+# Number of results per shard fetched at once when scrolling through all results, e.g. for exports.
+ES_SCROLL_SIZE = int(os.environ.get('ES_SCROLL_SIZE', 500))
+
+# How long Elasticsearch keeps the results of a scroll between fetches.
+ES_SCROLL_TIMEOUT = os.environ.get('ES_SCROLL_TIMEOUT', '5m')
+
+# Maximum number of results of a search in the API that can't be paginated in the index.
+ES_SEARCH_FILTER_MAX_RESULTS = int(os.environ.get('ES_SEARCH_FILTER_MAX_RESULTS', 10000))
+
+# Seconds the accounts and contacts of a phone number are cached for caller ID lookups.
+PHONE_NUMBER_INDEX_TIMEOUT = int(os.environ.get('PHONE_NUMBER_INDEX_TIMEOUT', 24 * 60 * 60))
+
+# Seconds the user a call from a phone number is routed to is cached.
+PHONE_NUMBER_ROUTING_TIMEOUT = int(os.environ.get('PHONE_NUMBER_ROUTING_TIMEOUT', 60 * 60))
+
+# Seconds the results of a stats widget are cached.
+STATS_CACHE_TIMEOUT = int(os.environ.get('STATS_CACHE_TIMEOUT', 5 * 60))
+
+# Number of past days of which the stats rollups are recomputed every night.
+STATS_ROLLUP_DAYS = int(os.environ.get('STATS_ROLLUP_DAYS', 62))
+
+# Seconds the stats rollups of a day are refreshed after a case or deal of that day changed.
+STATS_REFRESH_DELAY = int(os.environ.get('STATS_REFRESH_DELAY', 60))
+
 #######################################################################################################################
 # Gmail settings                                                                                                  #
 #######################################################################################################################
@@ -581,10 +628,28 @@ GOOGLE_OAUTH2_CLIENT_ID = os.environ.get('GOOGLE_OAUTH2_CLIENT_ID', '')
 GOOGLE_OAUTH2_CLIENT_SECRET = os.environ.get('GOOGLE_OAUTH2_CLIENT_SECRET', '')
 GMAIL_FULL_MESSAGE_BATCH_SIZE = os.environ.get('GMAIL_FULL_MESSAGE_BATCH_SIZE', 300)
 GMAIL_LABEL_UPDATE_BATCH_SIZE = os.environ.get('GMAIL_LABEL_UPDATE_BATCH_SIZE', 500)
+# Number of messages downloaded with a single batch request, Gmail allows at most 100 requests per batch.
+GMAIL_DOWNLOAD_BATCH_SIZE = int(os.environ.get('GMAIL_DOWNLOAD_BATCH_SIZE', 50))
+# Number of email accounts for which a worker keeps the credentials and authorized http instances in memory.
+GMAIL_SERVICE_CACHE_SIZE = int(os.environ.get('GMAIL_SERVICE_CACHE_SIZE', 500))
+# Number of seconds before cached credentials are loaded from the database again.
+GMAIL_SERVICE_CACHE_TIMEOUT = int(os.environ.get('GMAIL_SERVICE_CACHE_TIMEOUT', 1800))
+# Number of seconds a rendered email body is cached.
+EMAIL_BODY_CACHE_TIMEOUT = int(os.environ.get('EMAIL_BODY_CACHE_TIMEOUT', 86400))
 GMAIL_PARTIAL_SYNC_LIMIT = os.environ.get('GMAIL_PARTIAL_SYNC_LIMIT', 899)
 GMAIL_CALLBACK_URL = os.environ.get('GMAIL_CALLBACK_URL', 'http://localhost:8000/messaging/email/callback/')
 GMAIL_SYNC_DELAY_INTERVAL = 1
 GMAIL_SYNC_LOCK_LIFETIME = 300
+# Seconds between incremental syncs of a mailbox that changed, the interval doubles for every sync without changes up
+# to the maximum interval. Mailboxes with push notifications are polled at the maximum interval.
+GMAIL_SYNC_MIN_INTERVAL = int(os.environ.get('GMAIL_SYNC_MIN_INTERVAL', 60))
+GMAIL_SYNC_MAX_INTERVAL = int(os.environ.get('GMAIL_SYNC_MAX_INTERVAL', 30 * 60))
+# Seconds after which the labels of a mailbox without changes are synced anyway.
+GMAIL_LABEL_SYNC_MAX_AGE = int(os.environ.get('GMAIL_LABEL_SYNC_MAX_AGE', 24 * 60 * 60))
+# The Cloud Pub/Sub topic Gmail publishes push notifications to, push notifications are disabled when empty.
+GMAIL_PUSH_TOPIC = os.environ.get('GMAIL_PUSH_TOPIC', '')
+# Secret the Pub/Sub push subscription passes as the token query parameter of the push endpoint.
+GMAIL_PUSH_TOKEN = os.environ.get('GMAIL_PUSH_TOKEN', '')
 # A chuck size of -1 indicates that the entire file should be uploaded in a single request. If the underlying platform
 # supports streams, such as Python 2.6 or later, then this can be very efficient as it avoids multiple connections, and
 # also avoids loading the entire file into memory before sending it.
@@ -594,6 +659,12 @@ GMAIL_CHUNK_SIZE = -1
 # With resumable uploads enabled, tests on sending email behave different when mocking. In the old situation resumable
 # was enabled but code handling failing uploads was missing.
 GMAIL_UPLOAD_RESUMABLE = False
+# Messages larger than this number of bytes are always sent with a resumable upload, in chunks of the given number of
+# bytes (a multiple of 256 KB), so they are never read into memory at once.
+GMAIL_RESUMABLE_UPLOAD_SIZE = int(os.environ.get('GMAIL_RESUMABLE_UPLOAD_SIZE', 5 * 1024 * 1024))
+GMAIL_RESUMABLE_CHUNK_SIZE = int(os.environ.get('GMAIL_RESUMABLE_CHUNK_SIZE', 4 * 1024 * 1024))
+# Outgoing messages larger than this number of bytes are written to a temporary file instead of memory.
+EMAIL_SPOOL_MAX_MEMORY_SIZE = int(os.environ.get('EMAIL_SPOOL_MAX_MEMORY_SIZE', 1024 * 1024))
 GMAIL_LABEL_INBOX = os.environ.get('GMAIL_LABEL_INBOX', 'INBOX')
 GMAIL_LABEL_SPAM = os.environ.get('GMAIL_LABEL_SPAM', 'SPAM')
 GMAIL_LABEL_TRASH = os.environ.get('GMAIL_LABEL_TRASH', 'TRASH')
@@ -630,6 +701,9 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'lily.api.drf_extensions.pagination.CustomPagination',
 }
 
+# Seconds an API token is cached with its user, tenant and plan.
+API_TOKEN_CACHE_TIMEOUT = int(os.environ.get('API_TOKEN_CACHE_TIMEOUT', 10 * 60))
+
 #######################################################################################################################
 # External app settings                                                                                               #
 #######################################################################################################################
@@ -679,6 +753,22 @@ MULTI_TENANT = boolean(os.environ.get('MULTI_TENANT', 0))
 
 BILLING_ENABLED = boolean(os.environ.get('BILLING_ENABLED', 0))
 
+# Number of rows the import commands write per transaction.
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 1000))
+
+# Webhooks
+# Seconds to wait for a webhook endpoint to respond.
+WEBHOOK_TIMEOUT = int(os.environ.get('WEBHOOK_TIMEOUT', 10))
+# Number of deliveries to a single webhook endpoint at the same time.
+WEBHOOK_CONCURRENCY = int(os.environ.get('WEBHOOK_CONCURRENCY', 1))
+# Maximum number of events posted at once to webhooks that accept batches.
+WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', 50))
+# Failed deliveries are retried after 1, 2, 4, ... times this number of seconds, until the maximum attempts are used.
+WEBHOOK_RETRY_DELAY = int(os.environ.get('WEBHOOK_RETRY_DELAY', 30))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 10))
+# Seconds between the periodic deliveries of pending events, e.g. events of which the delivery should be retried.
+WEBHOOK_DELIVERY_INTERVAL = int(os.environ.get('WEBHOOK_DELIVERY_INTERVAL', 60))
+
 # Django Bootstrap
 # TODO: These settings can be removed once all forms are converted to Angular
 BOOTSTRAP3 = {
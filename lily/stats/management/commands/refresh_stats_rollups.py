@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from lily.tenant.models import Tenant
+
+from ...rollups import refresh_recent_rollups
+
+
+class Command(BaseCommand):
+    help = """Recompute the stats rollups of the last days of every tenant, e.g. to fill them after a deploy."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenant', type=int, action='append', dest='tenants',
+                            help='Only recompute the rollups of this tenant, can be given multiple times.')
+        parser.add_argument('--days', type=int, default=settings.STATS_ROLLUP_DAYS,
+                            help='Number of days to recompute, defaults to STATS_ROLLUP_DAYS.')
+
+    def handle(self, *args, **options):
+        tenant_ids = options['tenants'] or Tenant.objects.values_list('pk', flat=True)
+
+        for tenant_id in tenant_ids:
+            refresh_recent_rollups(tenant_id, options['days'])
+            self.stdout.write('Refreshed stats rollups of tenant %s.' % tenant_id)
+
+        self.stdout.write('Done.')
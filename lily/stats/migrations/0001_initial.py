@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tenant', '0005_tenant_billing'),
+        ('users', '0022_auto_20170508_1525'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('date', models.DateField()),
+                ('metric', models.CharField(max_length=50)),
+                ('group', models.CharField(max_length=255, blank=True)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('amount', models.DecimalField(default=0, max_digits=19, decimal_places=2)),
+                ('team', models.ForeignKey(to='users.Team', null=True)),
+                ('tenant', models.ForeignKey(to='tenant.Tenant')),
+                ('user', models.ForeignKey(to=settings.AUTH_USER_MODEL, null=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='dailyrollup',
+            index_together=set([('tenant', 'metric', 'date')]),
+        ),
+    ]
@@ -0,0 +1,89 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from lily.cases.models import Case
+from lily.deals.models import Deal
+from lily.tags.models import Tag
+from lily.tenant.models import Tenant
+from lily.users.models import LilyUser, Team
+
+
+class DailyRollup(models.Model):
+    """
+    Aggregate of a metric of the cases or deals of a tenant on a single day (UTC), see lily.stats.rollups.
+
+    The stats widgets sum the rollups of the days they cover, so they don't depend on the size of the history.
+    """
+    # Number of cases created, grouped by case type.
+    CASES_CREATED = 'cases_created'
+    # Number of cases created with at least one tag.
+    CASES_WITH_TAGS = 'cases_with_tags'
+    # Number of times a tag is used on the cases created, grouped by tag name.
+    CASE_TAGS = 'case_tags'
+    # Number and recurring amount of the deals won and lost, grouped by new business.
+    DEALS_WON = 'deals_won'
+    DEALS_LOST = 'deals_lost'
+
+    tenant = models.ForeignKey(Tenant)
+    date = models.DateField()
+    metric = models.CharField(max_length=50)
+    team = models.ForeignKey(Team, null=True)
+    user = models.ForeignKey(LilyUser, null=True)
+    group = models.CharField(max_length=255, blank=True)
+    count = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(max_digits=19, decimal_places=2, default=0)
+
+    class Meta:
+        index_together = [
+            ['tenant', 'metric', 'date'],
+        ]
+
+
+@receiver(post_save, sender=Case)
+@receiver(post_delete, sender=Case)
+def case_changed(sender, instance, **kwargs):
+    from .rollups import schedule_refresh
+
+    if instance.created:
+        schedule_refresh(instance.tenant_id, instance.created)
+
+
+@receiver(m2m_changed, sender=Case.assigned_to_teams.through)
+def case_teams_changed(sender, instance, action, reverse, **kwargs):
+    from .rollups import schedule_refresh
+
+    if action.startswith('post_') and not reverse and instance.created:
+        schedule_refresh(instance.tenant_id, instance.created)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, instance, **kwargs):
+    from .rollups import schedule_refresh
+
+    if ContentType.objects.get_for_id(instance.content_type_id).model_class() is Case:
+        created = Case.objects.filter(pk=instance.object_id).values_list('created', flat=True).first()
+        if created:
+            schedule_refresh(instance.tenant_id, created)
+
+
+@receiver(pre_save, sender=Deal)
+def deal_closed_date_changed(sender, instance, **kwargs):
+    from .rollups import schedule_refresh
+
+    # The rollups of the old closed date are outdated too.
+    if instance.pk:
+        closed_date = Deal.objects.filter(pk=instance.pk).values_list('closed_date', flat=True).first()
+        if closed_date and closed_date != instance.closed_date:
+            schedule_refresh(instance.tenant_id, closed_date)
+
+
+@receiver(post_save, sender=Deal)
+@receiver(post_delete, sender=Deal)
+def deal_changed(sender, instance, **kwargs):
+    from .rollups import schedule_refresh
+
+    if instance.closed_date:
+        schedule_refresh(instance.tenant_id, instance.closed_date)
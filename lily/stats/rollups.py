@@ -0,0 +1,185 @@
+"""
+Daily rollups of the case and deal statistics of every tenant.
+
+The rollups of a day are recomputed shortly after a case or deal of that day changes, and every night for the period
+the stats widgets cover, which also repairs rollups of changes that were missed.
+"""
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from lily.cases.models import Case
+from lily.deals.models import Deal
+from lily.tags.models import Tag
+
+from .models import DailyRollup
+
+# Tags of cases of these types aren't part of the top tags.
+TOP_TAGS_EXCLUDED_CASE_TYPES = ['Config', 'Retour', 'Callback']
+
+REFRESH_KEY = 'stats_refresh_%s_%s'
+REFRESHED_KEY = 'stats_refreshed_%s'
+
+
+def get_day(value):
+    """
+    Return the date in UTC of a datetime, the rollups are per UTC day like the original stats queries.
+    """
+    if isinstance(value, datetime):
+        return timezone.localtime(value, timezone.utc).date() if timezone.is_aware(value) else value.date()
+
+    return value
+
+
+def get_day_range(day):
+    start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+def compute_case_rollups(tenant_id, day):
+    start, end = get_day_range(day)
+
+    cases = Case.objects.filter(
+        tenant_id=tenant_id,
+        is_deleted=False,
+        created__gte=start,
+        created__lt=end,
+        assigned_to_teams__isnull=False,
+    ).values_list('id', 'assigned_to_teams', 'type__name')
+
+    case_tags = defaultdict(list)
+    for case_id, name in Tag.objects.filter(
+        tenant_id=tenant_id,
+        content_type=ContentType.objects.get_for_model(Case),
+        object_id__in=set(case[0] for case in cases),
+    ).exclude(name='').values_list('object_id', 'name'):
+        case_tags[case_id].append(name)
+
+    created = Counter()
+    with_tags = Counter()
+    tags = Counter()
+    for case_id, team_id, type_name in cases:
+        created[(team_id, type_name)] += 1
+
+        if case_tags[case_id]:
+            with_tags[team_id] += 1
+
+            if type_name not in TOP_TAGS_EXCLUDED_CASE_TYPES:
+                for name in case_tags[case_id]:
+                    tags[(team_id, name)] += 1
+
+    rollups = []
+    for (team_id, type_name), count in created.items():
+        rollups.append(DailyRollup(metric=DailyRollup.CASES_CREATED, team_id=team_id, group=type_name, count=count))
+
+    for team_id, count in with_tags.items():
+        rollups.append(DailyRollup(metric=DailyRollup.CASES_WITH_TAGS, team_id=team_id, count=count))
+
+    for (team_id, name), count in tags.items():
+        rollups.append(DailyRollup(metric=DailyRollup.CASE_TAGS, team_id=team_id, group=name, count=count))
+
+    return rollups
+
+
+def compute_deal_rollups(tenant_id, day):
+    start, end = get_day_range(day)
+    metrics = {
+        'Won': DailyRollup.DEALS_WON,
+        'Lost': DailyRollup.DEALS_LOST,
+    }
+
+    deals = Deal.objects.filter(
+        tenant_id=tenant_id,
+        is_deleted=False,
+        closed_date__gte=start,
+        closed_date__lt=end,
+        assigned_to__isnull=False,
+        status__name__in=metrics.keys(),
+    ).values('assigned_to', 'status__name', 'new_business').annotate(
+        count=Count('id'),
+        amount=Sum('amount_recurring'),
+    ).order_by()
+
+    return [DailyRollup(
+        metric=metrics[deal['status__name']],
+        user_id=deal['assigned_to'],
+        group=str(deal['new_business']),
+        count=deal['count'],
+        amount=deal['amount'] or 0,
+    ) for deal in deals]
+
+
+def refresh_rollups(tenant_id, day):
+    """
+    Recompute all rollups of a tenant on a day.
+    """
+    rollups = compute_case_rollups(tenant_id, day) + compute_deal_rollups(tenant_id, day)
+
+    for rollup in rollups:
+        rollup.tenant_id = tenant_id
+        rollup.date = day
+
+    with transaction.atomic():
+        DailyRollup.objects.filter(tenant_id=tenant_id, date=day).delete()
+        DailyRollup.objects.bulk_create(rollups)
+
+
+def refresh_recent_rollups(tenant_id, days):
+    """
+    Recompute the rollups of a tenant of the last days and store the timing of the refresh.
+    """
+    start_time = time.time()
+    today = get_day(timezone.now())
+
+    for offset in range(days):
+        refresh_rollups(tenant_id, today - timedelta(days=offset))
+
+    set_refresh_timing(tenant_id, time.time() - start_time)
+
+
+def schedule_refresh(tenant_id, value):
+    """
+    Refresh the rollups of the day of a changed case or deal soon, once for all changes of that day in the meantime.
+    """
+    from .tasks import refresh_stats_rollups
+
+    day = get_day(value)
+    if cache.add(REFRESH_KEY % (tenant_id, day), True, settings.STATS_REFRESH_DELAY + 60):
+        refresh_stats_rollups.apply_async(args=(tenant_id, day.isoformat()), countdown=settings.STATS_REFRESH_DELAY)
+
+
+def clear_scheduled_refresh(tenant_id, day):
+    cache.delete(REFRESH_KEY % (tenant_id, day))
+
+
+def set_refresh_timing(tenant_id, duration):
+    cache.set(REFRESHED_KEY % tenant_id, {
+        'refreshed': timezone.now(),
+        'duration': duration,
+    }, None)
+
+
+def get_refresh_timing(tenant_id):
+    """
+    Return when and in how many seconds the rollups of the tenant were last refreshed, or None if unknown.
+    """
+    return cache.get(REFRESHED_KEY % tenant_id)
+
+
+def get_rollups(tenant_id, metric, start, end, team_id=None):
+    """
+    Return the rollups of a metric of the days from start up to end.
+    """
+    rollups = DailyRollup.objects.filter(tenant_id=tenant_id, metric=metric, date__gte=start, date__lt=end)
+
+    if team_id is not None:
+        rollups = rollups.filter(team_id=team_id)
+
+    return rollups
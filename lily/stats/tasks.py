@@ -0,0 +1,35 @@
+import logging
+
+from celery.task import task
+from django.conf import settings
+from django.utils.dateparse import parse_date
+
+from . import rollups
+
+logger = logging.getLogger(__name__)
+
+
+@task(name='refresh_stats_rollups', logger=logger)
+def refresh_stats_rollups(tenant_id, day):
+    """
+    Recompute the stats rollups of a tenant on a day after cases or deals of that day changed.
+
+    Args:
+        day (str): the date in ISO format
+    """
+    day = parse_date(day)
+    # Changes from now on need another refresh.
+    rollups.clear_scheduled_refresh(tenant_id, day)
+    rollups.refresh_rollups(tenant_id, day)
+
+
+@task(name='refresh_stats_rollups_scheduler', logger=logger)
+def refresh_stats_rollups_scheduler():
+    """
+    Recompute the stats rollups of all tenants for the period the stats cover, to repair missed refreshes.
+    """
+    from lily.tenant.models import Tenant
+
+    for tenant_id in Tenant.objects.values_list('pk', flat=True):
+        rollups.refresh_recent_rollups(tenant_id, settings.STATS_ROLLUP_DAYS)
+        logger.info('Refreshed stats rollups of tenant %s', tenant_id)
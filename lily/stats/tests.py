@@ -1,7 +1,12 @@
 from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.utils import timezone
 
+from lily.cases.factories import CaseFactory, CaseTypeFactory
+from lily.tags.factories import TagFactory
 from lily.users.factories import TeamFactory, LilyUserFactory
+from .models import DailyRollup
+from .rollups import get_day, refresh_rollups
 from .urls import case_patterns, deal_patterns
 
 
@@ -26,3 +31,24 @@ class StatsTests(TestCase):
             # Loop over deal patterns, these need no kwargs.
             response = self.client.get(reverse(pattern.name))
             self.assertEqual(response.status_code, 200)
+
+    def test_refresh_rollups(self):
+        """
+        Test that the rollups of a day aggregate the cases of that day per team.
+        """
+        team = TeamFactory()
+        case_type = CaseTypeFactory(tenant=team.tenant, name='Question')
+        cases = CaseFactory.create_batch(3, tenant=team.tenant, type=case_type)
+        for case in cases:
+            case.assigned_to_teams.add(team)
+        TagFactory(tenant=team.tenant, subject=cases[0], name='billing')
+
+        day = get_day(timezone.now())
+        refresh_rollups(team.tenant_id, day)
+        # Refreshing again replaces the rollups of the day.
+        refresh_rollups(team.tenant_id, day)
+
+        rollups = DailyRollup.objects.filter(tenant=team.tenant, date=day, team=team)
+        self.assertEqual(rollups.get(metric=DailyRollup.CASES_CREATED, group='Question').count, 3)
+        self.assertEqual(rollups.get(metric=DailyRollup.CASES_WITH_TAGS).count, 1)
+        self.assertEqual(rollups.get(metric=DailyRollup.CASE_TAGS, group='billing').count, 1)
@@ -1,11 +1,21 @@
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
 import anyjson
+from django.conf import settings
+from django.core.cache import cache
 from django.db import connection
+from django.db.models import Sum
 from django.http import HttpResponse
+from django.utils import timezone
 from django.views.generic import View
 
 from lily.deals.models import DealStatus
 from lily.utils.views import LoginRequiredMixin
 
+from .models import DailyRollup
+from .rollups import get_day, get_day_range, get_refresh_timing, get_rollups
+
 
 def dictfetchall(cursor):
     """
@@ -18,23 +28,57 @@ def dictfetchall(cursor):
     ]
 
 
-class RawDatabaseView(LoginRequiredMixin, View):
+def get_last_week():
+    """
+    Return the first day of last week and the first day of this week, weeks start on monday.
+    """
+    today = get_day(timezone.now())
+    start = today - timedelta(days=today.weekday() + 7)
+    return start, start + timedelta(days=7)
+
+
+def get_last_month():
+    """
+    Return the first day of last month and the first day of this month.
+    """
+    end = get_day(timezone.now()).replace(day=1)
+    return (end - timedelta(days=1)).replace(day=1), end
+
+
+def get_average(amount, count):
+    return (amount / count).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+class StatsView(LoginRequiredMixin, View):
+    """
+    Base view of a stats widget.
+
+    The results are cached per tenant, team and day for STATS_CACHE_TIMEOUT seconds.
+    """
 
     def get(self, request, *args, **kwargs):
+        key = 'stats_%s_%s_%s_%s' % (
+            self.__class__.__name__,
+            request.user.tenant_id,
+            kwargs.get('team_id', ''),
+            get_day(timezone.now()),
+        )
+        results = cache.get(key)
 
-        query = self.get_query(request, *args, **kwargs)
+        if results is None:
+            results = self.get_results(request, *args, **kwargs)
+            cache.set(key, results, settings.STATS_CACHE_TIMEOUT)
 
-        if query:
-            cursor = connection.cursor()
-            cursor.execute(query)
+        response = HttpResponse(anyjson.dumps(results))
 
-            results = self.parse_results(dictfetchall(cursor))
-        else:
-            results = []
+        timing = get_refresh_timing(request.user.tenant_id)
+        if timing:
+            response['X-Stats-Refreshed'] = timing['refreshed'].isoformat()
+            response['X-Stats-Refresh-Duration'] = '%.3f' % timing['duration']
 
-        return HttpResponse(anyjson.dumps(results))
+        return response
 
-    def get_query(self, request, *args, **kwargs):
+    def get_results(self, request, *args, **kwargs):
         raise NotImplementedError
 
     def parse_results(self, results):
@@ -50,98 +94,72 @@ class RawDatabaseView(LoginRequiredMixin, View):
         return parsed_results
 
 
-class CasesTotalCountLastWeek(RawDatabaseView):
+class RawDatabaseView(StatsView):
+    """
+    Stats widget of the current state of the cases or deals, which are queried directly.
+    """
 
-    def get_query(self, request, *args, **kwargs):
-        return '''
-            SELECT
-                count (cases_case.id)
-            FROM
-                cases_case,
-                cases_casestatus,
-                cases_casetype,
-                cases_case_assigned_to_teams
-            WHERE
-                cases_case.status_id = cases_casestatus.id AND
-                cases_case.type_id = cases_casetype.id AND
-                cases_case.id = cases_case_assigned_to_teams.case_id AND
-                cases_case.tenant_id = {tenant_id} AND
-                cases_case_assigned_to_teams.team_id = {team_id} AND
-                cases_case.is_deleted = false AND
+    def get_results(self, request, *args, **kwargs):
 
-                /*last week*/
-                cases_case.created BETWEEN  date_trunc( 'week', now() - interval '1 week' ) AND
-                date_trunc( 'week', now() - interval '1 week' )+ interval '1 week' - interval '1 second';
-        '''.format(
-            tenant_id=request.user.tenant_id,
-            team_id=int(kwargs['team_id']),
-        )
+        query = self.get_query(request, *args, **kwargs)
 
+        if query:
+            cursor = connection.cursor()
+            cursor.execute(query)
+
+            results = self.parse_results(dictfetchall(cursor))
+        else:
+            results = []
 
-class CasesPerTypeCountLastWeek(RawDatabaseView):
+        return results
 
     def get_query(self, request, *args, **kwargs):
-        return '''
-            SELECT
-                count(cases_case.id),
-                cases_casetype.name,
-                date_trunc( 'week', now() - interval '1 week' ) as from,
-                (date_trunc('week', now() - interval '1 week' ) + interval '1 week' - interval '1 second') as to,
-                EXTRACT(WEEK FROM date_trunc( 'week', now() - interval '1 week' )) as weeknr
-            FROM
-                cases_case,
-                cases_casestatus,
-                cases_casetype,
-                cases_case_assigned_to_teams
-            WHERE
-                cases_case.status_id = cases_casestatus.id AND
-                cases_case.type_id = cases_casetype.id AND
-                cases_case.id = cases_case_assigned_to_teams.case_id AND
-                cases_case.tenant_id = {tenant_id} AND
-                cases_case_assigned_to_teams.team_id = {team_id} AND
-                cases_case.is_deleted = false AND
+        raise NotImplementedError
 
-                /*last week*/
-                cases_case.created BETWEEN  date_trunc( 'week', now() - interval '1 week' ) AND
-                date_trunc( 'week', now() - interval '1 week' )+ interval '1 week' - interval '1 second'
-            GROUP BY
-                cases_casetype.name;
-        '''.format(
-            tenant_id=request.user.tenant_id,
-            team_id=int(kwargs['team_id']),
-        )
 
+class CasesTotalCountLastWeek(StatsView):
 
-class CasesWithTagsLastWeek(RawDatabaseView):
-    def get_query(self, request, *args, **kwargs):
-        return '''
-            SELECT
-                count(DISTINCT(cases_case.id)),
-                date_trunc( 'week', now() - interval '1 week' ) as start,
-                (date_trunc( 'week', now() - interval '1 week' ) + interval '1 week' - interval '1 second') as end
-            FROM
-                cases_case,
-                cases_casestatus,
-                cases_casetype,
-                cases_case_assigned_to_teams,
-                tags_tag
-            WHERE
-                cases_case.status_id = cases_casestatus.id AND
-                cases_case.type_id = cases_casetype.id AND
-                cases_case.id = cases_case_assigned_to_teams.case_id AND
-                cases_case.id = tags_tag.object_id AND
-                tags_tag.name != '' AND
-                tags_tag.tenant_id = {tenant_id} AND
-                cases_case_assigned_to_teams.team_id = {team_id} AND
-                cases_case.is_deleted = false AND
+    def get_results(self, request, *args, **kwargs):
+        start, end = get_last_week()
+        count = get_rollups(
+            request.user.tenant_id, DailyRollup.CASES_CREATED, start, end, int(kwargs['team_id'])
+        ).aggregate(total=Sum('count'))['total']
+
+        return self.parse_results([{'count': count or 0}])
 
-                /*last week*/
-                cases_case.created BETWEEN date_trunc( 'week', now() - interval '1 week' ) AND
-                date_trunc( 'week', now() - interval '1 week' )+ interval '1 week' - interval '1 second';
-        '''.format(
-            tenant_id=request.user.tenant_id,
-            team_id=int(kwargs['team_id']),
-        )
+
+class CasesPerTypeCountLastWeek(StatsView):
+
+    def get_results(self, request, *args, **kwargs):
+        start, end = get_last_week()
+        week_start = get_day_range(start)[0]
+        rollups = get_rollups(
+            request.user.tenant_id, DailyRollup.CASES_CREATED, start, end, int(kwargs['team_id'])
+        ).values('group').annotate(total=Sum('count')).order_by('group')
+
+        return self.parse_results([{
+            'count': rollup['total'],
+            'name': rollup['group'],
+            'from': week_start,
+            'to': week_start + timedelta(weeks=1, seconds=-1),
+            'weeknr': float(start.isocalendar()[1]),
+        } for rollup in rollups])
+
+
+class CasesWithTagsLastWeek(StatsView):
+
+    def get_results(self, request, *args, **kwargs):
+        start, end = get_last_week()
+        week_start = get_day_range(start)[0]
+        count = get_rollups(
+            request.user.tenant_id, DailyRollup.CASES_WITH_TAGS, start, end, int(kwargs['team_id'])
+        ).aggregate(total=Sum('count'))['total']
+
+        return self.parse_results([{
+            'count': count or 0,
+            'start': week_start,
+            'end': week_start + timedelta(weeks=1, seconds=-1),
+        }])
 
 
 class CasesCountPerStatus(RawDatabaseView):
@@ -171,42 +189,15 @@ class CasesCountPerStatus(RawDatabaseView):
         )
 
 
-class CasesTopTags(RawDatabaseView):
-    def get_query(self, request, *args, **kwargs):
-        return '''
-            SELECT
-                count(tags_tag.name), tags_tag.name
-            FROM
-                cases_case,
-                cases_casestatus,
-                cases_casetype,
-                cases_case_assigned_to_teams,
-                tags_tag
-            WHERE
-                cases_case.status_id = cases_casestatus.id AND
-                cases_case.type_id = cases_casetype.id AND
-                cases_case.id = cases_case_assigned_to_teams.case_id AND
-                cases_case.id = tags_tag.object_id AND
-                tags_tag.name <> '' AND
-                tags_tag.tenant_id = {tenant_id} AND
-                cases_case.is_deleted = false AND
-                cases_case.created BETWEEN date_trunc('month', now()- interval '1 month') AND
-                date_trunc('month', now()) - interval '1 second' AND
-                cases_case_assigned_to_teams.team_id = {team_id} AND
-                cases_casetype.name != 'Config' AND
-                cases_casetype.name != 'Retour' AND
-                cases_casetype.name != 'Callback'
-            GROUP BY
-                tags_tag.name
-            HAVING
-                COUNT (tags_tag.name) > 2
-            ORDER BY
-                count(tags_tag.name) desc
-            LIMIT 15;
-          '''.format(
-            tenant_id=request.user.tenant_id,
-            team_id=int(kwargs['team_id']),
-        )
+class CasesTopTags(StatsView):
+
+    def get_results(self, request, *args, **kwargs):
+        start, end = get_last_month()
+        rollups = get_rollups(
+            request.user.tenant_id, DailyRollup.CASE_TAGS, start, end, int(kwargs['team_id'])
+        ).values('group').annotate(total=Sum('count')).filter(total__gt=2).order_by('-total', 'group')[:15]
+
+        return self.parse_results([{'count': rollup['total'], 'name': rollup['group']} for rollup in rollups])
 
 
 class DealsUrgentFollowUp(RawDatabaseView):
@@ -242,101 +233,66 @@ class DealsUrgentFollowUp(RawDatabaseView):
         )
 
 
-class DealsWon(RawDatabaseView):
-    def get_query(self, request, *args, **kwargs):
-        try:
-            deal_status = DealStatus.objects.get(name='Won')
-        except DealStatus.DoesNotExist:
-            return ''
+class DealRollupsView(StatsView):
+    """
+    Stats widget of the number and recurring amount of the deals closed by each user in the last 30 days.
+    """
+    metric = None
+    new_business = True
+
+    def get_results(self, request, *args, **kwargs):
+        today = get_day(timezone.now())
+        rollups = get_rollups(
+            request.user.tenant_id, self.metric, today - timedelta(days=30), today + timedelta(days=1)
+        ).filter(
+            group=str(self.new_business),
+        ).values('user__last_name').annotate(
+            total_count=Sum('count'),
+            total_amount=Sum('amount'),
+        ).order_by('user__last_name')
+
+        return self.parse_results([
+            self.get_row(rollup['user__last_name'], rollup['total_count'], rollup['total_amount'])
+            for rollup in rollups
+        ])
+
+    def get_row(self, last_name, count, amount):
+        raise NotImplementedError
 
-        return '''
-            SELECT
-                users_lilyuser.last_name,
-                count(deals_deal.id) as NrOfDealsWon,
-                sum(deals_deal.amount_recurring) as TotalAmountDealsWon,
-                ROUND(sum(deals_deal.amount_recurring)/count(deals_deal.id),2) as AvgPerDealWon
-            FROM
-                public.users_lilyuser,
-                public.deals_deal
-            WHERE
-                deals_deal.assigned_to_id = users_lilyuser.id AND
-                deals_deal.closed_date > now() - interval '30 days month' AND
-                deals_deal.tenant_id = {tenant_id} AND
-                deals_deal.is_deleted = false AND
-                deals_deal.new_business = true AND
-                deals_deal.status_id = {status_id}
-            GROUP BY
-                users_lilyuser.last_name
-            ORDER BY
-                users_lilyuser.last_name;
-        '''.format(
-            tenant_id=request.user.tenant_id,
-            status_id=deal_status.pk
-        )
 
+class DealsWon(DealRollupsView):
+    metric = DailyRollup.DEALS_WON
 
-class DealsLost(RawDatabaseView):
-    def get_query(self, request, *args, **kwargs):
-        try:
-            deal_status = DealStatus.objects.get(name='Lost')
-        except DealStatus.DoesNotExist:
-            return ''
+    def get_row(self, last_name, count, amount):
+        return {
+            'last_name': last_name,
+            'nrofdealswon': count,
+            'totalamountdealswon': amount,
+            'avgperdealwon': get_average(amount, count),
+        }
 
-        return '''
-            SELECT
-                users_lilyuser.last_name,
-                count(deals_deal.id) as NrOfNotWonDeals,
-                sum(deals_deal.amount_recurring) as TotalAmountNotWonDeals,
-                ROUND(sum(deals_deal.amount_recurring)/count(deals_deal.id),2) as AvgPerNotWonDeal
-            FROM
-                public.users_lilyuser,
-                public.deals_deal
-            WHERE
-                deals_deal.assigned_to_id = users_lilyuser.id AND
-                deals_deal.closed_date > now() - interval '30 days month' AND
-                deals_deal.tenant_id = {tenant_id} AND
-                deals_deal.status_id = {status_id} AND
-                deals_deal.is_deleted = false AND
-                deals_deal.new_business = true
-            GROUP BY
-                users_lilyuser.last_name,deals_deal.new_business
-            ORDER BY
-                users_lilyuser.last_name;
-        '''.format(
-            tenant_id=request.user.tenant_id,
-            status_id=deal_status.pk
-        )
 
+class DealsLost(DealRollupsView):
+    metric = DailyRollup.DEALS_LOST
 
-class DealsAmountRecurring(RawDatabaseView):
-    def get_query(self, request, *args, **kwargs):
-        try:
-            deal_status = DealStatus.objects.get(name='Won')
-        except DealStatus.DoesNotExist:
-            return ''
+    def get_row(self, last_name, count, amount):
+        return {
+            'last_name': last_name,
+            'nrofnotwondeals': count,
+            'totalamountnotwondeals': amount,
+            'avgpernotwondeal': get_average(amount, count),
+        }
 
-        return '''
-            SELECT
-                users_lilyuser.last_name,
-                count(deals_deal.id) as NrOfWonDeals,
-                sum(deals_deal.amount_recurring) as TotalAmountWonDeals,
-                ROUND(sum(deals_deal.amount_recurring)/count(deals_deal.id),2) as AvgPerWonDeal,
-                deals_deal.new_business
-            FROM
-                public.users_lilyuser,
-                public.deals_deal
-            WHERE
-                deals_deal.assigned_to_id = users_lilyuser.id AND
-                deals_deal.closed_date > now() - interval '30 days month' AND
-                deals_deal.is_deleted = false AND
-                deals_deal.tenant_id = {tenant_id} AND
-                deals_deal.new_business = false AND
-                deals_deal.status_id = {status_id}
-            GROUP BY
-                users_lilyuser.last_name,deals_deal.new_business
-            ORDER BY
-                users_lilyuser.last_name,deals_deal.new_business;
-        '''.format(
-            tenant_id=request.user.tenant_id,
-            status_id=deal_status.pk
-        )
+
+class DealsAmountRecurring(DealRollupsView):
+    metric = DailyRollup.DEALS_WON
+    new_business = False
+
+    def get_row(self, last_name, count, amount):
+        return {
+            'last_name': last_name,
+            'nrofwondeals': count,
+            'totalamountwondeals': amount,
+            'avgperwondeal': get_average(amount, count),
+            'new_business': self.new_business,
+        }
@@ -8,7 +8,9 @@ from oauth2client.client import OAuth2Credentials
 
 from decimal import Decimal
 from django.contrib.auth.models import AnonymousUser, Group
+from django.db import connection
 from django.db.models import Manager, Model
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient, APITestCase
@@ -454,6 +456,39 @@ class GenericAPITestCase(CompareObjectsMixin, UserBasedTest, APITestCase):
         self.assertEqual(request.data, {u'detail': u'Not found.'})
 
 
+class ListQueryCountMixin(object):
+    """
+    Mixin for API tests of lists that fetch their related objects with a constant number of queries.
+
+    Subclasses create an object with all the nested relations the serializer renders in _create_list_object.
+    """
+    def _create_list_object(self, tenant):
+        raise NotImplementedError
+
+    def _get_list_query_count(self, page_size):
+        with CaptureQueriesContext(connection) as queries:
+            request = self.user.get('%s&%s' % (self.get_url(self.list_url), urlencode({'page_size': page_size})))
+
+        self.assertStatus(request, status.HTTP_200_OK)
+        self.assertEqual(len(request.data.get('results')), page_size)
+
+        return len(queries)
+
+    def test_list_query_count(self):
+        """
+        Test that the number of queries of the list doesn't depend on the page size.
+        """
+        set_current_user(self.user_obj)
+
+        for iteration in range(0, 7):
+            self._create_list_object(self.user_obj.tenant)
+
+        # The first request fills the caches, e.g. of the content types.
+        self._get_list_query_count(1)
+
+        self.assertEqual(self._get_list_query_count(2), self._get_list_query_count(7))
+
+
 def get_dummy_credentials():
     access_token = 'foo'
     client_id = 'some_client_id'
@@ -2,10 +2,13 @@ import json
 
 from mock import patch
 from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
 
 from lily.billing.models import Billing
 from lily.tenant.middleware import set_current_user
 from lily.tests.utils import GenericAPITestCase
+from lily.users import auth_cache
 from lily.users.api.serializers import LilyUserSerializer
 from lily.users.factories import LilyUserFactory
 from lily.users.models import LilyUser
@@ -109,3 +112,25 @@ class LilyUserTests(GenericAPITestCase):
         request = self.user.delete(self.get_url(self.detail_url, kwargs={'pk': db_obj.pk}))
         self.assertStatus(request, status.HTTP_204_NO_CONTENT)
         self.assertFalse(self.model_cls.objects.get(pk=db_obj.pk).is_active)
+
+    def test_token_cached(self):
+        """
+        Test that the token of an API request is cached until its user is deactivated.
+        """
+        user = LilyUserFactory(tenant=self.user_obj.tenant, is_active=True)
+        token = Token.objects.create(user=user)
+        key = auth_cache.get_key(token.key)
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token %s' % token.key)
+
+        request = client.get(self.get_url(self.list_url))
+        self.assertStatus(request, status.HTTP_200_OK)
+        self.assertEqual(auth_cache.cache.get(key), token)
+
+        user.is_active = False
+        user.save()
+        self.assertIsNone(auth_cache.cache.get(key))
+
+        request = client.get(self.get_url(self.list_url))
+        self.assertStatus(request, status.HTTP_403_FORBIDDEN)
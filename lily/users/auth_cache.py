@@ -0,0 +1,53 @@
+"""
+Cache of the API tokens, so token authenticated requests don't query the user, tenant and plan of the token.
+
+The cached token has its user, tenant, billing and plan loaded, which is everything authentication, the tier check
+and the tenant filters need. Entries are removed by the signals in lily.users.models whenever any of those change.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authtoken.models import Token
+
+API_TOKEN_KEY = 'api_token_%s'
+
+
+def get_key(token_key):
+    return API_TOKEN_KEY % token_key
+
+
+def get_token(token_key):
+    """
+    Return the token with the given key, or None if it doesn't exist.
+    """
+    key = get_key(token_key)
+    token = cache.get(key)
+
+    if token is None:
+        try:
+            token = Token.objects.select_related('user__tenant__billing__plan').get(key=token_key)
+        except Token.DoesNotExist:
+            return None
+
+        cache.set(key, token, settings.API_TOKEN_CACHE_TIMEOUT)
+
+    return token
+
+
+def invalidate(token_keys):
+    token_keys = list(token_keys)
+    if token_keys:
+        cache.delete_many([get_key(token_key) for token_key in token_keys])
+
+
+def invalidate_user(user_id):
+    """
+    Remove the cached token of a user, e.g. when the user is deactivated.
+    """
+    invalidate(Token.objects.filter(user_id=user_id).values_list('key', flat=True))
+
+
+def invalidate_tenant(tenant_id):
+    """
+    Remove the cached tokens of the users of a tenant, e.g. when the plan of the tenant changed.
+    """
+    invalidate(Token.objects.filter(user__tenant_id=tenant_id).values_list('key', flat=True))
@@ -8,15 +8,20 @@ from django.contrib.auth.models import UserManager, AbstractBaseUser, Permission
 from django.contrib.auth.signals import user_logged_out
 from django.core.mail import send_mail
 from django.db import models
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
+from rest_framework.authtoken.models import Token
 from timezone_field import TimeZoneField
 
+from lily.billing.models import Billing, Plan
 from lily.socialmedia.models import SocialMedia
 from lily.tenant.models import TenantMixin, Tenant
 from lily.utils.models.models import Webhook
 
+from . import auth_cache
+
 
 class LilyUserManager(UserManager):
 
@@ -76,6 +81,10 @@ class Team(TenantMixin):
         return self.name
 
     def active_users(self):
+        # Prefetched with Prefetch('user_set', queryset=..., to_attr='prefetched_active_users').
+        if hasattr(self, 'prefetched_active_users'):
+            return self.prefetched_active_users
+
         return self.user_set.filter(is_active=True)
 
     class Meta:
@@ -271,3 +280,34 @@ def logged_out_callback(sender, **kwargs):
     if not settings.DEBUG:
         request = kwargs['request']
         messages.info(request, _('You are now logged out.'))
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def token_changed(sender, instance, **kwargs):
+    auth_cache.invalidate([instance.key])
+
+
+@receiver(post_save, sender=LilyUser)
+@receiver(post_delete, sender=LilyUser)
+def user_changed(sender, instance, **kwargs):
+    # The user might have been deactivated.
+    auth_cache.invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=Tenant)
+def tenant_changed(sender, instance, **kwargs):
+    auth_cache.invalidate_tenant(instance.pk)
+
+
+@receiver(post_save, sender=Billing)
+def billing_changed(sender, instance, **kwargs):
+    # The plan might have changed, e.g. by check_subscriptions.
+    for tenant_id in instance.tenant_set.values_list('pk', flat=True):
+        auth_cache.invalidate_tenant(tenant_id)
+
+
+@receiver(post_save, sender=Plan)
+def plan_changed(sender, instance, **kwargs):
+    for tenant_id in Tenant.objects.filter(billing__plan=instance).values_list('pk', flat=True):
+        auth_cache.invalidate_tenant(tenant_id)
@@ -133,6 +133,7 @@ class RelatedExternalAppLinkSerializer(RelatedSerializerMixin, ExternalAppLinkSe
 
 class WebhookSerializer(serializers.ModelSerializer):
     url = serializers.CharField(required=True, max_length=255, validators=[HostnameValidator()])
+    average_latency = serializers.ReadOnlyField()
 
     class Meta:
         model = Webhook
@@ -140,7 +141,14 @@ class WebhookSerializer(serializers.ModelSerializer):
             'id',
             'url',
             'name',
+            'batch_events',
+            'delivered_count',
+            'failed_count',
+            'average_latency',
+            'last_delivered',
+            'last_error',
         )
+        read_only_fields = ('delivered_count', 'failed_count', 'last_delivered', 'last_error', )
 
 
 class RelatedWebhookSerializer(RelatedSerializerMixin, WebhookSerializer):
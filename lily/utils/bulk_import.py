@@ -0,0 +1,267 @@
+import logging
+import operator
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Model, Q
+
+from lily.search import phone_number_index
+from lily.search.indexing import bulk_update_in_index, index_queue
+from lily.search.scan_search import ModelMappings
+
+logger = logging.getLogger(__name__)
+
+
+def reserve_pks(model, count):
+    """
+    Reserve primary keys from the sequence of the table of the model.
+
+    bulk_create doesn't set the primary keys (on Django 1.8), so they're assigned up front instead.
+    """
+    cursor = connection.cursor()
+    cursor.execute(
+        'SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+        [model._meta.db_table, model._meta.pk.column, count]
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def read_chunks(rows, chunk_size):
+    """
+    Split an iterable of rows in lists of at most chunk_size rows.
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def normalize_value(value):
+    """
+    Make a field value comparable to what's read from the database.
+    """
+    if isinstance(value, Model):
+        return value.pk
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return value
+
+
+class BulkImporter(object):
+    """
+    Import rows in chunks with a fixed number of queries per chunk.
+
+    The import function given to `run` is called for every chunk and uses `create`, `get_or_create` and `add_m2m`
+    to write the objects of the whole chunk at once. Bulk writes don't send signals, so the objects of search mappings
+    are queued for indexing and the linked phone numbers are invalidated in the phone number index after every chunk
+    instead.
+
+    With skip_errors, a chunk that fails is imported again one row at a time, so only the rows that fail are skipped.
+    """
+    def __init__(self, chunk_size=None, stdout=None, skip_errors=False):
+        self.chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+        self.stdout = stdout
+        self.skip_errors = skip_errors
+        self.skipped = 0
+        self.changed = defaultdict(set)
+        self.phone_numbers = defaultdict(set)
+        self.rows = 0
+        self.start_time = None
+
+    def run(self, rows, import_chunk):
+        """
+        Import the rows, every chunk in its own transaction.
+
+        Args:
+            rows (iterable): the rows to import, e.g. a csv reader
+            import_chunk (function): called with every list of rows
+        """
+        self.start_time = time.time()
+        index_queue.defer()
+
+        try:
+            for chunk in read_chunks(rows, self.chunk_size):
+                try:
+                    with transaction.atomic():
+                        import_chunk(chunk)
+                except Exception:
+                    if not self.skip_errors:
+                        raise
+
+                    logger.exception('Could not import chunk, importing its rows one by one')
+                    # The objects of the chunk were rolled back.
+                    self.changed = defaultdict(set)
+                    self.import_rows(chunk, import_chunk)
+
+                self.rows += len(chunk)
+                self.queue_changed()
+                self.report()
+        finally:
+            index_queue.release()
+
+    def import_rows(self, rows, import_chunk):
+        """
+        Import the rows one at a time, every row in its own transaction, and skip the rows that fail.
+        """
+        for row in rows:
+            changed = dict((model, set(pks)) for model, pks in self.changed.items())
+            try:
+                with transaction.atomic():
+                    import_chunk([row])
+            except Exception:
+                logger.exception('Could not import row, skipping it: %s', row)
+                self.changed = defaultdict(set, changed)
+                self.skipped += 1
+
+    def report(self):
+        if self.stdout:
+            elapsed = max(time.time() - self.start_time, 0.001)
+            self.stdout.write('Imported %s rows (%.0f rows/sec)' % (self.rows, self.rows / elapsed))
+
+    def mark_changed(self, objects):
+        """
+        Remember the objects of search mappings for indexing.
+        """
+        for obj in objects:
+            if type(obj) in ModelMappings.model_to_mappings:
+                self.changed[type(obj)].add(obj.pk)
+
+    def queue_changed(self):
+        for model, pks in self.changed.items():
+            bulk_update_in_index(ModelMappings.model_to_mappings[model], pks)
+        self.changed = defaultdict(set)
+
+        # Numbers of rows that were rolled back are invalidated too, which does no harm.
+        for tenant_id, numbers in self.phone_numbers.items():
+            phone_number_index.invalidate(tenant_id, numbers)
+        self.phone_numbers = defaultdict(set)
+
+    def create(self, model, objects):
+        """
+        Bulk create the objects, with their primary keys set.
+
+        Returns:
+            list: the created objects
+        """
+        if not objects:
+            return []
+
+        for obj, pk in zip(objects, reserve_pks(model, len(objects))):
+            obj.pk = pk
+
+        model.objects.bulk_create(objects)
+        self.mark_changed(objects)
+
+        return objects
+
+    def get_or_create(self, model, lookups, defaults=None):
+        """
+        Bulk version of get_or_create, the existing objects are fetched with a single query.
+
+        Args:
+            model (Model): the model of the objects
+            lookups (list): dicts with the field values identifying every object
+            defaults (list): dicts with extra field values for new objects, in the order of the lookups
+
+        Returns:
+            list: the objects, in the order of the lookups
+        """
+        if not lookups:
+            return []
+
+        def get_key(lookup):
+            return tuple(sorted((field, normalize_value(value)) for field, value in lookup.items()))
+
+        unique_lookups = {}
+        for lookup in lookups:
+            unique_lookups.setdefault(get_key(lookup), lookup)
+
+        attnames = dict((field.name, field.attname) for field in model._meta.concrete_fields)
+        objects = {}
+        keys = unique_lookups.keys()
+        for i in range(0, len(keys), self.chunk_size):
+            batch = keys[i:i + self.chunk_size]
+            field_sets = set(tuple(field for field, value in key) for key in batch)
+            query = reduce(operator.or_, [Q(**unique_lookups[key]) for key in batch])
+
+            for obj in model.objects.filter(query).order_by('pk'):
+                for fields in field_sets:
+                    key = tuple((field, normalize_value(getattr(obj, attnames[field]))) for field in fields)
+                    if key in unique_lookups and key not in objects:
+                        objects[key] = obj
+
+        new_objects = []
+        for index, lookup in enumerate(lookups):
+            key = get_key(lookup)
+            if key not in objects:
+                values = dict(lookup)
+                if defaults:
+                    values.update(defaults[index])
+                objects[key] = model(**values)
+                new_objects.append(objects[key])
+
+        self.create(model, new_objects)
+        self.mark_changed(objects.values())
+
+        return [objects[get_key(lookup)] for lookup in lookups]
+
+    def add_m2m(self, model, field_name, pairs):
+        """
+        Bulk version of adding objects to a many to many relation, existing relations are skipped.
+
+        Args:
+            model (Model): the model with the many to many field
+            field_name (str): the name of the many to many field
+            pairs (list): (instance of model, related object) tuples
+        """
+        if not pairs:
+            return
+
+        field = model._meta.get_field(field_name)
+        through = field.rel.through
+        source, target = field.m2m_column_name(), field.m2m_reverse_name()
+
+        rows = set((obj.pk, related.pk) for obj, related in pairs)
+        existing = set(through.objects.filter(
+            **{'%s__in' % source: set(source_pk for source_pk, target_pk in rows)}
+        ).values_list(source, target))
+
+        through.objects.bulk_create([
+            through(**{source: source_pk, target: target_pk}) for source_pk, target_pk in rows - existing
+        ])
+        self.mark_changed(obj for obj, related in pairs)
+
+        if phone_number_index.get_model_name(field.rel.to) == 'utils.phonenumber':
+            for obj, related in pairs:
+                if (obj.pk, related.pk) not in existing:
+                    self.phone_numbers[obj.tenant_id].add(related.number)
+
+    def get_m2m(self, model, field_name, objects):
+        """
+        Fetch the related objects of a many to many relation for multiple objects at once.
+
+        Returns:
+            dict: the pk of every object with a list of its related objects
+        """
+        field = model._meta.get_field(field_name)
+        through = field.rel.through
+        source, target = field.m2m_column_name(), field.m2m_reverse_name()
+
+        rows = list(through.objects.filter(
+            **{'%s__in' % source: set(obj.pk for obj in objects)}
+        ).values_list(source, target))
+        related_objects = field.rel.to.objects.in_bulk(set(target_pk for source_pk, target_pk in rows))
+
+        related = defaultdict(list)
+        for source_pk, target_pk in rows:
+            if target_pk in related_objects:
+                related[source_pk].append(related_objects[target_pk])
+
+        return related
@@ -0,0 +1,139 @@
+"""
+Export jobs, which write exports that are too large to stream in a request to storage in a task.
+"""
+import os
+import uuid
+from datetime import datetime, timedelta
+from tempfile import TemporaryFile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.http import HttpRequest, QueryDict
+from django.utils.module_loading import import_string
+
+from lily.tenant.middleware import set_current_user
+
+PENDING, DONE, FAILED = 'pending', 'done', 'failed'
+
+EXPORT_JOB_KEY = 'export_job_%s'
+# Directory of the export files, the part of EXPORT_UPLOAD_TO before the tenant.
+EXPORT_DIR = settings.EXPORT_UPLOAD_TO.split('%')[0].rstrip('/')
+
+
+def get_job_key(job_id):
+    return EXPORT_JOB_KEY % job_id
+
+
+def start_export_job(view_class, user, query_string, file_name):
+    """
+    Start a task that writes the export of the view to storage.
+
+    Args:
+        view_class (class): view with the ExportListViewMixin
+        user (LilyUser): user that requested the export
+        query_string (str): query string of the export request, with the columns and filter
+        file_name (str): name of the exported file
+
+    Returns:
+        str: id of the job, see get_export_job
+    """
+    from .tasks import export_list
+
+    job_id = uuid.uuid4().hex
+    cache.set(get_job_key(job_id), {'status': PENDING, 'user': user.pk}, settings.EXPORT_JOB_TIMEOUT)
+
+    view_path = '%s.%s' % (view_class.__module__, view_class.__name__)
+    export_list.delay(job_id, view_path, user.pk, query_string, file_name)
+
+    return job_id
+
+
+def get_export_job(job_id, user):
+    """
+    Return the status of an export job of the user, or None if there's no such job.
+    """
+    job = cache.get(get_job_key(job_id))
+
+    if job is None or job['user'] != user.pk:
+        return None
+
+    return job
+
+
+def run_export_job(job_id, view_path, user_id, query_string, file_name):
+    """
+    Write the export of a view to storage, as if the user requested it.
+    """
+    from lily.users.models import LilyUser
+
+    key = get_job_key(job_id)
+    user = LilyUser.objects.get(pk=user_id)
+
+    request = HttpRequest()
+    request.method = 'GET'
+    request.user = user
+    request.GET = QueryDict(query_string)
+
+    view = import_string(view_path)()
+    view.request = request
+    view.args = ()
+    view.kwargs = {}
+
+    # Querysets are filtered on the tenant of the current user.
+    set_current_user(user)
+    try:
+        with TemporaryFile() as export_file:
+            for row in view.write_rows(export_file):
+                pass
+
+            export_file.seek(0)
+            name = default_storage.save(settings.EXPORT_UPLOAD_TO % {
+                'tenant_id': user.tenant_id,
+                'job_id': job_id,
+                'filename': file_name,
+            }, File(export_file))
+    except Exception:
+        cache.set(key, {'status': FAILED, 'user': user_id}, settings.EXPORT_JOB_TIMEOUT)
+        raise
+    finally:
+        set_current_user(None)
+
+    cache.set(key, {'status': DONE, 'user': user_id, 'name': name}, settings.EXPORT_JOB_TIMEOUT)
+
+    return name
+
+
+def delete_expired_exports():
+    """
+    Delete the export files that are older than their job, nothing links to them anymore.
+
+    Returns:
+        int: the number of deleted files
+    """
+    # Don't check if the directory exists, S3 has no directories and only knows the files in it.
+    try:
+        tenant_dirs = default_storage.listdir(EXPORT_DIR)[0]
+    except OSError:
+        # The directory of a file system storage is only created with the first export.
+        return 0
+
+    # The storage returns naive local times.
+    expired = datetime.now() - timedelta(seconds=settings.EXPORT_JOB_TIMEOUT)
+    deleted = 0
+
+    for tenant_dir in tenant_dirs:
+        tenant_path = os.path.join(EXPORT_DIR, tenant_dir)
+
+        for job_dir in default_storage.listdir(tenant_path)[0]:
+            job_path = os.path.join(tenant_path, job_dir)
+
+            for file_name in default_storage.listdir(job_path)[1]:
+                name = os.path.join(job_path, file_name)
+
+                if default_storage.modified_time(name) < expired:
+                    default_storage.delete(name)
+                    deleted += 1
+
+    return deleted
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 from lily.tenant.models import TenantMixin
@@ -145,9 +146,46 @@ class Webhook(TenantMixin):
     """
     url = models.URLField(max_length=255)
     name = models.CharField(max_length=255, null=True, blank=True)
+    # Post a list of pending events per request, instead of a single event.
+    batch_events = models.BooleanField(default=False)
+    # Delivery metrics.
+    request_count = models.PositiveIntegerField(default=0)  # Number of successful requests.
+    delivered_count = models.PositiveIntegerField(default=0)  # Number of delivered events.
+    failed_count = models.PositiveIntegerField(default=0)  # Number of failed requests.
+    total_latency = models.BigIntegerField(default=0)  # Total duration of the successful requests in milliseconds.
+    last_delivered = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(default='', blank=True)
 
     def __unicode__(self):
         return self.name
 
+    @property
+    def average_latency(self):
+        """
+        Return the average duration of successful requests in milliseconds.
+        """
+        if self.request_count:
+            return self.total_latency / self.request_count
+
+    class Meta:
+        app_label = 'utils'
+
+
+class WebhookEvent(models.Model):
+    """
+    An event which still has to be posted to a webhook.
+    """
+    webhook = models.ForeignKey(Webhook, related_name='events')
+    payload = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True)
+    # Set when the event couldn't be delivered within the maximum number of attempts.
+    failed = models.BooleanField(default=False)
+
+    def __unicode__(self):
+        return u'%s: %s' % (self.webhook, self.created)
+
     class Meta:
         app_label = 'utils'
+        ordering = ['pk']
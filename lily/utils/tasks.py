@@ -2,6 +2,7 @@ import logging
 
 from celery.task import task
 from django.core.management import call_command
+from django.utils import timezone
 
 
 logger = logging.getLogger(__name__)
@@ -19,9 +20,68 @@ def import_sugar_csv(model, path, tenant, sugar_import):
         call_command('sugarcsvimport', model, path, tenant, sugar_import, verbosity=0)
 
 
+@task(name='export_list', logger=logger)
+def export_list(job_id, view_path, user_id, query_string, file_name):
+    """
+    Write an export that's too large to stream in a request to storage, see lily.utils.exports.
+    """
+    from .exports import run_export_job
+
+    name = run_export_job(job_id, view_path, user_id, query_string, file_name)
+    logger.info('Export job %s written to %s', job_id, name)
+
+
+@task(name='delete_expired_exports_scheduler', logger=logger)
+def delete_expired_exports_scheduler():
+    """
+    Delete the files of export jobs that expired, see lily.utils.exports.
+    """
+    from .exports import delete_expired_exports
+
+    deleted = delete_expired_exports()
+    logger.info('Deleted %s expired export files', deleted)
+
+
 @task(name='clear_sessions_scheduler')
 def clear_sessions_scheduler():
     """
     Call the Django provided management command to clear expired sessions.
     """
     call_command('clearsessions', interactive=False)
+
+
+@task(name='deliver_webhook_events', logger=logger)
+def deliver_webhook_events(webhook_id):
+    """
+    Post the pending events of a webhook, unless the endpoint already has the maximum concurrent deliveries.
+    """
+    from .models.models import Webhook
+    from .webhooks import acquire_delivery_slot, deliver_events, release_delivery_slot
+
+    slot = acquire_delivery_slot(webhook_id)
+    if not slot:
+        # The deliveries in progress continue with the new events, or else the next periodic delivery does.
+        return
+
+    try:
+        webhook = Webhook.objects.filter(pk=webhook_id).first()
+        if webhook:
+            deliver_events(webhook)
+    finally:
+        release_delivery_slot(slot)
+
+
+@task(name='deliver_pending_webhook_events', logger=logger)
+def deliver_pending_webhook_events():
+    """
+    Start the delivery of events that are due, e.g. events of which the delivery should be retried.
+    """
+    from .models.models import WebhookEvent
+
+    webhook_ids = WebhookEvent.objects.filter(
+        failed=False,
+        next_attempt__lte=timezone.now(),
+    ).order_by().values_list('webhook_id', flat=True).distinct()
+
+    for webhook_id in webhook_ids:
+        deliver_webhook_events.delay(webhook_id)
@@ -0,0 +1,208 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.test import RequestFactory, TestCase
+from django.views.generic import View
+from mock import patch
+import requests
+
+from lily.accounts.factories import AccountFactory
+from lily.accounts.models import Account
+from lily.tenant.factories import TenantFactory
+from lily.utils.models.models import PhoneNumber, Webhook, WebhookEvent
+from .bulk_import import BulkImporter
+from .exports import delete_expired_exports
+from .views.mixins import ExportListViewMixin
+from .webhooks import deliver_events, record_webhook_event
+
+
+class BulkImporterTests(TestCase):
+    def test_get_or_create(self):
+        """
+        Test that existing objects are reused and missing objects are created with their pks set.
+        """
+        tenant = TenantFactory.create()
+        existing = PhoneNumber.objects.create(tenant=tenant, type='work', number='+31612345678')
+        importer = BulkImporter(chunk_size=10)
+
+        phone_numbers = importer.get_or_create(PhoneNumber, [
+            {'tenant': tenant, 'type': 'work', 'number': '+31612345678'},
+            {'tenant': tenant, 'type': 'mobile', 'number': '+31687654321'},
+            {'tenant': tenant, 'type': 'mobile', 'number': '+31687654321'},
+        ])
+
+        self.assertEqual(phone_numbers[0].pk, existing.pk)
+        self.assertIsNotNone(phone_numbers[1].pk)
+        self.assertEqual(phone_numbers[1].pk, phone_numbers[2].pk)
+        self.assertEqual(PhoneNumber.objects.filter(tenant=tenant).count(), 2)
+
+    def test_add_m2m(self):
+        """
+        Test that many to many relations are added once.
+        """
+        tenant = TenantFactory.create()
+        account = AccountFactory.create(tenant=tenant)
+        phone_number = account.phone_numbers.first()
+        new_phone_number = PhoneNumber.objects.create(tenant=tenant, type='work', number='+31612345678')
+        importer = BulkImporter()
+
+        importer.add_m2m(Account, 'phone_numbers', [
+            (account, phone_number),
+            (account, new_phone_number),
+            (account, new_phone_number),
+        ])
+
+        self.assertEqual(set(account.phone_numbers.values_list('pk', flat=True)),
+                         set([phone_number.pk, new_phone_number.pk]))
+        self.assertEqual(importer.changed[Account], set([account.pk]))
+        self.assertEqual(importer.phone_numbers, {tenant.pk: set([new_phone_number.number])})
+
+    def test_add_m2m_phone_number_index(self):
+        """
+        Test that the phone number index entries of linked numbers are invalidated after the chunk.
+        """
+        tenant = TenantFactory.create()
+        account = AccountFactory.create(tenant=tenant)
+        phone_number = PhoneNumber.objects.create(tenant=tenant, type='work', number='+31612345678')
+        importer = BulkImporter()
+
+        with patch('lily.utils.bulk_import.phone_number_index.invalidate') as invalidate_mock:
+            importer.run([None], lambda rows: importer.add_m2m(Account, 'phone_numbers', [(account, phone_number)]))
+
+        invalidate_mock.assert_called_once_with(tenant.pk, set([phone_number.number]))
+
+
+class WebhookDeliveryTests(TestCase):
+    def setUp(self):
+        self.webhook = Webhook.objects.create(tenant=TenantFactory.create(), url='https://example.com/hook')
+
+    @patch('lily.utils.webhooks.session')
+    def test_deliver_events_batched(self, session_mock):
+        """
+        Test that pending events are posted in a single request and removed afterwards.
+        """
+        self.webhook.batch_events = True
+        self.webhook.save()
+
+        record_webhook_event(self.webhook, {'event': 'create'})
+        record_webhook_event(self.webhook, {'event': 'update'})
+
+        self.assertEqual(deliver_events(self.webhook), 2)
+        self.assertEqual(session_mock.post.call_count, 1)
+        self.assertEqual(session_mock.post.call_args[1]['data'], '[{"event": "create"},{"event": "update"}]')
+        self.assertFalse(WebhookEvent.objects.exists())
+
+        webhook = Webhook.objects.get(pk=self.webhook.pk)
+        self.assertEqual(webhook.request_count, 1)
+        self.assertEqual(webhook.delivered_count, 2)
+
+    @patch('lily.utils.webhooks.session')
+    def test_deliver_events_failed(self, session_mock):
+        """
+        Test that events are kept for a later attempt when the endpoint fails.
+        """
+        session_mock.post.side_effect = requests.ConnectionError('Connection refused')
+        event = record_webhook_event(self.webhook, {'event': 'create'})
+
+        self.assertEqual(deliver_events(self.webhook), 0)
+
+        event.refresh_from_db()
+        self.assertEqual(event.attempts, 1)
+        self.assertFalse(event.failed)
+        self.assertGreater(event.next_attempt, event.created)
+        self.assertEqual(Webhook.objects.get(pk=self.webhook.pk).failed_count, 1)
+
+
+class ExportNameView(ExportListViewMixin, View):
+    exportable_columns = {
+        'name': {
+            'headers': ['Name'],
+            'columns_for_item': ['name'],
+        },
+    }
+
+    def get_items(self):
+        return iter([{'name': 'First'}, {'name': 'Second'}])
+
+    def value_for_column(self, item, column):
+        return item[column]
+
+
+class ExportListViewMixinTests(TestCase):
+    def test_stream_rows(self):
+        """
+        Test that the export is streamed one row at a time.
+        """
+        response = ExportNameView.as_view()(RequestFactory().get('/export/'))
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(list(response.streaming_content), ['Name\r\n', 'First\r\n', 'Second\r\n'])
+
+    @patch('lily.utils.exports.start_export_job', return_value='abc123')
+    def test_export_job(self, start_export_job_mock):
+        """
+        Test that an export job is started when asked for.
+        """
+        request = RequestFactory().get('/export/', {'async': 1})
+        request.user = None
+
+        response = ExportNameView.as_view()(request)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(start_export_job_mock.call_args[0][0], ExportNameView)
+
+    def test_delete_expired_exports(self):
+        """
+        Test that only the export files that are older than their job are deleted.
+        """
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        storage = FileSystemStorage(location=location)
+
+        old_name = storage.save('exports/1/old/export_list.csv', ContentFile('old'))
+        new_name = storage.save('exports/1/new/export_list.csv', ContentFile('new'))
+        old_time = time.time() - 2 * 24 * 60 * 60
+        os.utime(storage.path(old_name), (old_time, old_time))
+
+        with self.settings(EXPORT_JOB_TIMEOUT=24 * 60 * 60), patch('lily.utils.exports.default_storage', storage):
+            self.assertEqual(delete_expired_exports(), 1)
+
+        self.assertFalse(storage.exists(old_name))
+        self.assertTrue(storage.exists(new_name))
+
+    def test_delete_expired_exports_without_directories(self):
+        """
+        Test that export files are deleted from a storage without directories, like S3.
+        """
+        class PrefixStorage(FileSystemStorage):
+            def exists(self, name):
+                return os.path.isfile(self.path(name))
+
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        storage = PrefixStorage(location=location)
+
+        name = storage.save('exports/1/old/export_list.csv', ContentFile('old'))
+        old_time = time.time() - 2 * 24 * 60 * 60
+        os.utime(storage.path(name), (old_time, old_time))
+
+        self.assertFalse(storage.exists('exports'))
+
+        with self.settings(EXPORT_JOB_TIMEOUT=24 * 60 * 60), patch('lily.utils.exports.default_storage', storage):
+            self.assertEqual(delete_expired_exports(), 1)
+
+        self.assertFalse(storage.exists(name))
+
+    def test_delete_expired_exports_without_exports(self):
+        """
+        Test that nothing is deleted before the first export.
+        """
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+
+        with patch('lily.utils.exports.default_storage', FileSystemStorage(location=location)):
+            self.assertEqual(delete_expired_exports(), 0)
@@ -8,7 +8,7 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ImproperlyConfigured
 from django.db.models import Q, FieldDoesNotExist
 from django.forms.models import modelformset_factory
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils.http import base36_to_int
 import unicodecsv
@@ -95,6 +95,9 @@ class ExportListViewMixin(FilterQuerysetMixin):
     If `export_columns` in request.POST, only these will be exported.
     If `export_filter` in request.POST, object_list will be searched.
 
+    The csv is streamed while the items are fetched. With `async` in request.GET the csv is written to storage by a
+    task instead.
+
     Attributes:
         exportable_columns (dict): List with info on the columns to be exported. Should look like:
             exportable_columns = {
@@ -129,13 +132,10 @@ class ExportListViewMixin(FilterQuerysetMixin):
     def value_for_column(self, item, column):
         return ''
 
-    def get(self, request, *args, **kwargs):
-        """
-        """
-        # Setup headers, columns and search
+    def get_headers_and_columns(self):
         headers = []
         columns = []
-        export_columns = request.GET.getlist('export_columns', None)
+        export_columns = self.request.GET.getlist('export_columns', None)
         if export_columns:
             # Always insert id
             export_columns.insert(0, 'id')
@@ -151,16 +151,20 @@ class ExportListViewMixin(FilterQuerysetMixin):
                 headers.extend(value.get('headers', []))
                 columns.extend(value.get('columns_for_item', []))
 
-        # Setup response type.
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="%s"' % self.file_name
+        return [unicode(header) for header in headers], columns
 
-        # Setup writer.
-        writer = unicodecsv.writer(response)
+    def write_rows(self, fp):
+        """
+        Write the export to a file like object, one row at a time.
 
-        # Add headers to response.
-        headers = [unicode(header) for header in headers]
-        writer.writerow(headers)
+        Yields:
+            The result of every write, so the rows can be streamed.
+        """
+        headers, columns = self.get_headers_and_columns()
+        writer = unicodecsv.writer(fp)
+
+        # Add headers.
+        yield writer.writerow(headers)
 
         # For each item, make a row to export.
         for item in self.get_items():
@@ -169,10 +173,42 @@ class ExportListViewMixin(FilterQuerysetMixin):
                 # Get the value from the item.
                 value = self.value_for_column(item, column)
                 row.append(value)
-            # Add complete row to response.
-            writer.writerow(row)
+            yield writer.writerow(row)
+
+    def get(self, request, *args, **kwargs):
+        """
+        Stream the export as csv, or start an export job when asked for.
+        """
+        if request.GET.get('async'):
+            return self.start_export_job()
+
+        # The writer returns the written row to the response instead of writing it to a file.
+        response = StreamingHttpResponse(self.write_rows(Echo()), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="%s"' % self.file_name
+
         return response
 
+    def start_export_job(self):
+        """
+        Write the export to storage in a task, see lily.utils.exports.
+        """
+        from ..exports import start_export_job
+
+        job_id = start_export_job(self.__class__, self.request.user, self.request.GET.urlencode(), self.file_name)
+
+        return HttpResponse(anyjson.serialize({
+            'job': job_id,
+            'status_url': reverse('export_job_status', kwargs={'job_id': job_id}),
+        }), content_type='application/json', status=202)
+
+
+class Echo(object):
+    """
+    File like object that returns what is written, to stream the output of a writer.
+    """
+    def write(self, value):
+        return value
+
 
 class FilteredListByTagMixin(object):
     """
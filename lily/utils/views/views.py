@@ -19,6 +19,7 @@ from lily.messaging.email.models.models import EmailAccount, EmailAttachment
 from lily.users.models import LilyUser
 from lily.utils.models.models import PhoneNumber
 from lily.utils.functions import has_required_tier
+from ..exports import DONE, get_export_job
 from ..forms import SugarCsvImportForm
 from ..tasks import import_sugar_csv
 from .mixins import LoginRequiredMixin
@@ -310,3 +311,23 @@ class DownloadRedirectView(LoginRequiredMixin, RedirectView):
         self.instance = get_object_or_404(self.mapping[self.model_name]['model_cls'], pk=self.object_id)
 
         return super(DownloadRedirectView, self).get(request, *args, **kwargs)
+
+
+class ExportJobStatusView(LoginRequiredMixin, View):
+    """
+    Return the status of an export job, with a download url once the export is written.
+    """
+    http_method_names = ['get']
+
+    def get(self, request, *args, **kwargs):
+        job = get_export_job(kwargs['job_id'], request.user)
+
+        if job is None:
+            raise Http404()
+
+        data = {'status': job['status']}
+
+        if job['status'] == DONE:
+            data['url'] = default_storage.url(job['name'])  # Let the storage backend generate an url for us.
+
+        return HttpResponse(json.dumps(data), content_type='application/json')
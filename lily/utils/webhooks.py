@@ -0,0 +1,148 @@
+import json
+import logging
+import time
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from lily.utils.models.models import Webhook, WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+# Seconds a delivery slot of an endpoint is kept when the worker holding it doesn't release it.
+DELIVERY_SLOT_TIMEOUT = 5 * 60
+
+# A single session per worker process, so connections to the same endpoint are reused.
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=20, pool_maxsize=20))
+session.mount('https://', HTTPAdapter(pool_connections=20, pool_maxsize=20))
+
+
+def record_webhook_event(webhook, data):
+    """
+    Store an event for delivery to the webhook.
+
+    Call this in the transaction of the change, so the event is only stored when the change is committed.
+    """
+    return WebhookEvent.objects.create(
+        webhook=webhook,
+        payload=json.dumps(data, sort_keys=True, default=lambda x: str(x)),
+    )
+
+
+def acquire_delivery_slot(webhook_id):
+    """
+    Claim one of the WEBHOOK_CONCURRENCY delivery slots of a webhook.
+
+    Returns:
+        str: the cache key of the slot, or None if all slots are taken
+    """
+    for slot in range(settings.WEBHOOK_CONCURRENCY):
+        key = 'webhook_delivery_%s_%s' % (webhook_id, slot)
+        if cache.add(key, True, DELIVERY_SLOT_TIMEOUT):
+            return key
+
+    return None
+
+
+def release_delivery_slot(key):
+    cache.delete(key)
+
+
+def claim_events(webhook, count):
+    """
+    Claim due events of a webhook, so they aren't delivered by another worker at the same time.
+
+    The events are claimed by moving their next attempt past the request timeout with a single update.
+
+    Returns:
+        list: the claimed events
+    """
+    now = timezone.now()
+    event_ids = list(WebhookEvent.objects.filter(
+        webhook=webhook,
+        failed=False,
+        next_attempt__lte=now,
+    ).values_list('pk', flat=True)[:count])
+
+    if not event_ids:
+        return []
+
+    # The claim time identifies the events claimed by this worker.
+    claimed_until = now + timedelta(seconds=settings.WEBHOOK_TIMEOUT * 3)
+    WebhookEvent.objects.filter(pk__in=event_ids, next_attempt__lte=now).update(next_attempt=claimed_until)
+
+    return list(WebhookEvent.objects.filter(pk__in=event_ids, next_attempt=claimed_until))
+
+
+def deliver_events(webhook):
+    """
+    Post the due events of a webhook until there are none left or a request fails.
+
+    Returns:
+        int: the number of delivered events
+    """
+    batch_size = settings.WEBHOOK_BATCH_SIZE if webhook.batch_events else 1
+    delivered = 0
+
+    while True:
+        events = claim_events(webhook, batch_size)
+        if not events:
+            break
+
+        if webhook.batch_events:
+            data = '[%s]' % ','.join(event.payload for event in events)
+        else:
+            data = events[0].payload
+
+        start_time = time.time()
+        try:
+            response = session.post(
+                webhook.url,
+                data=data,
+                headers={'Content-Type': 'application/json'},
+                timeout=settings.WEBHOOK_TIMEOUT,
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logger.warning('Failed to deliver %s events to webhook %s: %s', len(events), webhook.pk, e)
+            handle_failed_delivery(webhook, events, e)
+            # Don't hammer an endpoint that's failing, the events are retried later.
+            break
+
+        latency = int((time.time() - start_time) * 1000)
+        WebhookEvent.objects.filter(pk__in=[event.pk for event in events]).delete()
+        Webhook.objects.filter(pk=webhook.pk).update(
+            request_count=F('request_count') + 1,
+            delivered_count=F('delivered_count') + len(events),
+            total_latency=F('total_latency') + latency,
+            last_delivered=timezone.now(),
+        )
+        delivered += len(events)
+
+    return delivered
+
+
+def handle_failed_delivery(webhook, events, error):
+    """
+    Schedule the next attempt of the events with exponential backoff, or give up on them.
+    """
+    now = timezone.now()
+    for event in events:
+        event.attempts += 1
+        if event.attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+            logger.error('Giving up on delivering event %s to webhook %s', event.pk, webhook.pk)
+            event.failed = True
+        else:
+            event.next_attempt = now + timedelta(seconds=settings.WEBHOOK_RETRY_DELAY * 2 ** (event.attempts - 1))
+        event.save(update_fields=['attempts', 'next_attempt', 'failed'])
+
+    Webhook.objects.filter(pk=webhook.pk).update(
+        failed_count=F('failed_count') + 1,
+        last_error=unicode(error)[:1000],
+    )